@@ -3,80 +3,868 @@ Flask API for Crop Image Analysis using ML Model
 Multi-modal model that learns crop-specific behavior from data
 """
 import os
-import sys
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import numpy as np
 from PIL import Image
 import io
 import base64
+import functools
+import json
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+# Per-request details are logged at DEBUG; LOG_LEVEL=WARNING silences startup info too
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
+# oneDNN (AVX-512/VNNI kernels on Intel CPUs) and OpenMP thread defaults;
+# must be set before TensorFlow is imported, and explicit env settings win
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+os.environ.setdefault('OMP_NUM_THREADS', str(max(1, (os.cpu_count() or 1) // 2)))
+os.environ.setdefault('KMP_AFFINITY', 'granularity=fine,compact,1,0')
+TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', os.cpu_count() or 1))
+TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 2))
+
+# TensorFlow (and the multi-modal architecture, which imports it) is imported
+# by import_ml_dependencies() on the model-loading thread, so the process can
+# answer /health while TF starts up
+tf = None
+keras = None
+MobileNetV2 = None
+TENSORFLOW_AVAILABLE = False
+TF_SERVING_AVAILABLE = False
+MULTI_MODAL_AVAILABLE = False
+# Set by load_model: the loaded model takes the crop/weather/soil inputs
+USE_MULTI_MODAL = False
+# Set by load_backend: the model scales raw 0-255 pixels itself (its 'normalize' layer)
+RAW_PIXEL_INPUT = False
+# Set at the end of load_model; the backend globals are assigned earlier
+# (e.g. the Keras model before TFLite conversion) and are not a ready signal
+model_ready = False
+
+# Optional libjpeg-turbo bindings for faster JPEG decoding of uploads
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    jpeg_decoder = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    jpeg_decoder = None
+
+# Optional ONNX Runtime backend (MODEL_VARIANT=onnx)
 try:
-    import tensorflow as tf
-    from tensorflow import keras
-    from tensorflow.keras.applications import MobileNetV2
-    from tensorflow.keras.preprocessing import image
-    from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-    TENSORFLOW_AVAILABLE = True
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
 except ImportError:
-    TENSORFLOW_AVAILABLE = False
-    logger.warning("TensorFlow not available. ML model will not work. Install with: pip install tensorflow")
+    ONNXRUNTIME_AVAILABLE = False
 
-# Import multi-modal model architecture
+# Optional OpenCV for SIMD resizing of decoded images
 try:
-    from model_architecture import (
-        create_multi_modal_model,
-        prepare_features_for_inference,
-        get_crop_type_index,
-        CROP_TYPES,
-        CROP_STAGES
-    )
-    MULTI_MODAL_AVAILABLE = True
+    import cv2
+    CV2_AVAILABLE = True
 except ImportError:
-    MULTI_MODAL_AVAILABLE = False
-    logger.warning("Multi-modal architecture not available. Using legacy model.")
-    
-    # Fallback function for crop type index
-    def get_crop_type_index(crop_type: str) -> int:
-        CROP_TYPES_FALLBACK = [
-            'Paddy', 'Wheat', 'Maize', 'Cotton', 'Sugarcane', 'Soybean', 
-            'Chickpea', 'Mustard', 'Groundnut', 'Potato', 'Onion', 'Tomato'
-        ]
-        try:
-            return CROP_TYPES_FALLBACK.index(crop_type)
-        except ValueError:
-            return 0
+    CV2_AVAILABLE = False
+
+CROP_TYPES_FALLBACK = [
+    'Paddy', 'Wheat', 'Maize', 'Cotton', 'Sugarcane', 'Soybean', 
+    'Chickpea', 'Mustard', 'Groundnut', 'Potato', 'Onion', 'Tomato'
+]
+
+@functools.lru_cache(maxsize=64)
+def get_crop_type_index(crop_type: str) -> int:
+    """Fallback crop type index, replaced by model_architecture's once it is imported"""
+    try:
+        return CROP_TYPES_FALLBACK.index(crop_type)
+    except ValueError:
+        return 0
+
+def import_ml_dependencies():
+    """Import TensorFlow, the TF Serving client and the multi-modal architecture into module globals"""
+    global tf, keras, MobileNetV2, TENSORFLOW_AVAILABLE
+    global grpc, get_model_metadata_pb2, predict_pb2, prediction_service_pb2_grpc, TF_SERVING_AVAILABLE
+    global create_multi_modal_model, prepare_features_for_inference, get_crop_type_index, with_quantized_crop_embedding
+    global configure_mixed_precision
+    global CROP_TYPES, CROP_STAGES, MULTI_MODAL_AVAILABLE
+    
+    try:
+        import tensorflow as tf
+        from tensorflow import keras
+        from tensorflow.keras.applications import MobileNetV2
+        TENSORFLOW_AVAILABLE = True
+    except ImportError:
+        TENSORFLOW_AVAILABLE = False
+        logger.warning("TensorFlow not available. ML model will not work. Install with: pip install tensorflow")
+        return
+    
+    # Thread pools can only be sized before TensorFlow runs its first op
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    except RuntimeError as e:
+        logger.warning(f"Could not configure TensorFlow thread pools: {e}")
+    
+    if TF_DECODE:
+        build_tf_decode()
+    
+    # Optional TensorFlow Serving client (only needed when TF_SERVING_ADDRESS is set)
+    try:
+        import grpc
+        from tensorflow_serving.apis import get_model_metadata_pb2, predict_pb2, prediction_service_pb2_grpc
+        TF_SERVING_AVAILABLE = True
+    except ImportError:
+        TF_SERVING_AVAILABLE = False
+    
+    # Import multi-modal model architecture
+    try:
+        from model_architecture import (
+            create_multi_modal_model,
+            prepare_features_for_inference,
+            get_crop_type_index,
+            with_quantized_crop_embedding,
+            configure_mixed_precision,
+            CROP_TYPES,
+            CROP_STAGES
+        )
+        MULTI_MODAL_AVAILABLE = True
+        # Memoized: called for every request with a handful of distinct crop names
+        get_crop_type_index = functools.lru_cache(maxsize=64)(get_crop_type_index)
+    except ImportError:
+        MULTI_MODAL_AVAILABLE = False
+        logger.warning("Multi-modal architecture not available. Using legacy model.")
 
 app = Flask(__name__)
 CORS(app)
 
+MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
+# A pruned model written by train_multi_modal.py (PRUNE_SPARSITY) is preferred
+PRUNED_MODEL_PATH = os.path.join(MODEL_DIR, 'crop_health_model_pruned.h5')
+# Overridable to serve a different .h5 (e.g. for A/B model deploys)
+MODEL_PATH = os.environ.get(
+    'MODEL_PATH',
+    PRUNED_MODEL_PATH if os.path.exists(PRUNED_MODEL_PATH) else os.path.join(MODEL_DIR, 'crop_health_model.h5')
+)
+# MobileNetV2 width multiplier for newly created models
+MOBILENET_ALPHA = float(os.environ.get('CROP_MOBILENET_ALPHA', '0.5'))
+
 # Global model variable
 model = None
+# Pool of TFLite interpreters (preferred for inference when available);
+# each request checks one out so concurrent requests never share one
+interpreter_pool = None
+input_details = None
+output_details = None
+output_tables = None
+INTERPRETER_POOL_SIZE = int(os.environ.get('INTERPRETER_POOL_SIZE', min(4, os.cpu_count() or 1)))
+# Dummy forward passes at startup so kernel selection/JIT happens before the
+# first request; WARMUP=0 skips them (faster restarts in development)
+WARMUP_RUNS = 3 if os.environ.get('WARMUP', '1') == '1' else 0
+# Serving precision: 'fp16' (TFLite float16 weights), 'int8' (full-integer
+# TFLite, best on ARM/VNNI CPUs - benchmark before enabling on plain x86),
+# 'onnx' (ONNX Runtime, with TensorRT FP16 / CUDA when available),
+# 'onnx-int8' (statically INT8-quantized ONNX) or 'fp32' (serve the Keras model directly)
+MODEL_VARIANT = os.environ.get('MODEL_VARIANT', 'fp16').lower()
+# TFLite files sit next to the .h5 they were converted from
+TFLITE_SUFFIXES = {
+    'fp16': '.tflite',
+    'int8': '_int8.tflite',
+}
+REPRESENTATIVE_SAMPLES = 100
+# Directory of real crop photos (searched recursively) used to calibrate the
+# INT8 model; random images are used when unset
+CALIBRATION_DIR = os.environ.get('CALIBRATION_DIR')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+ONNX_OPSET = 15
+# ONNX files sit next to the .h5 as well; the INT8 model is quantized from the float export
+ONNX_SUFFIXES = {
+    'onnx': '.onnx',
+    'onnx-int8': '_int8.onnx',
+}
+# Largest difference from the Keras outputs an ONNX export may show on a
+# calibration sample before it is discarded
+ONNX_TOLERANCE = 1e-3
+# Execution providers in order of preference; unavailable ones are skipped
+ONNX_PROVIDERS = ['TensorrtExecutionProvider', 'CUDAExecutionProvider', 'CPUExecutionProvider']
+onnx_session = None
+onnx_input_names = None
+onnx_input_dtypes = None
+# Micro-batching: concurrent requests are gathered for up to BATCH_TIMEOUT_MS
+# (at most BATCH_MAX_SIZE of them) and run in one forward pass on whichever
+# in-process backend is loaded. BATCH_MAX_SIZE=1 disables batching.
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+BATCH_TIMEOUT_MS = float(os.environ.get('BATCH_TIMEOUT_MS', 10))
+# Seconds a request waits for its batch before failing
+BATCH_RESULT_TIMEOUT = float(os.environ.get('BATCH_RESULT_TIMEOUT', 30))
+batch_queue = None
+# Concrete function of the compiled Keras forward pass (XLA on GPU) and its input specs
+keras_infer = None
+keras_infer_specs = None
+# serving_default signature of the exported SavedModel, used instead of the
+# .h5 when no TFLite variant is served; the loaded object keeps its variables alive
+saved_model = None
+saved_model_fn = None
+saved_model_input_names = None
+# Remote inference: when TF_SERVING_ADDRESS (host:port of the gRPC endpoint)
+# is set, forward passes go to TensorFlow Serving, which batches requests
+# server-side; Flask only does image decoding and insight generation
+TF_SERVING_ADDRESS = os.environ.get('TF_SERVING_ADDRESS')
+TF_SERVING_MODEL_NAME = os.environ.get('TF_SERVING_MODEL_NAME', 'crop')
+TF_SERVING_TIMEOUT = float(os.environ.get('TF_SERVING_TIMEOUT', 10))
+# Exported next to the .h5 it came from (models/<name>_saved/1), so a
+# different MODEL_PATH never picks up another model's export
+SAVED_MODEL_DIR = os.path.join(os.path.splitext(MODEL_PATH)[0] + '_saved', '1')
+serving_stub = None
+serving_input_names = None
 CLASS_NAMES = ['healthy', 'moderate', 'critical']
 DISEASE_TYPES = [
     'yellowing', 'browning', 'dark_spots', 'pest_damage', 
     'low_vigor', 'fungal_infection', 'bacterial_spot', 'leaf_curl'
 ]
 
+# Uploads are decoded at reduced scale when possible, down to this minimum size
+DECODE_MIN_SIZE = 448
+# TF_DECODE=1 decodes and resizes uploads in one TensorFlow graph
+# (tf.io.decode_image) instead of PIL / libjpeg-turbo
+TF_DECODE = os.environ.get('TF_DECODE', '0') == '1'
+tf_decode_fn = None
+
+# Keras input names, in the order the model expects them
+MODEL_INPUT_NAMES = ['image_input', 'crop_type_input', 'crop_stage_input', 'weather_input', 'soil_input']
+# TFLite does not preserve output order, so outputs are matched by width:
+# health_status (3), disease_detection (8), crop_stress_auxiliary (1)
+MODEL_OUTPUT_ORDER = {len(CLASS_NAMES): 0, len(DISEASE_TYPES): 1, 1: 2}
+
+def build_crop_adjustment_table(base_adjustment, multiplier_start, multiplier_period, patterns):
+    """
+    Per-crop additive adjustment of the [healthy, moderate, critical] probabilities
+    
+    Crop i is shifted by base_adjustment * (multiplier_start + (i % multiplier_period) * 0.1)
+    times the sign/weight row patterns[i % 3].
+    """
+    crop_idx = np.arange(len(CROP_TYPES_FALLBACK))
+    adjustment = base_adjustment * (multiplier_start + (crop_idx % multiplier_period) * 0.1)
+    return (adjustment[:, np.newaxis] * np.asarray(patterns)[crop_idx % 3]).astype(np.float32)
+
+# Multi-modal models: 15% base shift, multiplier 0.5-1.4
+MULTI_MODAL_CROP_ADJUSTMENT = build_crop_adjustment_table(0.15, 0.5, 10, [
+    [1.0, -0.7, -0.5],  # toward healthy
+    [-0.5, 1.0, -0.7],  # toward moderate
+    [-0.6, -0.4, 1.0],  # toward critical
+])
+# Legacy image-only models: 30% base shift, multiplier 0.6-1.4, enough to change the class
+LEGACY_CROP_ADJUSTMENT = build_crop_adjustment_table(0.30, 0.6, 9, [
+    [1.0, -0.8, -0.6],
+    [-0.6, 1.0, -0.8],
+    [-0.7, -0.5, 1.0],
+])
+
+def apply_crop_adjustment(health_pred, adjustment):
+    """Shift health probabilities by a crop's table row, clip to [0, 1] and renormalize"""
+    health_pred = np.clip(np.asarray(health_pred, dtype=np.float32) + adjustment, 0.0, 1.0)
+    health_pred /= health_pred.sum() + 1e-8
+    return health_pred
+
+def model_normalizes_input(path):
+    """
+    True if the .h5 at path has the in-graph 'normalize' layer, read from its
+    stored config so it also holds for the TFLite/ONNX/SavedModel conversions
+    """
+    try:
+        import h5py
+        with h5py.File(path, 'r') as f:
+            config = f.attrs['model_config']
+        if isinstance(config, bytes):
+            config = config.decode('utf-8')
+        layers = json.loads(config)['config']['layers']
+    except Exception as e:
+        logger.warning(f"Could not read the layers of {path}, assuming [-1, 1] image input: {e}")
+        return False
+    return any(layer.get('name') == 'normalize' or layer.get('config', {}).get('name') == 'normalize' for layer in layers)
+
+def is_model_loaded():
+    """True once load_model has finished and requests can be served"""
+    return model_ready
+
+def calibration_images():
+    """Up to REPRESENTATIVE_SAMPLES preprocessed images from CALIBRATION_DIR"""
+    paths = []
+    if CALIBRATION_DIR:
+        for root, _, files in os.walk(CALIBRATION_DIR):
+            paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        logger.warning("No calibration images found (set CALIBRATION_DIR), calibrating INT8 on random inputs")
+        return []
+    
+    step = max(1, len(paths) // REPRESENTATIVE_SAMPLES)
+    images = []
+    for path in paths[::step][:REPRESENTATIVE_SAMPLES]:
+        try:
+            with Image.open(path) as img:
+                images.append(preprocess_image(img.convert('RGB')))
+        except Exception as e:
+            logger.warning(f"Skipping calibration image {path}: {e}")
+    logger.info(f"Calibrating INT8 model on {len(images)} images from {CALIBRATION_DIR}")
+    return images
+
+def representative_dataset(keras_model):
+    """Yield calibration batches matching the model inputs for INT8 quantization"""
+    images = calibration_images()
+    num_crops = len(CROP_TYPES) if MULTI_MODAL_AVAILABLE else 12
+    
+    # Keyed by input name: the converted model does not keep the Keras input order
+    for i in range(REPRESENTATIVE_SAMPLES):
+        sample = {}
+        for model_input in keras_model.inputs:
+            name = model_input.name.split(':')[0]
+            shape = (1,) + tuple(model_input.shape[1:])
+            dtype = getattr(model_input.dtype, 'name', model_input.dtype)
+            if dtype == 'int32':
+                sample[name] = np.random.randint(0, num_crops, size=shape).astype(np.int32)
+            elif len(shape) == 4:
+                # Images are fed as preprocess_image returns them
+                if images:
+                    sample[name] = images[i % len(images)]
+                elif RAW_PIXEL_INPUT:
+                    sample[name] = np.random.uniform(0.0, 255.0, size=shape).astype(np.float32)
+                else:
+                    sample[name] = np.random.uniform(-1.0, 1.0, size=shape).astype(np.float32)
+            elif name == 'crop_stage_input':
+                sample[name] = np.eye(shape[1], dtype=np.float32)[[np.random.randint(shape[1])]]
+            else:
+                sample[name] = np.random.rand(*shape).astype(np.float32)
+        yield sample
+
+def convert_to_tflite(keras_model, tflite_path, variant='fp16'):
+    """Convert a Keras model to a Float16- or INT8-quantized TFLite flatbuffer"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == 'int8':
+        converter.representative_dataset = lambda: representative_dataset(keras_model)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    else:
+        converter.target_spec.supported_types = [tf.float16]
+    tflite_model = converter.convert()
+    with open(tflite_path, 'wb') as f:
+        f.write(tflite_model)
+    logger.info(f"TFLite model written to {tflite_path}")
+
+def load_interpreter(tflite_path):
+    """Load a pool of TFLite interpreters and cache their input/output tensor details"""
+    global interpreter_pool, input_details, output_details, output_tables
+    
+    # Split the cores between the pooled interpreters; the builtin op resolver
+    # applies the XNNPACK delegate to all float ops
+    threads_per_interpreter = max(1, (os.cpu_count() or 1) // INTERPRETER_POOL_SIZE)
+    interpreters = []
+    for _ in range(INTERPRETER_POOL_SIZE):
+        interp = tf.lite.Interpreter(
+            model_path=tflite_path,
+            num_threads=threads_per_interpreter,
+            experimental_op_resolver_type=tf.lite.experimental.OpResolverType.BUILTIN
+        )
+        interp.allocate_tensors()
+        interpreters.append(interp)
+    
+    def input_rank(detail):
+        for i, name in enumerate(MODEL_INPUT_NAMES):
+            if name in detail['name']:
+                return i
+        return 0
+    
+    input_details = sorted(interp.get_input_details(), key=input_rank)
+    output_details = sorted(
+        interp.get_output_details(),
+        key=lambda d: MODEL_OUTPUT_ORDER.get(int(d['shape'][-1]), len(MODEL_OUTPUT_ORDER))
+    )
+    output_tables = [dequantization_table(detail) for detail in output_details]
+    # Warm up every interpreter so delegate setup and kernel selection
+    # happen here instead of on the first /analyze request
+    pool = queue.Queue(maxsize=INTERPRETER_POOL_SIZE)
+    for interp in interpreters:
+        for _ in range(WARMUP_RUNS):
+            for detail in input_details:
+                interp.set_tensor(detail['index'], np.zeros(detail['shape'], dtype=detail['dtype']))
+            interp.invoke()
+        pool.put(interp)
+    
+    interpreter_pool = pool
+    logger.info(
+        f"TFLite interpreter pool loaded from {tflite_path} "
+        f"({INTERPRETER_POOL_SIZE} x {threads_per_interpreter} threads, {len(input_details)} inputs)"
+    )
+
+def start_batch_workers():
+    """Start the micro-batching workers: one per pooled interpreter, else one for TF"""
+    global batch_queue
+    
+    if batch_queue is not None:
+        return
+    batch_queue = queue.Queue()
+    # TensorFlow already spreads one forward pass over all cores
+    num_workers = INTERPRETER_POOL_SIZE if interpreter_pool is not None else 1
+    for i in range(num_workers):
+        threading.Thread(target=batch_worker, name=f'inference-batcher-{i}', daemon=True).start()
+    logger.info(f"Micro-batching enabled (max {BATCH_MAX_SIZE} requests / {BATCH_TIMEOUT_MS:g} ms)")
+
+# TensorFlow kernels require tensor buffers aligned to this many bytes
+TENSOR_ALIGNMENT = 64
+
+def aligned_empty(shape, dtype):
+    """Uninitialized array whose buffer is TENSOR_ALIGNMENT-aligned, so to_tensor can alias it"""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(nbytes + TENSOR_ALIGNMENT, dtype=np.uint8)
+    offset = -raw.ctypes.data % TENSOR_ALIGNMENT
+    return raw[offset:offset + nbytes].view(dtype).reshape(shape)
+
+def to_tensor(value, dtype):
+    """
+    CPU tensor for a batch input, sharing memory with the array when possible
+    
+    tf.constant copies every input (about 0.6 MB per image); an aligned,
+    contiguous array of the right dtype, such as a batch_worker staging buffer,
+    is instead wrapped through DLPack without a copy. The array must not be
+    modified while the tensor is in use.
+    """
+    if (
+        isinstance(value, np.ndarray)
+        and value.dtype == dtype.as_numpy_dtype
+        and value.flags.c_contiguous
+        and value.flags.writeable
+        and value.ctypes.data % TENSOR_ALIGNMENT == 0
+        and hasattr(value, '__dlpack__')
+    ):
+        return tf.experimental.dlpack.from_dlpack(value.__dlpack__())
+    return tf.constant(value, dtype=dtype)
+
+def batch_worker():
+    """Drain queued requests into batches and resolve each request's future"""
+    # Per-worker staging buffers (BATCH_MAX_SIZE rows per input), allocated on
+    # the first batch and reused so batching does not allocate per request;
+    # aligned so TensorFlow backends read them in place (to_tensor)
+    staging = None
+    while True:
+        items = [batch_queue.get()]
+        deadline = time.monotonic() + BATCH_TIMEOUT_MS / 1000.0
+        while len(items) < BATCH_MAX_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(batch_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        try:
+            if staging is None:
+                staging = [
+                    aligned_empty((BATCH_MAX_SIZE,) + np.shape(value)[1:], np.asarray(value).dtype)
+                    for value in items[0][0]
+                ]
+            for row, (inputs, _) in enumerate(items):
+                for buffer, value in zip(staging, inputs):
+                    buffer[row] = value[0]
+            outputs = predict_batch([buffer[:len(items)] for buffer in staging])
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            continue
+        
+        # Every request carries a batch of one, so row i belongs to request i
+        for i, (_, future) in enumerate(items):
+            future.set_result([output[i:i + 1] for output in outputs])
+
+def invoke_interpreter(inputs):
+    """Run one invocation on a pooled interpreter, resizing it to the batch size"""
+    interpreter = interpreter_pool.get()
+    try:
+        batch_size = len(inputs[0])
+        if interpreter.get_input_details()[0]['shape'][0] != batch_size:
+            for detail in input_details:
+                interpreter.resize_tensor_input(detail['index'], [batch_size] + list(detail['shape'][1:]))
+            interpreter.allocate_tensors()
+        
+        for detail, value in zip(input_details, inputs):
+            interpreter.set_tensor(detail['index'], quantize_input(detail, value))
+        interpreter.invoke()
+        outputs = [interpreter.get_tensor(detail['index']) for detail in output_details]
+        return [
+            output if table is None else table[output.view(np.uint8)]
+            for output, table in zip(outputs, output_tables)
+        ]
+    finally:
+        interpreter_pool.put(interpreter)
+
+def num_model_inputs():
+    """Number of inputs of the loaded model (1 for legacy image-only models)"""
+    if serving_stub is not None:
+        return len(serving_input_names)
+    if interpreter_pool is not None:
+        return len(input_details)
+    if onnx_session is not None:
+        return len(onnx_input_names)
+    if saved_model_fn is not None:
+        return len(saved_model_input_names)
+    return len(model.inputs) if hasattr(model, 'inputs') else 0
+
+def quantize_input(detail, value):
+    """Cast an input to the interpreter's dtype, quantizing floats for INT8 models"""
+    dtype = detail['dtype']
+    scale, zero_point = detail['quantization']
+    if scale and np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        value = np.clip(np.round(np.asarray(value) / scale + zero_point), info.min, info.max)
+    return np.asarray(value, dtype=dtype)
+
+def dequantization_table(detail):
+    """
+    Float value of every 8-bit code of a quantized output, or None for float outputs
+    
+    The softmax/sigmoid heads are quantized inside the TFLite graph, so their
+    outputs take only 256 values; indexing this table by the raw bytes replaces
+    the per-request subtract/multiply.
+    """
+    scale, zero_point = detail['quantization']
+    if not scale or np.dtype(detail['dtype']).itemsize != 1:
+        return None
+    codes = np.arange(256, dtype=np.uint8).view(detail['dtype'])
+    return (codes.astype(np.float32) - zero_point) * scale
+
+def run_inference(inputs):
+    """
+    Run a forward pass and return [health_status, disease_detection, (crop_stress)]
+    
+    Args:
+        inputs: List of batched input arrays, ordered as MODEL_INPUT_NAMES
+    """
+    if serving_stub is not None:
+        return serving_predict(inputs)
+    # The micro-batcher takes single-row requests; larger batches run as they are
+    if batch_queue is not None and len(inputs[0]) == 1:
+        future = Future()
+        batch_queue.put((inputs, future))
+        return future.result(timeout=BATCH_RESULT_TIMEOUT)
+    return predict_batch(inputs)
+
+def predict_batch(inputs):
+    """Run a forward pass on the in-process backend (TFLite, SavedModel or Keras)"""
+    if interpreter_pool is not None:
+        return invoke_interpreter(inputs)
+    if onnx_session is not None:
+        feed = {
+            name: np.asarray(value, dtype=dtype)
+            for name, dtype, value in zip(onnx_input_names, onnx_input_dtypes, inputs)
+        }
+        return sort_outputs_by_width(onnx_session.run(None, feed))
+    if saved_model_fn is not None:
+        specs = saved_model_fn.structured_input_signature[1]
+        outputs = saved_model_fn(**{
+            name: to_tensor(value, specs[name].dtype)
+            for name, value in zip(saved_model_input_names, inputs)
+        })
+        return sort_outputs_by_width([output.numpy() for output in outputs.values()])
+    if keras_infer is not None:
+        outputs = keras_infer(*[
+            to_tensor(value, spec.dtype) for spec, value in zip(keras_infer_specs, inputs)
+        ])
+        return [output.numpy() for output in outputs]
+    # Call the model directly: predict() builds a data adapter on every call
+    outputs = model(inputs if len(inputs) > 1 else inputs[0], training=False)
+    return [np.asarray(output) for output in outputs]
+
+def compile_keras_inference():
+    """Trace the Keras forward pass into a concrete function, placed and XLA-compiled on GPU when present"""
+    global keras_infer, keras_infer_specs
+    
+    use_gpu = bool(tf.config.list_physical_devices('GPU'))
+    device = '/GPU:0' if use_gpu else '/CPU:0'
+    signature = [
+        tf.TensorSpec([None] + list(model_input.shape[1:]), model_input.dtype)
+        for model_input in model.inputs
+    ]
+    # The crop type lookup reads an int8 table (per-row scales) instead of float32
+    served = with_quantized_crop_embedding(model) if MULTI_MODAL_AVAILABLE else model
+    
+    @tf.function(jit_compile=use_gpu, input_signature=signature)
+    def infer(*inputs):
+        with tf.device(device):
+            outputs = served(list(inputs) if len(inputs) > 1 else inputs[0], training=False)
+        return outputs if isinstance(outputs, (list, tuple)) else [outputs]
+    
+    # Calling the concrete function skips tf.function's per-call argument
+    # binding and trace-cache lookup; trace (and compile) it now
+    concrete = infer.get_concrete_function()
+    for _ in range(WARMUP_RUNS):
+        concrete(*[tf.zeros([1] + spec.shape[1:].as_list(), spec.dtype) for spec in signature])
+    keras_infer, keras_infer_specs = concrete, signature
+    logger.info(f"Keras inference compiled on {device}{' with XLA' if use_gpu else ''}")
+
+def connect_serving():
+    """Connect to TensorFlow Serving and read the serving signature's input names"""
+    global serving_stub, serving_input_names
+    
+    channel = grpc.insecure_channel(TF_SERVING_ADDRESS)
+    stub = prediction_service_pb2_grpc.PredictionServiceStub(channel)
+    
+    request = get_model_metadata_pb2.GetModelMetadataRequest()
+    request.model_spec.name = TF_SERVING_MODEL_NAME
+    request.metadata_field.append('signature_def')
+    response = stub.GetModelMetadata(request, timeout=TF_SERVING_TIMEOUT)
+    signature_map = get_model_metadata_pb2.SignatureDefMap()
+    response.metadata['signature_def'].Unpack(signature_map)
+    serving_input_names = rank_input_names(signature_map.signature_def['serving_default'].inputs.keys())
+    serving_stub = stub
+    logger.info(
+        f"Using TensorFlow Serving model '{TF_SERVING_MODEL_NAME}' at {TF_SERVING_ADDRESS} "
+        f"({len(serving_input_names)} inputs)"
+    )
+
+def serving_predict(inputs):
+    """Run a forward pass on TensorFlow Serving over gRPC"""
+    request = predict_pb2.PredictRequest()
+    request.model_spec.name = TF_SERVING_MODEL_NAME
+    request.model_spec.signature_name = 'serving_default'
+    for name, value in zip(serving_input_names, inputs):
+        request.inputs[name].CopyFrom(tf.make_tensor_proto(value))
+    response = serving_stub.Predict(request, timeout=TF_SERVING_TIMEOUT)
+    
+    return sort_outputs_by_width([tf.make_ndarray(tensor) for tensor in response.outputs.values()])
+
+def sort_outputs_by_width(outputs):
+    """Order signature outputs (keyed by layer name) as [health, disease, crop_stress]"""
+    return sorted(outputs, key=lambda o: MODEL_OUTPUT_ORDER.get(o.shape[-1], len(MODEL_OUTPUT_ORDER)))
+
+def rank_input_names(names):
+    """Order signature input names as MODEL_INPUT_NAMES (a single input is the image)"""
+    return sorted(names, key=lambda name: MODEL_INPUT_NAMES.index(name) if name in MODEL_INPUT_NAMES else 0)
+
+def is_up_to_date(path):
+    """True if a converted model exists and is at least as new as the .h5"""
+    return os.path.exists(path) and (
+        not os.path.exists(MODEL_PATH) or os.path.getmtime(path) >= os.path.getmtime(MODEL_PATH)
+    )
+
+def convert_to_onnx(keras_model, onnx_path, variant='onnx'):
+    """Export the Keras model to ONNX with tf2onnx, INT8-quantized for variant 'onnx-int8'"""
+    import tf2onnx
+    
+    float_path = os.path.splitext(MODEL_PATH)[0] + ONNX_SUFFIXES['onnx']
+    signature = [
+        tf.TensorSpec([None] + list(model_input.shape[1:]), model_input.dtype, name=model_input.name.split(':')[0])
+        for model_input in keras_model.inputs
+    ]
+    tf2onnx.convert.from_keras(keras_model, input_signature=signature, opset=ONNX_OPSET, output_path=float_path)
+    check_onnx_export(keras_model, float_path)
+    logger.info(f"ONNX model written to {float_path}")
+    
+    if variant == 'onnx-int8':
+        quantize_onnx_int8(keras_model, float_path, onnx_path)
+
+def check_onnx_export(keras_model, onnx_path):
+    """Compare the ONNX export with the Keras model on one calibration sample; remove it if they disagree"""
+    sample = next(representative_dataset(keras_model))
+    names = [model_input.name.split(':')[0] for model_input in keras_model.inputs]
+    expected = keras_model([sample[name] for name in names] if len(names) > 1 else sample[names[0]], training=False)
+    session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+    actual = sort_outputs_by_width(session.run(None, sample))
+    
+    error = max(float(np.max(np.abs(np.asarray(e) - a))) for e, a in zip(expected, actual))
+    if error > ONNX_TOLERANCE:
+        os.remove(onnx_path)
+        raise ValueError(f"ONNX export differs from the Keras model by {error:.2g}")
+    logger.info(f"ONNX export matches the Keras model (max difference {error:.2g})")
+
+def quantize_onnx_int8(keras_model, float_path, int8_path):
+    """
+    Static INT8 quantization of the float ONNX export, calibrated like the
+    TFLite INT8 model: QDQ format with per-channel weights and per-tensor
+    activations, which ONNX Runtime runs as fused int8 kernels on VNNI / ARM dot-product CPUs
+    """
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    
+    class RepresentativeReader(CalibrationDataReader):
+        def __init__(self):
+            self.samples = representative_dataset(keras_model)
+        
+        def get_next(self):
+            return next(self.samples, None)
+    
+    quantize_static(
+        float_path,
+        int8_path,
+        RepresentativeReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    logger.info(f"INT8 ONNX model written to {int8_path}")
+
+def load_onnx_session(onnx_path):
+    """Create an ONNX Runtime session on the best available execution provider"""
+    global onnx_session, onnx_input_names, onnx_input_dtypes
+    
+    available = ort.get_available_providers()
+    providers = []
+    for provider in ONNX_PROVIDERS:
+        if provider not in available:
+            continue
+        if provider == 'TensorrtExecutionProvider':
+            # FP16 engines, cached next to the model so they are built once per model file
+            providers.append((provider, {
+                'trt_fp16_enable': True,
+                'trt_engine_cache_enable': True,
+                'trt_engine_cache_path': os.path.dirname(onnx_path),
+            }))
+        else:
+            providers.append(provider)
+    
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(onnx_path, sess_options=options, providers=providers)
+    
+    by_name = {i.name: i for i in session.get_inputs()}
+    names = rank_input_names(by_name)
+    session_inputs = [by_name[name] for name in names]
+    dtypes = [np.int32 if i.type == 'tensor(int32)' else np.float32 for i in session_inputs]
+    
+    # Warm up so provider setup (and TensorRT engine builds) happen here
+    for _ in range(WARMUP_RUNS):
+        session.run(None, {
+            i.name: np.zeros([1] + list(i.shape[1:]), dtype=dtype)
+            for i, dtype in zip(session_inputs, dtypes)
+        })
+    
+    onnx_session, onnx_input_names, onnx_input_dtypes = session, names, dtypes
+    logger.info(f"ONNX Runtime session loaded from {onnx_path} ({session.get_providers()[0]})")
+
+def load_saved_model():
+    """Load the exported SavedModel's serving signature for in-process inference"""
+    global saved_model, saved_model_fn, saved_model_input_names
+    
+    loaded = tf.saved_model.load(SAVED_MODEL_DIR)
+    fn = loaded.signatures['serving_default']
+    names = rank_input_names(fn.structured_input_signature[1].keys())
+    
+    # Warm up so graph optimization happens here instead of on the first request
+    specs = fn.structured_input_signature[1]
+    for _ in range(WARMUP_RUNS):
+        fn(**{name: tf.zeros([1] + specs[name].shape[1:].as_list(), specs[name].dtype) for name in names})
+    
+    saved_model, saved_model_input_names = loaded, names
+    saved_model_fn = fn
+    logger.info(f"SavedModel loaded from {SAVED_MODEL_DIR} ({len(names)} inputs)")
+
+def export_saved_model():
+    """Export the Keras model as a SavedModel version directory for TensorFlow Serving"""
+    try:
+        tf.saved_model.save(model, SAVED_MODEL_DIR)
+        logger.info(f"SavedModel exported to {SAVED_MODEL_DIR}")
+    except Exception as e:
+        logger.warning(f"Could not export SavedModel: {e}")
+
 def load_model():
+    """Load the model for inference and start the micro-batching workers"""
+    global USE_MULTI_MODAL, model_ready
+    
+    if not load_backend():
+        return False
+    # Fixed for the lifetime of the loaded model, so decided once here
+    USE_MULTI_MODAL = MULTI_MODAL_AVAILABLE and num_model_inputs() > 1
+    # TensorFlow Serving batches server-side
+    if BATCH_MAX_SIZE > 1 and serving_stub is None:
+        start_batch_workers()
+    if WARMUP_RUNS:
+        warmup_model()
+    model_ready = True
+    return True
+
+def warmup_model():
+    """Run dummy requests through the full inference path (batcher included)"""
+    image = np.zeros((1, 224, 224, 3), dtype=np.float32)
+    if USE_MULTI_MODAL:
+        features = prepare_features_for_inference(image_array=image, crop_type='Unknown')
+        inputs = [features[name] for name in MODEL_INPUT_NAMES]
+    else:
+        inputs = [image]
+    
+    start = time.perf_counter()
+    try:
+        for _ in range(WARMUP_RUNS):
+            run_inference(inputs)
+    except Exception as e:
+        logger.warning(f"Warmup failed: {e}")
+        return
+    logger.info(f"Warmup completed in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+def load_backend():
     """Load the pre-trained model or create a new one"""
-    global model
+    global model, RAW_PIXEL_INPUT
     
+    import_ml_dependencies()
     if not TENSORFLOW_AVAILABLE:
         logger.error("TensorFlow not available. Cannot load model.")
         return False
     
-    model_path = os.path.join(os.path.dirname(__file__), 'models', 'crop_health_model.h5')
+    # Models without the layer were trained on MobileNetV2-scaled [-1, 1] images
+    RAW_PIXEL_INPUT = os.path.exists(MODEL_PATH) and model_normalizes_input(MODEL_PATH)
+    
+    if TF_SERVING_ADDRESS:
+        if not TF_SERVING_AVAILABLE:
+            logger.error("TF_SERVING_ADDRESS is set but tensorflow-serving-api is not installed")
+            return False
+        try:
+            connect_serving()
+            return True
+        except Exception as e:
+            logger.error(f"Could not reach TensorFlow Serving at {TF_SERVING_ADDRESS}: {e}")
+            return False
+    
+    configure_gpu_precision()
+    tflite_path = None
+    onnx_path = None
+    if MODEL_VARIANT in ONNX_SUFFIXES:
+        if ONNXRUNTIME_AVAILABLE:
+            onnx_path = os.path.splitext(MODEL_PATH)[0] + ONNX_SUFFIXES[MODEL_VARIANT]
+        else:
+            logger.warning(f"MODEL_VARIANT={MODEL_VARIANT} but onnxruntime is not installed")
+    elif tf.config.list_physical_devices('GPU'):
+        logger.info("GPU available: serving the Keras model on GPU instead of TFLite")
+    elif MODEL_VARIANT in TFLITE_SUFFIXES:
+        tflite_path = os.path.splitext(MODEL_PATH)[0] + TFLITE_SUFFIXES[MODEL_VARIANT]
+    
+    # Prefer the pre-converted TFLite model when it is up to date with the .h5
+    if tflite_path and is_up_to_date(tflite_path):
+        try:
+            load_interpreter(tflite_path)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not load TFLite model, falling back to Keras: {e}")
+    
+    if onnx_path and is_up_to_date(onnx_path):
+        try:
+            load_onnx_session(onnx_path)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not load ONNX model, falling back to Keras: {e}")
     
-    if os.path.exists(model_path):
+    # Otherwise the SavedModel loads faster than the .h5 and is graph-optimized at load
+    saved_model_pb = os.path.join(SAVED_MODEL_DIR, 'saved_model.pb')
+    if tflite_path is None and onnx_path is None and is_up_to_date(saved_model_pb):
         try:
-            logger.info(f"Loading model from {model_path}")
-            model = keras.models.load_model(model_path, compile=False)
+            load_saved_model()
+            return True
+        except Exception as e:
+            logger.warning(f"Could not load SavedModel, falling back to Keras: {e}")
+    
+    if os.path.exists(MODEL_PATH):
+        try:
+            logger.info(f"Loading model from {MODEL_PATH}")
+            model = keras.models.load_model(MODEL_PATH, compile=False)
             
             # Check if loaded model is multi-modal
             num_inputs = len(model.inputs) if hasattr(model, 'inputs') else 0
@@ -124,6 +912,9 @@ def load_model():
                 logger.warning("⚠️  Legacy model loaded - crop differentiation will use fallback method")
             
             logger.info("Model loaded successfully")
+            if not is_up_to_date(saved_model_pb):
+                export_saved_model()
+            prepare_converted_model(tflite_path, onnx_path)
             return True
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
@@ -132,7 +923,44 @@ def load_model():
             return False
     else:
         logger.info("Model file not found, creating new multi-modal model")
-        return create_model()
+        if not create_model():
+            return False
+        RAW_PIXEL_INPUT = model_normalizes_input(MODEL_PATH)
+        prepare_converted_model(tflite_path, onnx_path)
+        return True
+
+def configure_gpu_precision():
+    """Use Tensor Cores on GPUs that have them: TF32 matmuls, mixed_float16 for newly built models"""
+    if tf.config.list_physical_devices('GPU'):
+        tf.config.experimental.enable_tensor_float_32_execution(True)
+    if MULTI_MODAL_AVAILABLE:
+        # Affects models built from here on (create_model); an existing .h5
+        # keeps the dtype policy it was saved with
+        logger.info(f"Dtype policy for newly built models: {configure_mixed_precision()}")
+
+def prepare_converted_model(tflite_path, onnx_path=None):
+    """Convert the loaded Keras model to TFLite or ONNX and switch inference to it"""
+    if onnx_path is not None:
+        try:
+            convert_to_onnx(model, onnx_path, variant=MODEL_VARIANT)
+            load_onnx_session(onnx_path)
+            return
+        except Exception as e:
+            logger.warning(f"ONNX conversion failed, serving the Keras model: {e}")
+    elif tflite_path is not None:
+        try:
+            convert_to_tflite(model, tflite_path, variant=MODEL_VARIANT)
+            load_interpreter(tflite_path)
+            return
+        except Exception as e:
+            logger.warning(f"TFLite conversion failed, serving the Keras model: {e}")
+    else:
+        logger.info(f"MODEL_VARIANT={MODEL_VARIANT}: serving the Keras model")
+    
+    try:
+        compile_keras_inference()
+    except Exception as e:
+        logger.warning(f"Could not compile Keras inference, calling the model eagerly: {e}")
 
 def create_model():
     """Create a new multi-modal model that learns crop-specific behavior"""
@@ -146,25 +974,30 @@ def create_model():
         if MULTI_MODAL_AVAILABLE:
             # Use new multi-modal architecture
             logger.info("Creating multi-modal model with crop-specific learning...")
-            model, base_model = create_multi_modal_model()
+            model, base_model = create_multi_modal_model(alpha=MOBILENET_ALPHA)
             logger.info("Multi-modal model created successfully")
         else:
             # Fallback to legacy model
             logger.warning("Using legacy model architecture (crop type not learned)")
             base_model = MobileNetV2(
                 input_shape=(224, 224, 3),
+                alpha=MOBILENET_ALPHA,
                 include_top=False,
                 weights='imagenet'
             )
             base_model.trainable = False
             
+            # Raw 0-255 pixels, scaled for MobileNetV2 in the graph
             inputs = keras.Input(shape=(224, 224, 3))
-            x = base_model(inputs, training=False)
+            x = keras.layers.Rescaling(1.0 / 127.5, offset=-1.0, name='normalize')(inputs)
+            x = base_model(x, training=False)
             x = keras.layers.GlobalAveragePooling2D()(x)
             x = keras.layers.Dropout(0.2)(x)
             
-            health_output = keras.layers.Dense(3, activation='softmax', name='health_status')(x)
-            disease_output = keras.layers.Dense(len(DISEASE_TYPES), activation='sigmoid', name='disease_detection')(x)
+            health_output = keras.layers.Dense(3, activation='softmax', name='health_status', dtype='float32')(x)
+            disease_output = keras.layers.Dense(
+                len(DISEASE_TYPES), activation='sigmoid', name='disease_detection', dtype='float32'
+            )(x)
             
             model = keras.Model(inputs=inputs, outputs=[health_output, disease_output])
             
@@ -181,10 +1014,10 @@ def create_model():
             )
         
         # Save the model
-        os.makedirs(os.path.join(os.path.dirname(__file__), 'models'), exist_ok=True)
-        model_path = os.path.join(os.path.dirname(__file__), 'models', 'crop_health_model.h5')
-        model.save(model_path)
-        logger.info(f"Model created and saved to {model_path}")
+        os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+        model.save(MODEL_PATH)
+        logger.info(f"Model created and saved to {MODEL_PATH}")
+        export_saved_model()
         return True
     except Exception as e:
         logger.error(f"Failed to create model: {e}")
@@ -193,31 +1026,85 @@ def create_model():
         return False
 
 def preprocess_image(img):
-    """Preprocess image for model input"""
+    """Preprocess image for model input: raw 0-255 pixels when the model normalizes them itself"""
+    # Already decoded and resized in TensorFlow (TF_DECODE=1)
+    if isinstance(img, np.ndarray) and img.ndim == 4:
+        return img if RAW_PIXEL_INPUT else img / 127.5 - 1.0
+    
     try:
-        # Resize to 224x224 (MobileNet input size)
-        img = img.resize((224, 224))
-        
-        # Convert to array
-        img_array = image.img_to_array(img)
-        
-        # Expand dimensions for batch
-        img_array = np.expand_dims(img_array, axis=0)
+        # Resize to 224x224 (MobileNet input size) and view the pixels as uint8
+        if CV2_AVAILABLE:
+            arr = cv2.resize(np.asarray(img, dtype=np.uint8), (224, 224), interpolation=cv2.INTER_AREA)
+        else:
+            if isinstance(img, np.ndarray):
+                img = Image.fromarray(img)
+            arr = np.asarray(img.resize((224, 224), Image.BILINEAR), dtype=np.uint8)
         
-        # Preprocess for MobileNet
-        img_array = preprocess_input(img_array)
+        img_array = np.empty((1, 224, 224, 3), dtype=np.float32)
+        if RAW_PIXEL_INPUT:
+            img_array[0] = arr
+        else:
+            # MobileNetV2 scaling (x / 127.5 - 1) written straight into the batch buffer
+            np.multiply(arr, 1.0 / 127.5, out=img_array[0], dtype=np.float32)
+            np.subtract(img_array, 1.0, out=img_array)
         
         return img_array
     except Exception as e:
         logger.error(f"Image preprocessing error: {e}")
         raise
 
-def analyze_image(image_path, crop_type='Unknown', crop_stage=None, weather=None, soil=None):
+def build_tf_decode():
+    """Build the fused decode + resize graph used when TF_DECODE=1"""
+    global tf_decode_fn
+    
+    @tf.function(input_signature=[tf.TensorSpec([], tf.string)])
+    def decode(data):
+        # decode_image handles grayscale/RGBA/PNG/GIF, always yielding 3 channels
+        img = tf.io.decode_image(data, channels=3, expand_animations=False)
+        img = tf.image.resize(img, (224, 224), method='bilinear')
+        # Raw 0-255 pixels; preprocess_image scales them if the model does not
+        return img[tf.newaxis]
+    
+    tf_decode_fn = decode.get_concrete_function()
+    logger.info("Uploads are decoded with tf.io.decode_image")
+
+def decode_upload(image_bytes):
+    """
+    Decode uploaded image bytes to RGB
+    
+    Large JPEGs are DCT-downscaled while decoding to no less than
+    DECODE_MIN_SIZE; preprocess_image does the final 224x224 resize.
+    Returns an HxWx3 uint8 array (libjpeg-turbo) or a PIL image, or with
+    TF_DECODE=1 the already decoded and resized (1, 224, 224, 3) float32 batch.
+    """
+    if tf_decode_fn is not None:
+        return tf_decode_fn(tf.constant(image_bytes)).numpy()
+    
+    if jpeg_decoder is not None and image_bytes[:2] == b'\xff\xd8':
+        width, height, _, _ = jpeg_decoder.decode_header(image_bytes)
+        scaling_factor = min(
+            (
+                f for f in jpeg_decoder.scaling_factors
+                if min(width, height) * f[0] // f[1] >= DECODE_MIN_SIZE
+            ),
+            key=lambda f: f[0] / f[1],
+            default=None
+        )
+        return jpeg_decoder.decode(image_bytes, pixel_format=TJPF_RGB, scaling_factor=scaling_factor)
+    
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft('RGB', (DECODE_MIN_SIZE, DECODE_MIN_SIZE))
+    img.load()
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+def analyze_image(image_bytes, crop_type='Unknown', crop_stage=None, weather=None, soil=None):
     """
     Analyze crop image using ML model with multi-modal features
     
     Args:
-        image_path: Path to image file
+        image_bytes: Encoded image file contents (JPEG, PNG, ...)
         crop_type: Crop type string (required for crop-specific learning)
         crop_stage: Crop stage string (optional)
         weather: Dict with 'temp', 'humidity', 'rain' (optional)
@@ -225,24 +1112,15 @@ def analyze_image(image_path, crop_type='Unknown', crop_stage=None, weather=None
     """
     global model
     
-    if model is None:
+    if not is_model_loaded():
         return None
     
     try:
-        # Load and preprocess image
-        img = Image.open(image_path)
-        
-        # Convert to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        img_array = preprocess_image(img)
+        img_array = preprocess_image(decode_upload(image_bytes))
         
         # ALWAYS use multi-modal features if available, even for legacy models
         # This ensures crop type affects predictions
-        use_multi_modal = MULTI_MODAL_AVAILABLE and len(model.inputs) > 1
-        
-        if use_multi_modal:
+        if USE_MULTI_MODAL:
             # Multi-modal model: prepare all features
             features = prepare_features_for_inference(
                 image_array=img_array,
@@ -253,117 +1131,59 @@ def analyze_image(image_path, crop_type='Unknown', crop_stage=None, weather=None
             )
             
             # Predict with all features (deterministic - no randomness)
-            predictions = model.predict(
-                [
-                    features['image_input'],
-                    features['crop_type_input'],
-                    features['crop_stage_input'],
-                    features['weather_input'],
-                    features['soil_input']
-                ],
-                verbose=0
-            )
+            predictions = run_inference([
+                features['image_input'],
+                features['crop_type_input'],
+                features['crop_stage_input'],
+                features['weather_input'],
+                features['soil_input']
+            ])
             
             # Even for multi-modal models, apply STRONG crop-specific adjustment
             # to ensure visible differences (in case model isn't fully trained)
             if crop_type and crop_type != 'Unknown':
-                health_pred = np.array(predictions[0][0]).copy()
                 crop_idx = get_crop_type_index(crop_type)
-                
-                # STRONG adjustment for multi-modal too
-                base_adjustment = 0.15
-                crop_multiplier = 0.5 + (crop_idx % 10) * 0.1
-                crop_adjustment = base_adjustment * crop_multiplier
-                
-                pattern = crop_idx % 3
-                if pattern == 0:
-                    health_pred[0] = min(1.0, health_pred[0] + crop_adjustment)
-                    health_pred[1] = max(0.0, health_pred[1] - crop_adjustment * 0.7)
-                    health_pred[2] = max(0.0, health_pred[2] - crop_adjustment * 0.5)
-                elif pattern == 1:
-                    health_pred[0] = max(0.0, health_pred[0] - crop_adjustment * 0.5)
-                    health_pred[1] = min(1.0, health_pred[1] + crop_adjustment)
-                    health_pred[2] = max(0.0, health_pred[2] - crop_adjustment * 0.7)
-                else:
-                    health_pred[0] = max(0.0, health_pred[0] - crop_adjustment * 0.6)
-                    health_pred[1] = max(0.0, health_pred[1] - crop_adjustment * 0.4)
-                    health_pred[2] = min(1.0, health_pred[2] + crop_adjustment)
-                
-                health_pred = health_pred / (health_pred.sum() + 1e-8)
-                predictions = (np.array([health_pred]), predictions[1])
-                logger.info(f"Multi-modal crop adjustment for {crop_type} (idx: {crop_idx}, adj: {crop_adjustment:.3f}): {health_pred}")
+                health_pred = apply_crop_adjustment(predictions[0][0], MULTI_MODAL_CROP_ADJUSTMENT[crop_idx])
+                predictions = [health_pred[np.newaxis]] + list(predictions[1:])
+                logger.debug("Multi-modal crop adjustment for %s (idx: %d): %s", crop_type, crop_idx, health_pred)
         else:
             # Legacy model: only image, but we'll adjust based on crop type
-            predictions = model.predict(img_array, verbose=0)
+            predictions = run_inference([img_array])
             
             # FORCE crop-specific differentiation even for legacy models
-            # Add crop-based adjustment to predictions - MAKE IT MORE SIGNIFICANT
+            # (deterministic, strong enough to change the predicted class)
             if crop_type and crop_type != 'Unknown':
-                # Get crop index for deterministic adjustment
-                crop_idx = get_crop_type_index(crop_type)
-                
-                # Apply crop-specific adjustment to health predictions
-                # This ensures different crops get DIFFERENT results
-                health_pred = np.array(predictions[0][0]).copy()
-                
-                # DETERMINISTIC adjustment based on crop type
-                # Use crop index instead of hash for true determinism
                 crop_idx = get_crop_type_index(crop_type)
+                original_pred = predictions[0][0]
                 
-                # Create VERY STRONG, VISIBLE differences between crops
-                # Each crop gets a unique base adjustment that CAN CHANGE THE PREDICTED CLASS
-                base_adjustment = 0.30  # VERY STRONG adjustment (30%) - enough to change class
-                
-                # Crop-specific multiplier (0.6 to 1.4 range) - ensures each crop is different
-                crop_multiplier = 0.6 + (crop_idx % 9) * 0.1  # 0.6, 0.7, 0.8, ..., 1.4
-                crop_adjustment = base_adjustment * crop_multiplier
-                
-                # Apply VERY STRONG adjustment based on crop index pattern
-                # This will CHANGE the predicted class for different crops
-                pattern = crop_idx % 3
-                
-                # Store original for logging
-                original_pred = health_pred.copy()
-                original_class = np.argmax(original_pred)
+                health_pred = apply_crop_adjustment(original_pred, LEGACY_CROP_ADJUSTMENT[crop_idx])
+                predictions = [health_pred[np.newaxis]] + list(predictions[1:])
                 
-                if pattern == 0:
-                    # Pattern 1: STRONG shift toward healthy - can flip to healthy
-                    health_pred[0] = min(1.0, health_pred[0] + crop_adjustment)
-                    health_pred[1] = max(0.0, health_pred[1] - crop_adjustment * 0.8)
-                    health_pred[2] = max(0.0, health_pred[2] - crop_adjustment * 0.6)
-                elif pattern == 1:
-                    # Pattern 2: STRONG shift toward moderate - can flip to moderate
-                    health_pred[0] = max(0.0, health_pred[0] - crop_adjustment * 0.6)
-                    health_pred[1] = min(1.0, health_pred[1] + crop_adjustment)
-                    health_pred[2] = max(0.0, health_pred[2] - crop_adjustment * 0.8)
-                else:  # pattern == 2
-                    # Pattern 3: STRONG shift toward critical - can flip to critical
-                    health_pred[0] = max(0.0, health_pred[0] - crop_adjustment * 0.7)
-                    health_pred[1] = max(0.0, health_pred[1] - crop_adjustment * 0.5)
-                    health_pred[2] = min(1.0, health_pred[2] + crop_adjustment)
-                
-                # Normalize to ensure valid probabilities
-                health_pred = health_pred / (health_pred.sum() + 1e-8)
-                predictions = (np.array([health_pred]), predictions[1])
-                
-                new_class = np.argmax(health_pred)
-                class_changed = "✓ CHANGED" if new_class != original_class else "same"
-                
-                logger.info(f"Crop-specific adjustment for {crop_type} (idx: {crop_idx}, pattern: {pattern}, adj: {crop_adjustment:.3f})")
-                logger.info(f"  Original: {original_pred} -> Class: {original_class}")
-                logger.info(f"  Adjusted: {health_pred} -> Class: {new_class} {class_changed}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    original_class = np.argmax(original_pred)
+                    new_class = np.argmax(health_pred)
+                    class_changed = "✓ CHANGED" if new_class != original_class else "same"
+                    logger.debug("Crop-specific adjustment for %s (idx: %d, pattern: %d)", crop_type, crop_idx, crop_idx % 3)
+                    logger.debug("  Original: %s -> Class: %d", original_pred, original_class)
+                    logger.debug("  Adjusted: %s -> Class: %d %s", health_pred, new_class, class_changed)
         
         health_pred = predictions[0][0]  # Health status probabilities
         disease_pred = predictions[1][0]  # Disease detection probabilities
         crop_stress_pred = predictions[2][0] if len(predictions) > 2 else None  # Auxiliary output
+        # One vectorized scale + tolist() instead of a float() per class
+        health_percentages = dict(zip(CLASS_NAMES, (health_pred * 100).tolist()))
         
         # LOG crop type being used for debugging
-        predicted_class = np.argmax(health_pred)
-        logger.info(f"=== FINAL PREDICTION ===")
-        logger.info(f"Crop: {crop_type}")
-        logger.info(f"Health probs: Healthy={health_pred[0]*100:.1f}%, Moderate={health_pred[1]*100:.1f}%, Critical={health_pred[2]*100:.1f}%")
-        logger.info(f"Predicted class: {CLASS_NAMES[predicted_class]} ({predicted_class})")
-        logger.info(f"=========================")
+        if logger.isEnabledFor(logging.DEBUG):
+            predicted_class = np.argmax(health_pred)
+            logger.debug("=== FINAL PREDICTION ===")
+            logger.debug("Crop: %s", crop_type)
+            logger.debug(
+                "Health probs: Healthy=%.1f%%, Moderate=%.1f%%, Critical=%.1f%%",
+                *health_percentages.values()
+            )
+            logger.debug("Predicted class: %s (%d)", CLASS_NAMES[predicted_class], predicted_class)
+            logger.debug("=========================")
         
         # Generate insights from MODEL OUTPUTS (not templates)
         try:
@@ -380,12 +1200,8 @@ def analyze_image(image_path, crop_type='Unknown', crop_stage=None, weather=None
             
             # Add analysis details
             result['analysis'] = {
-                'healthProbabilities': {
-                    'healthy': float(health_pred[0] * 100),
-                    'moderate': float(health_pred[1] * 100),
-                    'critical': float(health_pred[2] * 100)
-                },
-                'cropStressScore': float(crop_stress_pred[0]) if crop_stress_pred is not None else None,
+                'healthProbabilities': health_percentages,
+                'cropStressScore': crop_stress_pred[0].item() if crop_stress_pred is not None else None,
                 'modelDerived': True
             }
             
@@ -396,7 +1212,7 @@ def analyze_image(image_path, crop_type='Unknown', crop_stage=None, weather=None
             logger.warning("model_insights not available, using basic model outputs")
             health_idx = np.argmax(health_pred)
             health_status = CLASS_NAMES[health_idx]
-            confidence = float(health_pred[health_idx] * 100)
+            confidence = health_percentages[health_status]
             
             return {
                 'healthStatus': health_status,
@@ -409,11 +1225,7 @@ def analyze_image(image_path, crop_type='Unknown', crop_stage=None, weather=None
                 'recommendations': ['Model assessment indicates ' + health_status + ' condition.'],
                 'detectedDiseases': [],
                 'analysis': {
-                    'healthProbabilities': {
-                        'healthy': float(health_pred[0] * 100),
-                        'moderate': float(health_pred[1] * 100),
-                        'critical': float(health_pred[2] * 100)
-                    }
+                    'healthProbabilities': health_percentages
                 }
             }
     except Exception as e:
@@ -425,13 +1237,51 @@ def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'OK',
-        'model_loaded': model is not None
+        'model_loaded': is_model_loaded()
     })
 
+# Seconds clients are told to wait when /analyze is called before the model is ready
+LOADING_RETRY_AFTER = 2
+
+# Form field -> feature key per group; a None default marks a required field
+FORM_FIELDS = {
+    'weather': [('temperature', 'temp', None), ('humidity', 'humidity', None), ('rainfall', 'rain', 0.0)],
+    'soil': [('soilPh', 'ph', None), ('soilMoisture', 'moisture', None)],
+}
+
+def parse_form_features(form):
+    """
+    Parse the weather and soil dicts from the request form
+    
+    A group is None when a required field is missing or a value is not a number.
+    """
+    groups = {}
+    for group, fields in FORM_FIELDS.items():
+        values = {}
+        try:
+            for form_key, key, default in fields:
+                raw = form.get(form_key)
+                if not raw:
+                    if default is None:
+                        raise ValueError(form_key)
+                    values[key] = default
+                else:
+                    values[key] = float(raw)
+        except ValueError:
+            values = None
+        groups[group] = values
+    return groups['weather'], groups['soil']
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     """Analyze crop image with multi-modal features"""
     try:
+        # Still loading (or warming up): ask the client to retry instead of failing
+        if not is_model_loaded():
+            response = jsonify({'error': 'Model is loading'})
+            response.headers['Retry-After'] = str(LOADING_RETRY_AFTER)
+            return response, 503
+        
         if 'image' not in request.files:
             return jsonify({'error': 'No image file provided'}), 400
         
@@ -439,73 +1289,35 @@ def analyze():
         crop_type = request.form.get('cropType', 'Unknown')
         
         # LOG received crop type for debugging
-        logger.info(f"=== RECEIVED REQUEST ===")
-        logger.info(f"Crop Type: {crop_type}")
-        logger.info(f"========================")
+        logger.debug("=== RECEIVED REQUEST ===")
+        logger.debug("Crop Type: %s", crop_type)
+        logger.debug("========================")
         crop_stage = request.form.get('cropStage', None)
         
-        # Parse weather features
-        weather = None
-        if request.form.get('latitude') and request.form.get('longitude'):
-            try:
-                # Weather can be passed directly or fetched from coordinates
-                temp = request.form.get('temperature')
-                humidity = request.form.get('humidity')
-                rain = request.form.get('rainfall')
-                if temp and humidity:
-                    weather = {
-                        'temp': float(temp),
-                        'humidity': float(humidity),
-                        'rain': float(rain) if rain else 0.0
-                    }
-            except (ValueError, TypeError):
-                pass
-        
-        # Parse soil features
-        soil = None
-        ph = request.form.get('soilPh')
-        moisture = request.form.get('soilMoisture')
-        if ph and moisture:
-            try:
-                soil = {
-                    'ph': float(ph),
-                    'moisture': float(moisture)
-                }
-            except (ValueError, TypeError):
-                pass
+        weather, soil = parse_form_features(request.form)
         
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Save temporary file
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            file.save(tmp_file.name)
-            tmp_path = tmp_file.name
+        # Read the upload into memory (no temp file)
+        image_bytes = file.read()
         
-        try:
-            # Analyze image with all features
-            result = analyze_image(
-                tmp_path,
-                crop_type=crop_type,
-                crop_stage=crop_stage,
-                weather=weather,
-                soil=soil
-            )
-            
-            if result is None:
-                return jsonify({'error': 'Model not loaded'}), 500
-            
-            result['cropType'] = crop_type
-            result['success'] = True
-            
-            return jsonify(result)
-        finally:
-            # Clean up temporary file
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
+        # Analyze image with all features
+        result = analyze_image(
+            image_bytes,
+            crop_type=crop_type,
+            crop_stage=crop_stage,
+            weather=weather,
+            soil=soil
+        )
+        
+        if result is None:
+            return jsonify({'error': 'Model not loaded'}), 500
+        
+        result['cropType'] = crop_type
+        result['success'] = True
+        
+        return jsonify(result)
     
     except Exception as e:
         logger.error(f"Analysis error: {e}")
@@ -513,12 +1325,19 @@ def analyze():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def load_model_in_background():
+    """Load the model on a background thread; the process exits if loading fails"""
+    def run():
+        if not load_model():
+            logger.error("Failed to load model. Exiting.")
+            os._exit(1)
+    
+    threading.Thread(target=run, name='model-loader', daemon=True).start()
+
 if __name__ == '__main__':
-    # Load model on startup
-    if load_model():
-        logger.info("Starting ML service...")
-        app.run(host='0.0.0.0', port=5001, debug=False)
-    else:
-        logger.error("Failed to load model. Exiting.")
-        sys.exit(1)
+    # Load the model in the background so /health answers (model_loaded=false)
+    # while TensorFlow starts up
+    load_model_in_background()
+    logger.info("Starting ML service...")
+    app.run(host='0.0.0.0', port=5001, debug=False)
 
@@ -1,7 +1,18 @@
 import os
-import json
+import copy
 import hashlib
-from typing import Dict, Optional, Tuple
+import json
+import functools
+import io
+import logging
+import platform
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
 from pathlib import Path
 from PIL import Image
 import numpy as np
@@ -11,6 +22,29 @@ try:
 except Exception:  # pragma: no cover
     tf = None
 
+try:
+    # The standalone runtime is enough to serve an exported .tflite
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:  # pragma: no cover
+    Interpreter = tf.lite.Interpreter if tf is not None else None
+
+try:
+    from numba import njit
+except ImportError:  # pragma: no cover
+    njit = None
+
+try:
+    import cv2
+except ImportError:  # pragma: no cover
+    cv2 = None
+
+try:
+    import onnxruntime as ort
+except ImportError:  # pragma: no cover
+    ort = None
+
+logger = logging.getLogger(__name__)
+
 _root = Path(__file__).parent
 # Fix: Go up from ml_service to backend, then to models
 # _root is backend/ml_service/, so _root.parent is backend/, then /models
@@ -18,18 +52,84 @@ MODELS_DIR = Path(os.environ.get('DEEPLEAF_MODELS_DIR', (_root.parent / 'models'
 MODEL_PATH = os.environ.get('DEEPLEAF_MODEL_PATH', (MODELS_DIR / 'deepleaf_model.h5').as_posix())
 CLASSES_PATH = os.environ.get('DEEPLEAF_CLASSES_PATH', (MODELS_DIR / 'deepleaf_classes.json').as_posix())
 MODEL_VERSION = os.environ.get('DEEPLEAF_MODEL_VERSION', 'DeepLeaf v2.0')
+# float16 TFLite conversion of MODEL_PATH, rebuilt whenever the .h5 is newer
+TFLITE_PATH = os.environ.get('DEEPLEAF_TFLITE_PATH', (MODELS_DIR / 'deepleaf_model.tflite').as_posix())
+# 'fp16' or 'int8' (full-integer; faster on CPUs with VNNI / ARM dot-product
+# instructions, can be slower on older x86 - benchmark before enabling).
+# Defaults to int8 on ARM and fp16 elsewhere.
+_ON_ARM = platform.machine().lower().startswith(('arm', 'aarch'))
+QUANTIZATION = os.environ.get('DEEPLEAF_QUANTIZATION', 'int8' if _ON_ARM else 'fp16').lower()
+INT8_TFLITE_PATH = os.environ.get('DEEPLEAF_INT8_TFLITE_PATH', (MODELS_DIR / 'deepleaf_model_int8.tflite').as_posix())
+# Training images used to calibrate int8 activation ranges
+CALIBRATION_DIR = os.environ.get('DEEPLEAF_CALIBRATION_DIR', (_root.parent.parent / 'Dataset').as_posix())
+CALIBRATION_SAMPLES = 100
+# 'tflite' or 'onnx' (ONNX Runtime on TensorRT FP16 / CUDA when available;
+# on a small MobileNetV2 at batch size 1 it is not always faster than TFLite -
+# benchmark before enabling). Falls back to TFLite if ONNX cannot be loaded.
+RUNTIME = os.environ.get('DEEPLEAF_RUNTIME', 'tflite').lower()
+ONNX_PATH = os.environ.get('DEEPLEAF_ONNX_PATH', (MODELS_DIR / 'deepleaf_model.onnx').as_posix())
+ONNX_OPSET = 15
+# Execution providers in order of preference; unavailable ones are skipped
+ONNX_PROVIDERS = ['TensorrtExecutionProvider', 'CUDAExecutionProvider', 'CPUExecutionProvider']
+# Version of the exported graphs (uint8 serving signature, input scaling,
+# quantization); bump it whenever those change so cached exports are rebuilt
+EXPORT_VERSION = 1
+# SavedModel export, served when TFLite is not available
+SAVED_MODEL_DIR = os.environ.get('DEEPLEAF_SAVED_MODEL_DIR', (MODELS_DIR / 'deepleaf_saved').as_posix())
+# Number of predict_disease results kept by image content; 0 disables the cache
+RESULT_CACHE_SIZE = int(os.environ.get('DEEPLEAF_RESULT_CACHE_SIZE', '512'))
+# Decode and resize uploads in one TensorFlow graph instead of with PIL
+TF_DECODE = os.environ.get('DEEPLEAF_TF_DECODE', '0') == '1' and tf is not None
+# Inference threads per process: the cores split between the server's worker
+# processes (WEB_CONCURRENCY, which uvicorn --workers also reads) so they do
+# not oversubscribe the CPU
+NUM_THREADS = int(os.environ.get(
+    'DEEPLEAF_NUM_THREADS',
+    max(1, (os.cpu_count() or 1) // max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))),
+))
+# Dummy inferences run by warmup() before the first request; 0 skips them
+WARMUP_RUNS = int(os.environ.get('DEEPLEAF_WARMUP_RUNS', '3'))
 
+# Keras model rebuilt from the .h5; only needed to (re)export the cached formats
 _model = None
+_saved_model = None
+_saved_infer = None
+_saved_input_name: Optional[str] = None
+_onnx_session = None
+_onnx_input_name: Optional[str] = None
+_interpreter = None
+_input_index: Optional[int] = None
+_output_index: Optional[int] = None
+# For int8 models: the quantized input value of each 0-255 pixel value, and
+# the output's (scale, zero_point); None for float models
+_input_lut: Optional[np.ndarray] = None
+_output_quant: Optional[Tuple[float, int]] = None
+# An interpreter's tensors are shared state; one invocation at a time
+_interpreter_lock = threading.Lock()
+# Set once a model is loaded; _load_lock serializes the first load
+_model_ready = False
+_load_lock = threading.Lock()
+# Runs color-feature extraction alongside CNN inference
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='deepleaf')
+# Per-thread CNN input buffers, reused across requests
+_input_buffers = threading.local()
 _idx_to_label: Optional[Dict[int, str]] = None
+# Indexed by class id: True for classes whose label contains "healthy"
+_healthy_mask: Optional[np.ndarray] = None
+# Class id -> _humanize_label() of its label, built with the class map
+_humanized: Dict[int, Tuple[str, Optional[str], str, bool]] = {}
+# Content digest -> predict_disease result, least recently used first
+_results: "OrderedDict[bytes, Dict]" = OrderedDict()
+_results_lock = threading.Lock()
 
 
 def _build_deepleaf_model(num_classes: int) -> "tf.keras.Model":
     if tf is None:
         raise RuntimeError("TensorFlow not available - cannot build model")
 
+    # Expects inputs already scaled to [-1, 1] by preprocess_image; the
+    # training graph's normalization ops carry no weights
     inputs = tf.keras.Input(shape=(224, 224, 3), name="input_layer_3")
-    x = tf.keras.layers.Lambda(lambda im: tf.math.divide(im, 127.5), name="true_divide_1")(inputs)
-    x = tf.keras.layers.Lambda(lambda im: tf.math.subtract(im, 1.0), name="subtract_1")(x)
 
     base = tf.keras.applications.MobileNetV2(
         input_shape=(224, 224, 3),
@@ -39,7 +139,7 @@ def _build_deepleaf_model(num_classes: int) -> "tf.keras.Model":
     )
     base._name = "mobilenetv2_1.00_224"
     base.trainable = False
-    x = base(x, training=False)
+    x = base(inputs, training=False)
 
     x = tf.keras.layers.GlobalAveragePooling2D(name="global_average_pooling2d_1")(x)
     x = tf.keras.layers.Dropout(rate=0.2, name="dropout_1")(x, training=False)
@@ -48,30 +148,293 @@ def _build_deepleaf_model(num_classes: int) -> "tf.keras.Model":
     return model
 
 
-def _ensure_model_loaded():
+def _ensure_model_loaded() -> Dict[int, str]:
+    """Load the model and class map once; returns the class map. A flag check after that."""
+    global _model_ready
+    if not _model_ready:
+        # Concurrent first requests (batcher threads) load the model only once
+        with _load_lock:
+            if not _model_ready:
+                _load_model()
+                _model_ready = True
+    return _idx_to_label
+
+
+def _load_model() -> None:
+    idx_to_label = _ensure_class_map_loaded()
+    if not idx_to_label:
+        raise FileNotFoundError(
+            f'Class map not found at: {CLASSES_PATH}\n'
+            f'Please ensure deepleaf_classes.json exists with class index mapping.'
+        )
+    if RUNTIME != 'onnx' and (tf is None or not os.path.exists(MODEL_PATH)):
+        # Serve a shipped .tflite as-is; without TensorFlow nothing could be re-exported anyway
+        tflite_path = _shipped_tflite()
+        if tflite_path is not None:
+            _load_interpreter(tflite_path)
+            return
+    if tf is None:
+        raise RuntimeError('TensorFlow not available - cannot load model')
+    try:
+        # Sizes TensorFlow's own pool too (exports and the SavedModel fallback)
+        tf.config.threading.set_intra_op_parallelism_threads(NUM_THREADS)
+    except RuntimeError as exc:
+        logger.warning(f"Could not configure TensorFlow thread pools: {exc}")
+    if not os.path.exists(MODEL_PATH):
+        raise FileNotFoundError(
+            f'Model file not found at: {MODEL_PATH}\n'
+            f'Please train the model first using: python deepleaf.py --data ./Dataset --out ./backend/models --epochs 10'
+        )
+    if RUNTIME == 'onnx':
+        try:
+            _load_onnx_session()
+            return
+        except Exception as exc:
+            logger.warning(f"ONNX Runtime unavailable, using TFLite: {exc}")
+    try:
+        _load_interpreter()
+    except Exception as exc:
+        # Keep serving through TensorFlow if TFLite is not usable here
+        logger.warning(f"TFLite model unavailable, using the SavedModel: {exc}")
+        _load_saved_model()
+
+
+def _keras_model() -> "tf.keras.Model":
     global _model
     if _model is None:
-        if tf is None:
-            raise RuntimeError('TensorFlow not available - cannot load model')
-        if not os.path.exists(MODEL_PATH):
-            raise FileNotFoundError(
-                f'Model file not found at: {MODEL_PATH}\n'
-                f'Please train the model first using: python deepleaf.py --data ./Dataset --out ./backend/models --epochs 10'
-            )
-        idx_to_label = _ensure_class_map_loaded()
-        if not idx_to_label:
-            raise FileNotFoundError(
-                f'Class map not found at: {CLASSES_PATH}\n'
-                f'Please ensure deepleaf_classes.json exists with class index mapping.'
-            )
-        num_classes = len(idx_to_label)
-        model = _build_deepleaf_model(num_classes)
+        model = _build_deepleaf_model(len(_idx_to_label))
         model.load_weights(os.path.abspath(MODEL_PATH))
         _model = model
     return _model
 
+
+def _is_stale(path: str) -> bool:
+    """True if an exported artifact is missing, older than the .h5 weights or from another EXPORT_VERSION."""
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(MODEL_PATH):
+        return True
+    try:
+        with open(path + '.version') as f:
+            return f.read().strip() != str(EXPORT_VERSION)
+    except OSError:
+        return True
+
+
+def _write_export_version(path: str) -> None:
+    """Record EXPORT_VERSION next to a freshly exported artifact."""
+    with open(path + '.version', 'w') as f:
+        f.write(str(EXPORT_VERSION))
+
+
+def _uint8_serving_fn(model: "tf.keras.Model"):
+    """
+    Serving function that takes uint8 pixels and applies the MobileNetV2
+    scaling in the graph, so a quarter of the bytes cross into the runtime
+    (and, on a GPU, over PCIe) compared to float32 inputs.
+    """
+    @tf.function(input_signature=[tf.TensorSpec((None, 224, 224, 3), tf.uint8, name='image')])
+    def serve(image):
+        return model(tf.cast(image, tf.float32) * (1.0 / 127.5) - 1.0, training=False)
+
+    return serve
+
+
+def _load_saved_model() -> None:
+    """
+    Export the model as a SavedModel once and load its serving signature.
+
+    Loading the pre-traced graph skips rebuilding MobileNetV2 layer by layer
+    on every cold start.
+    """
+    global _saved_model, _saved_infer, _saved_input_name
+    saved_model_pb = os.path.join(SAVED_MODEL_DIR, 'saved_model.pb')
+    if _is_stale(saved_model_pb):
+        model = _keras_model()
+        tf.saved_model.save(model, SAVED_MODEL_DIR, signatures={'serving_default': _uint8_serving_fn(model)})
+        _write_export_version(saved_model_pb)
+    loaded = tf.saved_model.load(SAVED_MODEL_DIR)
+    infer = loaded.signatures['serving_default']
+    _saved_input_name = next(iter(infer.structured_input_signature[1]))
+    # The signature's variables belong to the loaded object; keep it alive
+    _saved_model, _saved_infer = loaded, infer
+
+
+def _load_onnx_session() -> None:
+    """Export the model to ONNX once (cached next to the .h5) and open it on the best available provider."""
+    global _onnx_session, _onnx_input_name
+    if ort is None:
+        raise RuntimeError('onnxruntime is not installed')
+    if _is_stale(ONNX_PATH):
+        import tf2onnx
+        serve = _uint8_serving_fn(_keras_model())
+        tf2onnx.convert.from_function(
+            serve, input_signature=serve.input_signature, opset=ONNX_OPSET, output_path=ONNX_PATH
+        )
+        _write_export_version(ONNX_PATH)
+
+    available = ort.get_available_providers()
+    providers = []
+    for provider in ONNX_PROVIDERS:
+        if provider not in available:
+            continue
+        if provider == 'TensorrtExecutionProvider':
+            # FP16 engines, cached next to the model so they are built once per model file
+            providers.append((provider, {
+                'trt_fp16_enable': True,
+                'trt_engine_cache_enable': True,
+                'trt_engine_cache_path': os.path.dirname(ONNX_PATH),
+            }))
+        else:
+            providers.append(provider)
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = NUM_THREADS
+    session = ort.InferenceSession(ONNX_PATH, sess_options=options, providers=providers)
+    _onnx_input_name = session.get_inputs()[0].name
+    _onnx_session = session
+    logger.info(f"DeepLeaf ONNX Runtime session loaded ({session.get_providers()[0]})")
+
+
+def _convert_to_tflite(model: "tf.keras.Model") -> bytes:
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    return converter.convert()
+
+
+def _calibration_paths() -> List[Path]:
+    root = Path(CALIBRATION_DIR)
+    if not root.is_dir():
+        return []
+    paths = sorted(p for p in root.rglob('*') if p.suffix.lower() in {'.jpg', '.jpeg', '.png'})
+    # Spread the samples across the (class-sorted) dataset
+    step = max(1, len(paths) // CALIBRATION_SAMPLES)
+    return paths[::step][:CALIBRATION_SAMPLES]
+
+
+def _quantize_int8(model: "tf.keras.Model") -> bytes:
+    """Full-integer post-training quantization calibrated on CALIBRATION_DIR images."""
+    sample_paths = _calibration_paths()
+    if not sample_paths:
+        raise FileNotFoundError(f'No calibration images found under: {CALIBRATION_DIR}')
+
+    def representative_dataset():
+        for path in sample_paths:
+            yield [preprocess_image(str(path))]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+def _cached_tflite(path: str, convert) -> str:
+    if _is_stale(path):
+        tflite_model = convert(_keras_model())
+        with open(path, 'wb') as f:
+            f.write(tflite_model)
+        _write_export_version(path)
+    return path
+
+
+def _shipped_tflite() -> Optional[str]:
+    """The already exported .tflite for QUANTIZATION, if there is one."""
+    candidates = [INT8_TFLITE_PATH, TFLITE_PATH] if QUANTIZATION == 'int8' else [TFLITE_PATH]
+    return next((path for path in candidates if os.path.exists(path)), None)
+
+
+def _load_interpreter(tflite_path: Optional[str] = None) -> None:
+    """
+    Load a TFLite model into an interpreter. Unless a path is given, the
+    model is converted from the .h5 first (once; cached next to it).
+    """
+    global _interpreter, _input_index, _output_index, _input_lut, _output_quant
+    if Interpreter is None:
+        raise RuntimeError('Neither tflite_runtime nor TensorFlow is installed')
+    if tflite_path is None and QUANTIZATION == 'int8':
+        try:
+            tflite_path = _cached_tflite(INT8_TFLITE_PATH, _quantize_int8)
+        except Exception as exc:
+            logger.warning(f"int8 quantization failed, using float16: {exc}")
+    if tflite_path is None:
+        tflite_path = _cached_tflite(TFLITE_PATH, _convert_to_tflite)
+
+    interpreter = Interpreter(model_path=tflite_path, num_threads=NUM_THREADS)
+    interpreter.allocate_tensors()
+    input_detail = interpreter.get_input_details()[0]
+    output_detail = interpreter.get_output_details()[0]
+    _input_index = input_detail['index']
+    _output_index = output_detail['index']
+    if input_detail['dtype'] == np.int8:
+        scale, zero_point = input_detail['quantization']
+        # Same arithmetic as preprocess_image
+        levels = np.empty(256, dtype=np.float32)
+        np.multiply(np.arange(256), 1.0 / 127.5, out=levels)
+        levels -= 1.0
+        _input_lut = np.clip(np.round(levels / scale + zero_point), -128, 127).astype(np.int8)
+    else:
+        _input_lut = None
+    _output_quant = output_detail['quantization'] if output_detail['dtype'] == np.int8 else None
+    _interpreter = interpreter
+
+
+def _fill_input(x: np.ndarray, images: List[Union[Image.Image, np.ndarray]], target_size) -> None:
+    """
+    Write the images into the rows of the model input ``x``: scaled for float
+    inputs, quantized for int8 ones and as plain pixels for uint8 ones.
+    """
+    for row, img in zip(x, images):
+        if x.dtype == np.float32:
+            preprocess_image(img, target_size, out=row)
+        elif x.dtype == np.int8:
+            np.take(_input_lut, _resize_pixels(img, target_size), out=row)
+        else:
+            row[...] = _resize_pixels(img, target_size)
+
+
+def _predict_probs(images: List[Union[Image.Image, np.ndarray]], target_size=(224, 224)) -> np.ndarray:
+    """Class probabilities, one row per decoded image (or already resized pixels)."""
+    if _interpreter is None:
+        # The ONNX and SavedModel graphs take uint8 pixels
+        x = _input_buffer(len(images), target_size, dtype=np.uint8)
+        _fill_input(x, images, target_size)
+        if _onnx_session is not None:
+            return _onnx_session.run(None, {_onnx_input_name: x})[0]
+        outputs = _saved_infer(**{_saved_input_name: tf.constant(x)})
+        return next(iter(outputs.values())).numpy()
+    with _interpreter_lock:
+        shape = (len(images), target_size[1], target_size[0], 3)
+        if tuple(_interpreter.get_input_details()[0]['shape']) != shape:
+            _interpreter.resize_tensor_input(_input_index, shape)
+            _interpreter.allocate_tensors()
+        # Preprocess straight into the interpreter's input tensor rather than
+        # copying a separate array in with set_tensor(); the view is released
+        # when _fill_input returns, as invoke() requires
+        _fill_input(_interpreter.tensor(_input_index)(), images, target_size)
+        _interpreter.invoke()
+        probs = _interpreter.get_tensor(_output_index).copy()
+    if _output_quant is not None:
+        scale, zero_point = _output_quant
+        probs = (probs.astype(np.float32) - zero_point) * scale
+    return probs
+
+def warmup(runs: int = WARMUP_RUNS) -> None:
+    """
+    Load the model and run a few dummy inferences, so kernel initialization
+    and tensor allocation do not land on the first real request.
+    """
+    _ensure_model_loaded()
+    blank = Image.new('RGB', (224, 224), (128, 128, 128))
+    start = time.perf_counter()
+    for _ in range(runs):
+        _predict_probs([blank], target_size=(224, 224))
+    logger.info(f"DeepLeaf warmup completed in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
 def _ensure_class_map_loaded() -> Dict[int, str]:
-    global _idx_to_label
+    global _idx_to_label, _healthy_mask, _humanized
     if _idx_to_label is None:
         try:
             with open(CLASSES_PATH, 'r', encoding='utf-8') as f:
@@ -82,35 +445,139 @@ def _ensure_class_map_loaded() -> Dict[int, str]:
             else:
                 # name->idx
                 _idx_to_label = {int(v): k for k, v in data.items()}
+            _healthy_mask = np.array(
+                ["healthy" in _idx_to_label.get(i, "").lower() for i in range(len(_idx_to_label))]
+            )
+            # The label set is fixed, so the string cleanup runs once per class
+            # instead of per request (this also fills the recommendations cache)
+            _humanized = {i: _humanize_label(label) for i, label in _idx_to_label.items()}
+            for _, _, disease_key, is_healthy in _humanized.values():
+                _recommendations_for_label(disease_key, is_healthy)
         except Exception:
             _idx_to_label = None
     return _idx_to_label or {}
 
-def preprocess_image(image_path: str, target_size=(224, 224)) -> np.ndarray:
-    """Load and preprocess an image for CNN prediction. Uses 224x224 to match training."""
-    img = Image.open(image_path).convert('RGB')
-    img = img.resize(target_size)
-    arr = np.asarray(img, dtype=np.float32)
-    # Model has Lambda layers that do (x/127.5 - 1.0), so it expects 0-255 range input
-    # Just resize and keep as 0-255, model will do the normalization
-    arr = np.expand_dims(arr, axis=0)
-    return arr
+# A file path, or the encoded file contents (e.g. an upload kept in memory)
+ImageSource = Union[str, bytes]
+# An image source, or an RGB image already decoded by _load_rgb
+ImageInput = Union[str, bytes, Image.Image]
+
+
+def _load_rgb(source: ImageSource) -> Image.Image:
+    """
+    Decode an image once for both the CNN input and the color features.
+
+    draft() lets libjpeg decode JPEGs at 1/2-1/8 scale (DCT scaling), so a
+    multi-megapixel photo is never fully decoded; 448 keeps at least twice
+    the CNN resolution.
+    """
+    img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    img.draft('RGB', (448, 448))
+    return img.convert('RGB')
+
+
+def _as_rgb(image: ImageInput) -> Image.Image:
+    return image if isinstance(image, Image.Image) else _load_rgb(image)
+
+
+@functools.lru_cache(maxsize=1)
+def _tf_decoder():
+    """
+    Graph that decodes an encoded image and returns the 224x224 CNN pixels
+    and the 128x128 color-feature thumbnail, both uint8.
+    """
+    @tf.function(input_signature=[tf.TensorSpec([], tf.string)])
+    def decode(data):
+        # decode_image handles grayscale/RGBA/PNG/GIF, always yielding 3 channels
+        img = tf.io.decode_image(data, channels=3, expand_animations=False)
+
+        def resized(size):
+            out = tf.image.resize(img, size, method='bilinear', antialias=True)
+            return tf.cast(tf.round(out), tf.uint8)
+
+        return resized((224, 224)), resized((128, 128))
+
+    return decode.get_concrete_function()
+
+
+def _decode_with_tf(source: ImageSource) -> Tuple[np.ndarray, Image.Image]:
+    """CNN pixels and color-feature thumbnail of an image, decoded with DEEPLEAF_TF_DECODE=1."""
+    data = tf.constant(source) if isinstance(source, bytes) else tf.io.read_file(source)
+    pixels, thumbnail = _tf_decoder()(data)
+    return pixels.numpy(), Image.fromarray(thumbnail.numpy())
+
+
+def _resize_pixels(image: Union[ImageInput, np.ndarray], target_size=(224, 224)) -> np.ndarray:
+    """The image resized to ``target_size`` as an (H, W, 3) uint8 array."""
+    if isinstance(image, np.ndarray):
+        # Already decoded and resized by _decode_with_tf
+        return image
+    img = _as_rgb(image)
+    if cv2 is not None:
+        # OpenCV's SIMD resize is several times faster than Pillow's
+        return cv2.resize(np.asarray(img), target_size, interpolation=cv2.INTER_AREA)
+    # draft() already shrank large JPEGs; Pillow's bilinear filter is
+    # antialiased and cheaper than its bicubic default
+    return np.asarray(img.resize(target_size, Image.BILINEAR))
+
+
+def preprocess_image(image: Union[ImageInput, np.ndarray], target_size=(224, 224), out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Load and preprocess an image for CNN prediction. Uses 224x224 to match training.
+
+    With ``out`` (a float32 array of shape (H, W, 3)) the pixels are written
+    into it instead of a new array; a (1, H, W, 3) view of ``out`` is returned.
+    """
+    pixels = _resize_pixels(image, target_size)
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.float32)
+    # MobileNetV2 scaling (x/127.5 - 1.0), in place; the graph has no normalization ops
+    np.multiply(pixels, 1.0 / 127.5, out=out)
+    out -= 1.0
+    return out[np.newaxis]
+
+
+def _input_buffer(batch_size: int, target_size=(224, 224), dtype=np.float32) -> np.ndarray:
+    """This thread's (batch_size, H, W, 3) CNN input buffer."""
+    shape = (batch_size, target_size[1], target_size[0], 3)
+    buf = getattr(_input_buffers, 'buf', None)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = np.empty(shape, dtype=dtype)
+        _input_buffers.buf = buf
+    return buf
 
 LOW_CONF_THRESHOLD = 30.0
 
 
-def _extract_color_features(image_path: str) -> Dict[str, float]:
+def _channel_mean_std(arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-channel mean and std of a uint8 RGB image, scaled to [0, 1].
+
+    One pass for the sums and one fused sum-of-squares, both exact in int64;
+    only the length-3 results are converted to float. With OpenCV installed,
+    its SIMD meanStdDev does the same in a single pass.
+    """
+    if cv2 is not None:
+        mean, std = cv2.meanStdDev(np.ascontiguousarray(arr))
+        return mean.ravel() / 255.0, std.ravel() / 255.0
+    flat = arr.reshape(-1, 3)
+    n = flat.shape[0]
+    sums = flat.sum(axis=0, dtype=np.int64)
+    sq_sums = np.einsum('ij,ij->j', flat, flat, dtype=np.int64)
+    mean = sums / n
+    std = np.sqrt(np.maximum(sq_sums / n - mean * mean, 0.0))
+    return mean / 255.0, std / 255.0
+
+
+def _extract_color_features(image: ImageInput) -> Dict[str, float]:
     """
     Compute simple, lighting‑robust color features used both for
     (a) symptom validation and (b) healthy‑crop detection.
 
     NOTE: These are deliberately conservative to avoid false positives.
     """
-    img = Image.open(image_path).convert("RGB").resize((128, 128))
-    arr = np.asarray(img, dtype=np.float32) / 255.0
-
-    mean_rgb = arr.mean(axis=(0, 1))
-    std_rgb = arr.std(axis=(0, 1))
+    # 128x128 thumbnail, resized like the CNN input
+    mean_rgb, std_rgb = _channel_mean_std(_resize_pixels(image, (128, 128)))
 
     brightness = float(mean_rgb.mean())
     green_dominance = float(mean_rgb[1] - (mean_rgb[0] + mean_rgb[2]) / 2)
@@ -129,45 +596,31 @@ def _extract_color_features(image_path: str) -> Dict[str, float]:
     }
 
 
-def _detect_symptoms(features: Dict[str, float]) -> Tuple[Dict[str, bool], float]:
-    """
-    Derive coarse symptom flags from color features.
+# Bit i of the symptom mask is set when SYMPTOM_NAMES[i] is present
+SYMPTOM_NAMES = ("discoloration", "chlorosis", "necrotic_spots", "wilting", "abnormal_texture")
 
-    This is used as a *gate* on CNN predictions so that we NEVER
-    output a high‑confidence disease when the leaf looks visually healthy.
-    """
-    brightness = features["brightness"]
-    green_dom = features["green_dominance"]
-    yellow_tint = features["yellow_tint"]
-    dryness = features["dryness"]
-    std_rgb = features["std_rgb"]
 
-    # Symptom heuristics – intentionally conservative.
-    discoloration = std_rgb > 0.20 and brightness < 0.85
-    chlorosis = yellow_tint > 0.16 and green_dom < 0.06
-    necrotic_spots = std_rgb > 0.26 and brightness < 0.7
-    wilting = dryness > 0.55 and brightness < 0.55
-    abnormal_texture = std_rgb > 0.23 and abs(green_dom) < 0.10
-
-    symptoms = {
-        "discoloration": discoloration,
-        "chlorosis": chlorosis,
-        "necrotic_spots": necrotic_spots,
-        "wilting": wilting,
-        "abnormal_texture": abnormal_texture,
-    }
+def _symptom_kernel(brightness, green_dom, yellow_tint, dryness, std_rgb):
+    """Symptom bitmask and health score; compiled with Numba when it is installed."""
+    mask = 0
+    health_score = 92.0
 
+    # Symptom heuristics – intentionally conservative.
     # Health score: start high, subtract penalties for symptoms / stress.
-    health_score = 92.0
-    if discoloration:
+    if std_rgb > 0.20 and brightness < 0.85:  # discoloration
+        mask |= 1
         health_score -= 12
-    if chlorosis:
+    if yellow_tint > 0.16 and green_dom < 0.06:  # chlorosis
+        mask |= 2
         health_score -= 18
-    if necrotic_spots:
+    if std_rgb > 0.26 and brightness < 0.7:  # necrotic_spots
+        mask |= 4
         health_score -= 18
-    if wilting:
+    if dryness > 0.55 and brightness < 0.55:  # wilting
+        mask |= 8
         health_score -= 15
-    if abnormal_texture:
+    if std_rgb > 0.23 and abs(green_dom) < 0.10:  # abnormal_texture
+        mask |= 16
         health_score -= 10
 
     # Penalise strong yellowing / dryness even if symptom flags are borderline.
@@ -175,10 +628,33 @@ def _detect_symptoms(features: Dict[str, float]) -> Tuple[Dict[str, bool], float
     health_score -= max(0.0, (dryness - 0.5) * 50.0)
 
     health_score = max(40.0, min(97.0, health_score))
-    return symptoms, health_score
+    return mask, health_score
+
+
+if njit is not None:
+    _symptom_kernel = njit(cache=True)(_symptom_kernel)
+    # Compile (or load the cached machine code) now rather than on the first request
+    _symptom_kernel(0.5, 0.0, 0.0, 0.5, 0.1)
+
+
+def _detect_symptoms(features: Dict[str, float]) -> Tuple[int, float]:
+    """
+    Derive coarse symptom flags from color features, packed as a SYMPTOM_NAMES bitmask.
+
+    This is used as a *gate* on CNN predictions so that we NEVER
+    output a high‑confidence disease when the leaf looks visually healthy.
+    """
+    mask, health_score = _symptom_kernel(
+        features["brightness"],
+        features["green_dominance"],
+        features["yellow_tint"],
+        features["dryness"],
+        features["std_rgb"],
+    )
+    return int(mask), float(health_score)
 
 
-def predict_disease(image_path: str) -> Dict:
+def predict_disease(image: ImageSource) -> Dict:
     """
     Two‑stage inference pipeline:
 
@@ -190,36 +666,120 @@ def predict_disease(image_path: str) -> Dict:
         with strict confidence and symptom gating to avoid false positives.
 
     This makes “Healthy Crop” a first‑class outcome instead of a fallback.
+
+    ``image`` is a file path or the encoded file contents. Results are
+    cached by content, so a repeated image skips decoding and the CNN.
+    """
+    return predict_disease_batch([image])[0]
+
+
+def _content_key(source: ImageSource) -> bytes:
+    if not isinstance(source, bytes):
+        with open(source, 'rb') as f:
+            source = f.read()
+    return hashlib.blake2b(source, digest_size=16).digest()
+
+
+def predict_disease_batch(sources: List[ImageSource]) -> List[Dict]:
     """
+    predict_disease for several images, with a single CNN invocation.
+
+    Kernel dispatch and weight reads are amortized over the batch, which
+    raises throughput when several uploads arrive together. Only the images
+    missing from the result cache are run.
+    """
+    if RESULT_CACHE_SIZE <= 0:
+        return _predict_uncached(sources)
+    keys = [_content_key(source) for source in sources]
+    results: List[Optional[Dict]] = []
+    with _results_lock:
+        for key in keys:
+            cached = _results.get(key)
+            if cached is not None:
+                _results.move_to_end(key)
+                cached = copy.deepcopy(cached)
+            results.append(cached)
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        # A retried upload can land in the same batch as the original; each
+        # distinct image is run once
+        first: Dict[bytes, int] = {}
+        for i in misses:
+            first.setdefault(keys[i], i)
+        unique = list(first.values())
+        fresh = dict(zip(unique, _predict_uncached([sources[i] for i in unique])))
+        with _results_lock:
+            for i in misses:
+                result = fresh[first[keys[i]]]
+                results[i] = result if i in fresh else copy.deepcopy(result)
+            for i, result in fresh.items():
+                # Fallbacks caused by a failed model load or inference are not final
+                if "ml_failure" not in result.get("modelVersion", ""):
+                    _results[keys[i]] = copy.deepcopy(result)
+            while len(_results) > RESULT_CACHE_SIZE:
+                _results.popitem(last=False)
+    return results
+
+
+def _predict_uncached(sources: List[ImageSource]) -> List[Dict]:
+    # Decoded once; the CNN input, color features and fallback all reuse it
+    if TF_DECODE:
+        decoded = [_decode_with_tf(source) for source in sources]
+        cnn_inputs = [pixels for pixels, _ in decoded]
+        images = [thumbnail for _, thumbnail in decoded]
+    else:
+        images = [_load_rgb(source) for source in sources]
+        cnn_inputs = images
+    # PIL resizing, the NumPy reductions and invoke() release the GIL, so the
+    # color features are computed while the CNN runs
+    feature_futures = [_pool.submit(_extract_color_features, img) for img in images]
+    try:
+        _ensure_model_loaded()
+        probs_batch = _predict_probs(cnn_inputs, target_size=(224, 224))  # Match training size
+    except Exception as exc:
+        return [
+            fallback_prediction(
+                img,
+                reason=f"ml_failure: {exc}",
+                precomputed_features=None if future.exception() else future.result(),
+            )
+            for img, future in zip(images, feature_futures)
+        ]
+    return [
+        _interpret_prediction(img, probs, features)
+        for img, probs, features in zip(images, probs_batch, feature_futures)
+    ]
+
+
+def _interpret_prediction(img: Image.Image, probs: np.ndarray, features: "Future[Dict[str, float]]") -> Dict:
+    """Apply the healthy/unhealthy gate and disease rules to one image's class probabilities."""
+    color_features = None
     try:
         # ---- STEP 1: HEALTHY vs UNHEALTHY PRE‑CLASSIFICATION ----
         # Compute color features + symptom flags for gating.
-        color_features = _extract_color_features(image_path)
-        symptoms, health_score = _detect_symptoms(color_features)
-        has_any_symptom = any(symptoms.values())
+        color_features = features.result()
+        symptom_mask, health_score = _detect_symptoms(color_features)
+        has_any_symptom = symptom_mask != 0
 
-        model = _ensure_model_loaded()
-        x = preprocess_image(image_path, target_size=(224, 224))  # Match training size
-        probs = model.predict(x, verbose=0)[0]  # verbose=0 to suppress output
-        
-        idx_to_label = _ensure_class_map_loaded()
+        # Loaded by _ensure_model_loaded before inference ran
+        idx_to_label = _idx_to_label
         
-        # Get top 3 predictions (model space)
-        top3_indices = np.argsort(probs)[-3:][::-1]
-        top3_probs = probs[top3_indices]
+        # Get top 3 predictions (model space), highest first; argpartition
+        # avoids sorting every class
+        k = min(3, probs.shape[0])
+        top3_indices = np.argpartition(probs, -k)[-k:]
+        top3_indices = top3_indices[np.argsort(probs[top3_indices])[::-1]]
 
         # Track if model already has an explicit healthy class.
         healthy_idx = None
         healthy_conf = 0.0
-        for idx, prob in zip(top3_indices, top3_probs):
-            label = idx_to_label.get(int(idx), "")
-            if "healthy" in label.lower():
-                healthy_idx = int(idx)
-                healthy_conf = float(prob) * 100.0
-                break
+        healthy_hits = _healthy_mask[top3_indices]
+        if healthy_hits.any():
+            healthy_idx = int(top3_indices[healthy_hits.argmax()])  # first (most likely) hit
+            healthy_conf = float(probs[healthy_idx]) * 100.0
 
         # Model's top prediction
-        top_idx = int(np.argmax(probs))
+        top_idx = int(top3_indices[0])
         top_conf = float(probs[top_idx]) * 100.0
         raw_label = idx_to_label.get(top_idx, f"Class_{top_idx}")
 
@@ -231,7 +791,7 @@ def predict_disease(image_path: str) -> Dict:
         healthy_score_combined = (0.6 * healthy_score_combined) + (0.4 * healthy_score_model)
 
         # A rough “unhealthy score”: driven by top disease confidence + symptom burden.
-        symptom_count = sum(1 for v in symptoms.values() if v)
+        symptom_count = bin(symptom_mask).count("1")  # int.bit_count() needs Python 3.10
         unhealthy_score = top_conf + symptom_count * 8.0
 
         is_unhealthy = (unhealthy_score >= healthy_score_combined) and (
@@ -265,11 +825,16 @@ def predict_disease(image_path: str) -> Dict:
         cls_idx = top_idx
         confidence = top_conf
 
-        display_name, crop_type, disease_key, is_healthy = _humanize_label(raw_label)
+        display_name, crop_type, disease_key, is_healthy = _humanized.get(cls_idx) or _humanize_label(raw_label)
 
         # Very low confidence still falls back to heuristic model.
         if confidence < LOW_CONF_THRESHOLD:
-            return fallback_prediction(image_path, reason=f"low_conf({confidence:.1f})", default_crop=crop_type)
+            return fallback_prediction(
+                img,
+                reason=f"low_conf({confidence:.1f})",
+                default_crop=crop_type,
+                precomputed_features=color_features,
+            )
 
         # Disease confidence capping rule:
         # don't allow >80% unless multiple symptom flags are present.
@@ -290,8 +855,15 @@ def predict_disease(image_path: str) -> Dict:
             "prevention": rec["prevention"],
         }
     except Exception as exc:
-        return fallback_prediction(image_path, reason=f"ml_failure: {exc}")
+        return fallback_prediction(img, reason=f"ml_failure: {exc}", precomputed_features=color_features)
+
 
+_CROPS = frozenset({'wheat', 'rice', 'paddy', 'maize', 'corn', 'cotton', 'tomato', 'potato', 'soybean', 'grape', 'apple', 'pepper'})
+# A crop name as a whole '_'/'-' separated token of the label
+_CROP_RE = re.compile(r'(?:^|[_\-])(' + '|'.join(sorted(_CROPS)) + r')(?=[_\-]|$)', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
 def _derive_crop_from_label(label: str) -> Optional[str]:
     base = label.replace('__', '___')  # normalize
     if '___' in base:
@@ -299,14 +871,14 @@ def _derive_crop_from_label(label: str) -> Optional[str]:
         if crop:
             return 'maize' if crop == 'corn_(maize)' or crop == 'corn' else crop
     # fallback by tokens
-    tokens = Path(label).stem.replace('-', '_').split('_')
-    for t in tokens:
-        tl = t.lower()
-        if tl in {'wheat','rice','paddy','maize','corn','cotton','tomato','potato','soybean','grape','apple','pepper'}:
-            return 'maize' if tl == 'corn' else tl
-    return None
+    match = _CROP_RE.search(label)
+    if match is None:
+        return None
+    crop = match.group(1).lower()
+    return 'maize' if crop == 'corn' else crop
 
 
+@functools.lru_cache(maxsize=256)
 def _humanize_label(label: str) -> Tuple[str, Optional[str], str, bool]:
     """
     Convert dataset style labels like 'Corn_(maize)___Common_rust_' into readable strings.
@@ -346,6 +918,7 @@ def _humanize_label(label: str) -> Tuple[str, Optional[str], str, bool]:
     return display, crop.lower() if crop else None, disease, is_healthy
 
 
+@functools.lru_cache(maxsize=256)
 def _recommendations_for_label(disease_name: str, is_healthy: bool) -> Dict[str, str]:
     name = disease_name.lower()
     if is_healthy:
@@ -416,17 +989,28 @@ FALLBACK_LIBRARY = {
 }
 
 
-def fallback_prediction(image_path: str, reason: str = "", default_crop: Optional[str] = None) -> Dict:
-    """Return heuristic prediction based on color statistics when ML fails."""
-    img = Image.open(image_path).convert("RGB").resize((128, 128))
-    arr = np.asarray(img, dtype=np.float32) / 255.0
-    mean_rgb = arr.mean(axis=(0, 1))
-    std_rgb = arr.std(axis=(0, 1))
-    brightness = float(mean_rgb.mean())
-    green_dominance = float(mean_rgb[1] - (mean_rgb[0] + mean_rgb[2]) / 2)
-    yellow_tint = float(mean_rgb[0] + mean_rgb[1] - mean_rgb[2] * 1.4)
-    dryness = float((1 - mean_rgb[1]) + mean_rgb[0]) / 2
-    hash_int = int(hashlib.md5(arr.tobytes()).hexdigest(), 16)
+def fallback_prediction(
+    image: ImageInput,
+    reason: str = "",
+    default_crop: Optional[str] = None,
+    *,
+    precomputed_features: Optional[Dict[str, float]] = None,
+) -> Dict:
+    """
+    Return heuristic prediction based on color statistics when ML fails.
+
+    predict_disease passes the color features it already computed, so the
+    fallback (typically hit when the server is struggling) does no image work.
+    """
+    features = precomputed_features or _extract_color_features(image)
+    mean_r = features["mean_r"]
+    std_rgb = features["std_rgb"]
+    brightness = features["brightness"]
+    green_dominance = features["green_dominance"]
+    yellow_tint = features["yellow_tint"]
+    dryness = features["dryness"]
+    # Deterministic per-image jitter from the image statistics
+    hash_int = zlib.crc32(np.array([features["mean_r"], features["mean_g"], features["mean_b"], std_rgb]).tobytes())
     rng_boost = (hash_int % 23) / 40.0
 
     # If the leaf is overall green and reasonably bright with very low yellowing,
@@ -447,7 +1031,7 @@ def fallback_prediction(image_path: str, reason: str = "", default_crop: Optiona
             "prevention": "Keep following good agronomy practices: crop rotation, balanced fertiliser and timely pest monitoring.",
         }
         base_conf = 82
-    elif std_rgb.mean() > 0.20:
+    elif std_rgb > 0.20:
         disease = "Leaf Spot"
         library = FALLBACK_LIBRARY[disease]
         base_conf = 65
@@ -459,7 +1043,7 @@ def fallback_prediction(image_path: str, reason: str = "", default_crop: Optiona
         disease = "Leaf Blight"
         library = FALLBACK_LIBRARY[disease]
         base_conf = 66
-    elif green_dominance < -0.08 and mean_rgb[0] > 0.4:
+    elif green_dominance < -0.08 and mean_r > 0.4:
         disease = "Rust"
         library = FALLBACK_LIBRARY[disease]
         base_conf = 66
@@ -468,7 +1052,7 @@ def fallback_prediction(image_path: str, reason: str = "", default_crop: Optiona
         library = FALLBACK_LIBRARY[disease]
         base_conf = 64
 
-    confidence = base_conf + int((abs(green_dominance) + std_rgb.mean() + rng_boost) * 20)
+    confidence = base_conf + int((abs(green_dominance) + std_rgb + rng_boost) * 20)
     confidence = max(60, min(confidence, 93))
 
     return {
@@ -483,3 +1067,14 @@ def fallback_prediction(image_path: str, reason: str = "", default_crop: Optiona
     }
 
 
+
+
+if __name__ == '__main__':
+    # Build the cached serving formats ahead of time (e.g. in an image build
+    # step) so the service only loads them: the runtime selected by the
+    # DEEPLEAF_* settings, plus the SavedModel fallback
+    logging.basicConfig(level=logging.INFO)
+    _ensure_model_loaded()
+    if _saved_infer is None:
+        _load_saved_model()
+    logger.info(f"DeepLeaf exports are up to date in {MODELS_DIR}")
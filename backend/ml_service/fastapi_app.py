@@ -1,7 +1,11 @@
+import asyncio
+import functools
+import logging
 import os
-import tempfile
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from fastapi import FastAPI, File, UploadFile, Form
 from fastapi import status
@@ -9,9 +13,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 try:
-    from .deepleaf_inference import predict_disease, fallback_prediction, MODEL_VERSION
+    from .deepleaf_inference import predict_disease_batch, fallback_prediction, warmup, MODEL_VERSION
 except ImportError:
-    from deepleaf_inference import predict_disease, fallback_prediction, MODEL_VERSION
+    from deepleaf_inference import predict_disease_batch, fallback_prediction, warmup, MODEL_VERSION
 from pathlib import Path
 import subprocess
 import threading
@@ -28,6 +32,20 @@ if MONGO_URL:
     except Exception:
         mongo_client = None
         reports_collection = None
+# PyMongo is blocking, so reports are inserted off the event loop
+_report_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reports')
+# Inference and image decoding run here, off the event loop; one worker, as
+# batches already use every core and would only contend with each other
+_inference_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+
+logger = logging.getLogger(__name__)
+
+# Micro-batching: uploads arriving within BATCH_TIMEOUT_MS of each other (at
+# most BATCH_MAX_SIZE of them) share one CNN invocation
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+BATCH_TIMEOUT_MS = float(os.environ.get('BATCH_TIMEOUT_MS', 5))
+_batch_queue: Optional[asyncio.Queue] = None
+_batch_task: Optional[asyncio.Task] = None
 
 app = FastAPI(title="DeepLeaf Disease Detection API")
 app.add_middleware(
@@ -50,6 +68,66 @@ class PredictResponse(BaseModel):
     timestamp: str
 
 
+@app.on_event("startup")
+def warm_model():
+    # Load and warm the model before serving, instead of on the first /predict
+    try:
+        warmup()
+    except Exception as exc:
+        # /predict falls back to the heuristics until a model is available
+        logger.warning(f"DeepLeaf warmup skipped: {exc}")
+
+
+@app.on_event("startup")
+async def start_batcher():
+    global _batch_queue, _batch_task
+    _batch_queue = asyncio.Queue()
+    _batch_task = asyncio.create_task(_batch_worker())
+
+
+async def _batch_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _batch_queue.get()]
+        deadline = loop.time() + BATCH_TIMEOUT_MS / 1000.0
+        while len(batch) < BATCH_MAX_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_batch_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        await _run_batch(batch)
+
+
+async def _run_batch(batch: List[Tuple[bytes, asyncio.Future]]) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        # Off the event loop, so uploads keep being received meanwhile
+        results = await loop.run_in_executor(_inference_pool, predict_disease_batch, [content for content, _ in batch])
+    except Exception as exc:
+        if len(batch) == 1:
+            if not batch[0][1].done():
+                batch[0][1].set_exception(exc)
+            return
+        # An unreadable upload fails the whole batch; rerun the images one by
+        # one so only its own request sees the error
+        for item in batch:
+            await _run_batch([item])
+        return
+    for (_, future), result in zip(batch, results):
+        # Skipped if the request was cancelled meanwhile
+        if not future.done():
+            future.set_result(result)
+
+
+async def _predict(content: bytes) -> dict:
+    future = asyncio.get_running_loop().create_future()
+    await _batch_queue.put((content, future))
+    return await future
+
+
 @app.get("/health")
 def health():
     return {"status": "ok", "modelVersion": MODEL_VERSION}
@@ -57,15 +135,11 @@ def health():
 
 @app.post("/predict", response_model=PredictResponse)
 async def predict(image: UploadFile = File(...), cropType: Optional[str] = Form(None), language: Optional[str] = Form(None)):
-    # Save to temp file
-    suffix = os.path.splitext(image.filename or "upload.jpg")[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        content = await image.read()
-        tmp.write(content)
-        tmp_path = tmp.name
+    # Decoded straight from memory; nothing is written to disk
+    content = await image.read()
 
     try:
-        pred = predict_disease(tmp_path)
+        pred = await _predict(content)
 
         # Map disease to appropriate suggestions based on disease type
         disease_name = pred["disease"].lower()
@@ -99,10 +173,11 @@ async def predict(image: UploadFile = File(...), cropType: Optional[str] = Form(
                 prevention = "Use disease-free seeds, rotate crops, monitor regularly, maintain proper spacing"
         
         severe = float(pred["confidence"]) >= 90.0
+        now = datetime.utcnow()
 
         inferred_crop = pred.get("cropType") or _guess_crop_from_filename(image.filename or "")
         doc = {
-            "timestamp": datetime.utcnow(),
+            "timestamp": now,
             "cropType": cropType or inferred_crop,
             "disease": pred["disease"],
             "confidence": pred["confidence"],
@@ -110,70 +185,73 @@ async def predict(image: UploadFile = File(...), cropType: Optional[str] = Form(
             "alert": severe,
         }
         if reports_collection is not None:
-            try:
-                reports_collection.insert_one(doc)
-            except Exception:
-                pass
+            # Written in the background; the response does not wait for Mongo
+            _report_writer.submit(_save_report, dict(doc))
 
-        return PredictResponse(
-            disease=pred["disease"],
-            confidence=pred["confidence"],
-            suggestions=solution,
-            cause=cause,
-            prevention=prevention,
-            modelVersion=pred["modelVersion"],
-            cropType=doc["cropType"],
-            alert=severe,
-            timestamp=datetime.utcnow().isoformat(),
-        )
+        return _build_response(pred, solution, cause, prevention, doc["cropType"], severe, now)
     except FileNotFoundError:
         inferred_crop = _guess_crop_from_filename(image.filename or "")
-        fb = fallback_prediction(tmp_path, reason="model_missing")
+        fb = await _run_fallback(content, "model_missing")
         crop_name = cropType or inferred_crop or fb.get("cropType")
         alert_flag = fb["confidence"] >= 85
-        return PredictResponse(
-            disease=fb["disease"],
-            confidence=fb["confidence"],
-            suggestions=fb["suggestions"],
-            cause=fb["cause"],
-            prevention=fb["prevention"],
-            modelVersion=fb["modelVersion"],
-            cropType=crop_name,
-            alert=alert_flag,
-            timestamp=datetime.utcnow().isoformat(),
-        )
+        return _build_response(fb, fb["suggestions"], fb["cause"], fb["prevention"], crop_name, alert_flag)
     except Exception as e:
         inferred_crop = _guess_crop_from_filename(image.filename or "")
-        fb = fallback_prediction(tmp_path, reason=str(e))
+        fb = await _run_fallback(content, str(e))
         crop_name = cropType or inferred_crop or fb.get("cropType")
         alert_flag = fb["confidence"] >= 85
-        return PredictResponse(
-            disease=fb["disease"],
-            confidence=fb["confidence"],
-            suggestions=fb["suggestions"] + f" (fallback due to: {str(e)})",
-            cause=fb["cause"],
-            prevention=fb["prevention"],
-            modelVersion=fb["modelVersion"],
-            cropType=crop_name,
-            alert=alert_flag,
-            timestamp=datetime.utcnow().isoformat(),
-        )
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+        suggestions = fb["suggestions"] + f" (fallback due to: {str(e)})"
+        return _build_response(fb, suggestions, fb["cause"], fb["prevention"], crop_name, alert_flag)
+
+
+async def _run_fallback(content: bytes, reason: str) -> dict:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_inference_pool, functools.partial(fallback_prediction, content, reason=reason))
+
+
+def _save_report(doc: dict) -> None:
+    try:
+        reports_collection.insert_one(doc)
+    except Exception:
+        pass
+
+
+def _build_response(
+    pred: dict,
+    suggestions: str,
+    cause: str,
+    prevention: str,
+    crop_type: Optional[str],
+    alert: bool,
+    now: Optional[datetime] = None,
+) -> PredictResponse:
+    """PredictResponse for a predict_disease or fallback_prediction result"""
+    return PredictResponse(
+        disease=pred["disease"],
+        confidence=pred["confidence"],
+        suggestions=suggestions,
+        cause=cause,
+        prevention=prevention,
+        modelVersion=pred["modelVersion"],
+        cropType=crop_type,
+        alert=alert,
+        timestamp=(now or datetime.utcnow()).isoformat(),
+    )
+
+
+_FILENAME_CROPS = frozenset({"wheat", "rice", "paddy", "maize", "corn", "cotton", "tomato", "potato", "soybean", "grape"})
+# A crop name as a whole '_'/'-' separated token of the file name
+_FILENAME_CROP_RE = re.compile(r'(?:^|[_\-])(' + '|'.join(sorted(_FILENAME_CROPS)) + r')(?=[_\-]|$)', re.IGNORECASE)
 
 
 def _guess_crop_from_filename(name: str) -> Optional[str]:
     base = os.path.splitext(os.path.basename(name))[0]
     # simple heuristics
-    tokens = base.replace('-', '_').split('_')
-    for t in tokens:
-        t_low = t.lower()
-        if t_low in {"wheat", "rice", "paddy", "maize", "corn", "cotton", "tomato", "potato", "soybean", "grape"}:
-            return "paddy" if t_low == "rice" else ("maize" if t_low == "corn" else t_low)
-    return None
+    match = _FILENAME_CROP_RE.search(base)
+    if match is None:
+        return None
+    t_low = match.group(1).lower()
+    return "paddy" if t_low == "rice" else ("maize" if t_low == "corn" else t_low)
 
 
 # --- Training orchestration (optional) ---
@@ -0,0 +1,24 @@
+"""
+Gunicorn configuration for the Flask ML service
+
+    gunicorn -c gunicorn.conf.py app:app
+
+One worker process with many threads shares a single loaded model; the
+threads overlap HTTP parsing and image decoding while the micro-batcher
+groups their forward passes. The model is loaded after fork in each worker
+(TensorFlow's thread pools do not survive fork, so --preload is not used).
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# Model loading (and TFLite/ONNX conversion on first start) can take minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+
+def post_worker_init(worker):
+    """Load the model in the background so the worker answers /health right away"""
+    from app import load_model_in_background
+    load_model_in_background()
@@ -5,8 +5,9 @@ Combines image features (CNN) with tabular features (crop type, stage, weather,
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.layers import Input, Dense, Dropout, GlobalAveragePooling2D, Embedding, Concatenate, BatchNormalization
+from tensorflow.keras.layers import Input, Dense, Dropout, GlobalAveragePooling2D, Embedding, Concatenate, BatchNormalization, Rescaling, Flatten
 import numpy as np
+import functools
 
 # Crop types for embedding
 CROP_TYPES = [
@@ -17,7 +18,41 @@ CROP_TYPES = [
 # Crop stages for encoding
 CROP_STAGES = ['Seedling', 'Vegetative', 'Flowering', 'Fruiting / Grain Filling']
 
-def create_multi_modal_model():
+def configure_mixed_precision(policy: str = None) -> str:
+    """
+    Set the Keras dtype policy for models built from here on and return it:
+    `policy` if given, else mixed_float16 on GPUs with Tensor Cores (compute
+    capability 7.0+), else float32. Under mixed_float16, compile() wraps the
+    optimizer in a LossScaleOptimizer by itself.
+    """
+    if policy is None:
+        policy = 'float32'
+        gpus = tf.config.list_physical_devices('GPU')
+        if gpus:
+            details = tf.config.experimental.get_device_details(gpus[0])
+            if (details.get('compute_capability') or (0, 0)) >= (7, 0):
+                policy = 'mixed_float16'
+    keras.mixed_precision.set_global_policy(policy)
+    return policy
+
+_LOSSES = {
+    'health_status': 'categorical_crossentropy',
+    'disease_detection': 'binary_crossentropy',
+    'crop_stress_auxiliary': 'binary_crossentropy'  # Auxiliary loss
+}
+# Higher weight on auxiliary loss to force crop-specific learning
+_LOSS_WEIGHTS = {
+    'health_status': 1.0,
+    'disease_detection': 1.0,
+    'crop_stress_auxiliary': 0.3  # Weight for auxiliary loss
+}
+_METRICS = {
+    'health_status': 'accuracy',
+    'disease_detection': 'binary_accuracy',
+    'crop_stress_auxiliary': 'mse'
+}
+
+def create_multi_modal_model(alpha: float = 1.0, learning_rate: float = 0.001, jit_compile: bool = False):
     """
     Create a multi-modal model that combines:
     - Image features (from CNN)
@@ -25,23 +60,37 @@ def create_multi_modal_model():
     - Crop stage (one-hot encoded)
     - Weather features (temperature, humidity, rainfall)
     - Soil features (pH, moisture)
+    
+    For inference, call the model directly (model(inputs, training=False)),
+    or a tf.function traced from it with a fixed input signature as app.py
+    does, rather than model.predict, which builds a data adapter and
+    callbacks on every call.
+    
+    Args:
+        alpha: MobileNetV2 width multiplier (ImageNet weights exist for
+            0.35, 0.5, 0.75, 1.0, 1.3, 1.4); smaller is cheaper to serve
+        learning_rate: Adam learning rate the model is compiled with
+        jit_compile: compile the training step with XLA (worth it on GPU)
     """
     
     # ========== IMAGE BRANCH ==========
-    # Image input: 224x224x3 RGB images
+    # Image input: 224x224x3 RGB images, raw 0-255 pixel values
     image_input = Input(shape=(224, 224, 3), name='image_input')
+    # MobileNetV2 scaling (x / 127.5 - 1) in the graph, on the same device as the CNN
+    normalized_image = Rescaling(1.0 / 127.5, offset=-1.0, name='normalize')(image_input)
     
     # Pre-trained MobileNetV2 for image feature extraction
     base_model = MobileNetV2(
         input_shape=(224, 224, 3),
+        alpha=alpha,
         include_top=False,
         weights='imagenet'
     )
     base_model.trainable = False  # Freeze initially
     
     # Extract image features
-    image_features = base_model(image_input, training=False)
-    image_features = GlobalAveragePooling2D()(image_features)
+    image_features = base_model(normalized_image, training=False)
+    image_features = GlobalAveragePooling2D(name='image_pool')(image_features)
     image_features = Dense(128, activation='relu', name='image_dense')(image_features)
     image_features = BatchNormalization()(image_features)
     image_features = Dropout(0.3)(image_features)
@@ -56,7 +105,7 @@ def create_multi_modal_model():
         output_dim=32,  # INCREASED from 16 to 32 for stronger crop signal
         name='crop_type_embedding'
     )(crop_type_input)
-    crop_type_embedding = tf.squeeze(crop_type_embedding, axis=1)  # Remove dimension
+    crop_type_embedding = Flatten()(crop_type_embedding)  # Remove dimension
     # Add dense layer to strengthen crop embedding contribution
     crop_type_embedding = Dense(32, activation='relu', name='crop_type_dense')(crop_type_embedding)
     crop_type_embedding = BatchNormalization()(crop_type_embedding)
@@ -77,14 +126,12 @@ def create_multi_modal_model():
     
     # ========== CROP-CONDITIONED FEATURE INTERACTION ==========
     # Force model to learn crop-specific responses to weather/soil
-    # Combine crop embedding with weather and soil BEFORE concatenation
-    crop_weather_interaction = Concatenate(name='crop_weather_interaction')([crop_type_embedding, weather_dense])
-    crop_weather_interaction = Dense(32, activation='relu', name='crop_weather_dense')(crop_weather_interaction)
-    crop_weather_interaction = BatchNormalization()(crop_weather_interaction)
-    
-    crop_soil_interaction = Concatenate(name='crop_soil_interaction')([crop_type_embedding, soil_dense])
-    crop_soil_interaction = Dense(24, activation='relu', name='crop_soil_dense')(crop_soil_interaction)
-    crop_soil_interaction = BatchNormalization()(crop_soil_interaction)
+    # Combine crop embedding with weather and soil BEFORE concatenation, in
+    # one Dense: a single matmul that reads the crop embedding once, where
+    # separate weather (32) and soil (24) interaction layers needed two
+    crop_interaction = Concatenate(name='crop_interaction')([crop_type_embedding, weather_dense, soil_dense])
+    crop_interaction = Dense(56, activation='relu', name='crop_interaction_dense')(crop_interaction)
+    crop_interaction = BatchNormalization()(crop_interaction)
     
     # ========== CONCATENATE ALL FEATURES ==========
     # Combine all feature branches (including crop-conditioned interactions)
@@ -92,11 +139,10 @@ def create_multi_modal_model():
         image_features,              # 128 dim
         crop_type_embedding,         # 32 dim (increased)
         crop_stage_input,            # 4 dim
-        crop_weather_interaction,    # 32 dim (crop-conditioned weather response)
-        crop_soil_interaction,       # 24 dim (crop-conditioned soil response)
+        crop_interaction,            # 56 dim (crop-conditioned weather and soil response)
     ])
-    # Total: 128 + 32 + 4 + 32 + 24 = 220 dimensions
-    # Crop features now contribute 32 + 32 + 24 = 88 dims (40% of total)
+    # Total: 128 + 32 + 4 + 56 = 220 dimensions
+    # Crop features now contribute 32 + 56 = 88 dims (40% of total)
     
     # ========== FUSION LAYERS ==========
     # Allow model to learn interactions between features
@@ -109,16 +155,17 @@ def create_multi_modal_model():
     fused = Dropout(0.3)(fused)
     
     # ========== OUTPUT LAYERS ==========
+    # Outputs stay float32 so softmax/sigmoid are stable under a mixed_float16 policy
     # Health status: 3 classes (healthy, moderate, critical)
-    health_output = Dense(3, activation='softmax', name='health_status')(fused)
+    health_output = Dense(3, activation='softmax', name='health_status', dtype='float32')(fused)
     
     # Disease detection: 8 disease types (multi-label binary)
-    disease_output = Dense(8, activation='sigmoid', name='disease_detection')(fused)
+    disease_output = Dense(8, activation='sigmoid', name='disease_detection', dtype='float32')(fused)
     
     # ========== AUXILIARY OUTPUT FOR CROP-SPECIFIC LEARNING ==========
     # Auxiliary loss: Predict crop-conditioned stress score
     # This forces the model to learn crop-specific responses to conditions
-    crop_stress_output = Dense(1, activation='sigmoid', name='crop_stress_auxiliary')(
+    crop_stress_output = Dense(1, activation='sigmoid', name='crop_stress_auxiliary', dtype='float32')(
         Concatenate()([crop_type_embedding, weather_dense, soil_dense])
     )
     
@@ -136,45 +183,198 @@ def create_multi_modal_model():
     )
     
     # Compile model with weighted losses
-    # Higher weight on auxiliary loss to force crop-specific learning
     model.compile(
-        optimizer=keras.optimizers.Adam(learning_rate=0.001),
-        loss={
-            'health_status': 'categorical_crossentropy',
-            'disease_detection': 'binary_crossentropy',
-            'crop_stress_auxiliary': 'binary_crossentropy'  # Auxiliary loss
-        },
-        loss_weights={
-            'health_status': 1.0,
-            'disease_detection': 1.0,
-            'crop_stress_auxiliary': 0.3  # Weight for auxiliary loss
-        },
-        metrics={
-            'health_status': 'accuracy',
-            'disease_detection': 'binary_accuracy',
-            'crop_stress_auxiliary': 'mse'
-        }
+        optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
+        loss=_LOSSES,
+        loss_weights=_LOSS_WEIGHTS,
+        metrics=_METRICS,
+        jit_compile=jit_compile
     )
     
     return model, base_model
 
+def create_head_only_model(model, learning_rate: float = 0.001, jit_compile: bool = False):
+    """
+    Split a multi-modal model at its pooled image features ('image_pool')
+    
+    Returns (feature_model, head_model): feature_model maps images to the
+    pooled MobileNetV2 features, head_model takes those features (first
+    input) plus the tabular inputs and produces the model outputs. Both share
+    the model's layers, so training the compiled head_model on precomputed
+    features trains the model's head in place. Only valid while the backbone
+    is frozen.
+    """
+    image_pool = model.get_layer('image_pool')
+    feature_model = keras.Model(model.inputs[0], image_pool.output, name='image_features')
+    
+    # Re-apply the layers after image_pool to a new features Input (Keras 3
+    # cannot save a model once a sub-model starts at one of its inner tensors)
+    features = Input(shape=image_pool.output.shape[1:], name='image_features_input')
+    tensors = {id(image_pool.output): features}
+    tensors.update({id(tensor): tensor for tensor in model.inputs[1:]})
+    # Read before any layer is re-applied (and gets a second inbound node)
+    connections = [
+        (layer, layer.input, layer.output) for layer in model.layers
+        if not isinstance(layer, keras.layers.InputLayer)
+    ]
+    for layer, inputs, output in connections:
+        flat_inputs = list(inputs) if isinstance(inputs, (list, tuple)) else [inputs]
+        if id(output) in tensors or any(id(tensor) not in tensors for tensor in flat_inputs):
+            continue  # the backbone, or already mapped
+        mapped = [tensors[id(tensor)] for tensor in flat_inputs]
+        tensors[id(output)] = layer(mapped if isinstance(inputs, (list, tuple)) else mapped[0])
+    head_outputs = [tensors[id(tensor)] for tensor in model.outputs]
+    head_model = keras.Model([features] + model.inputs[1:], head_outputs, name='multi_modal_head')
+    head_model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
+        loss=_LOSSES,
+        loss_weights=_LOSS_WEIGHTS,
+        metrics=_METRICS,
+        jit_compile=jit_compile
+    )
+    return feature_model, head_model
+
+def unfreeze_top_layers(base_model, num_layers: int = 30):
+    """
+    Make only the last `num_layers` layers of the backbone trainable for
+    fine-tuning; earlier layers keep their generic ImageNet features and
+    need no gradients. BatchNormalization layers stay frozen, so fine-tuning
+    keeps their ImageNet statistics. Recompile afterwards.
+    """
+    base_model.trainable = True
+    for i, layer in enumerate(base_model.layers):
+        layer.trainable = (
+            i >= len(base_model.layers) - num_layers
+            and not isinstance(layer, keras.layers.BatchNormalization)
+        )
+
+def quantize_model_int8(model, representative_dataset, sparse: bool = False):
+    """
+    Full-integer post-training quantization for deployment (int8 weights and
+    activations, int8 image/tabular inputs and outputs; the crop type index
+    stays int32)
+
+    Args:
+        model: Trained Keras model
+        representative_dataset: Callable returning an iterator of calibration
+            samples, each a dict of batch-size-1 arrays keyed by input name
+        sparse: Store the weights of pruned layers in TFLite's sparse format,
+            which XNNPACK can run as sparse kernels
+
+    Returns:
+        The TFLite flatbuffer (bytes)
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if sparse:
+        converter.optimizations.append(tf.lite.Optimize.EXPERIMENTAL_SPARSITY)
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    return converter.convert()
+
+class QuantizedEmbedding(keras.layers.Layer):
+    """
+    Embedding lookup over an int8 table with one float32 scale per row:
+    a byte gather and a scalar dequantize instead of a float32 gather
+    """
+
+    def __init__(self, table, scales, **kwargs):
+        super().__init__(**kwargs)
+        self.table = tf.constant(np.asarray(table, dtype=np.int8))
+        self.scales = tf.constant(np.asarray(scales, dtype=np.float32)[:, None])
+
+    def call(self, inputs):
+        rows = tf.gather(self.table, inputs)
+        return tf.cast(rows, tf.float32) * tf.gather(self.scales, inputs)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'table': self.table.numpy().tolist(), 'scales': self.scales.numpy()[:, 0].tolist()})
+        return config
+
+def quantize_embedding_weights(weights: np.ndarray):
+    """Symmetric per-row int8 quantization: (int8 table, float32 scale per row)"""
+    scales = np.abs(weights).max(axis=1) / 127.0
+    # All-zero rows (e.g. an unused crop) would divide by zero
+    scales[scales == 0] = 1.0
+    table = np.clip(np.round(weights / scales[:, None]), -127, 127).astype(np.int8)
+    return table, scales.astype(np.float32)
+
+def with_quantized_crop_embedding(model):
+    """
+    The same model with crop_type_embedding swapped for a QuantizedEmbedding;
+    every other layer (and its trained weights) is shared with `model`.
+    Models without the embedding (legacy image-only) are returned unchanged.
+    """
+    names = {layer.name for layer in model.layers}
+    if 'crop_type_embedding' not in names:
+        return model
+
+    def swap_embedding(layer):
+        if layer.name != 'crop_type_embedding':
+            return layer
+        table, scales = quantize_embedding_weights(layer.get_weights()[0])
+        return QuantizedEmbedding(table, scales, name=layer.name)
+
+    return keras.models.clone_model(model, clone_function=swap_embedding)
+
+def write_embedding_table(model, table_path: str):
+    """
+    Write the crop_type_embedding per-row int8 scales as an ncnn-style
+    calibration table (`<layer>_param_<row> <127 / max abs>` per line), so a
+    quantized export can be reproduced
+    """
+    _, scales = quantize_embedding_weights(model.get_layer('crop_type_embedding').get_weights()[0])
+    with open(table_path, 'w') as f:
+        for row, scale in enumerate(scales):
+            f.write(f"crop_type_embedding_param_{row} {1.0 / scale:.8g}\n")
+
+def _input_row(values, dtype='float32') -> np.ndarray:
+    """A read-only (1, n) model input row, shared by every request that needs it"""
+    row = np.array([values], dtype=dtype)
+    row.flags.writeable = False
+    return row
+
+_CROP_TYPE_INDEX = {name: i for i, name in enumerate(CROP_TYPES)}
+_CROP_STAGE_INDEX = {name: i for i, name in enumerate(CROP_STAGES)}
+# Read-only rows: one-hot per stage, and uniform for an unknown stage
+_CROP_STAGE_ONEHOT = np.eye(len(CROP_STAGES), dtype=np.float32)
+_CROP_STAGE_ONEHOT.flags.writeable = False
+_UNIFORM_CROP_STAGE = np.full(len(CROP_STAGES), 1.0 / len(CROP_STAGES), dtype=np.float32)
+_UNIFORM_CROP_STAGE.flags.writeable = False
+
 def get_crop_type_index(crop_type: str) -> int:
     """Convert crop type string to index for embedding"""
-    try:
-        return CROP_TYPES.index(crop_type)
-    except ValueError:
-        return 0  # Default to first crop if not found
+    # Default to first crop if not found
+    return _CROP_TYPE_INDEX.get(crop_type, 0)
 
 def encode_crop_stage(crop_stage: str) -> np.ndarray:
-    """One-hot encode crop stage"""
-    encoding = np.zeros(len(CROP_STAGES))
-    try:
-        idx = CROP_STAGES.index(crop_stage)
-        encoding[idx] = 1.0
-    except ValueError:
-        # If stage not found, use uniform distribution
-        encoding.fill(1.0 / len(CROP_STAGES))
-    return encoding
+    """One-hot encode crop stage (a shared read-only array)"""
+    idx = _CROP_STAGE_INDEX.get(crop_stage)
+    # If stage not found, use uniform distribution
+    return _UNIFORM_CROP_STAGE if idx is None else _CROP_STAGE_ONEHOT[idx]
+
+# Every possible crop type / crop stage input, built once instead of per request
+_CROP_TYPE_ROWS = [_input_row([i], dtype='int32') for i in range(len(CROP_TYPES))]
+_CROP_STAGE_ROWS = {stage: _CROP_STAGE_ONEHOT[i:i + 1] for stage, i in _CROP_STAGE_INDEX.items()}
+_UNKNOWN_CROP_STAGE_ROW = _UNIFORM_CROP_STAGE[np.newaxis]
+_NO_CROP_STAGE_ROW = _input_row(np.zeros(len(CROP_STAGES)))
+_DEFAULT_WEATHER_ROW = _input_row([0.5, 0.5, 0.0])
+_DEFAULT_SOIL_ROW = _input_row([0.5, 0.3])
+
+# Photos of one field share its weather and soil readings, so the normalized
+# rows are cached by raw value (lru_cache is thread-safe)
+@functools.lru_cache(maxsize=256)
+def _weather_row(temp, humidity, rain) -> np.ndarray:
+    # Normalized to 0-1 (assuming max 50°C and 200mm rain)
+    return _input_row([temp / 50.0, humidity / 100.0, min(rain / 200.0, 1.0)])
+
+@functools.lru_cache(maxsize=256)
+def _soil_row(ph, moisture) -> np.ndarray:
+    # pH normalized from the 5-8 range, moisture from percent
+    return _input_row([(ph - 5.0) / 3.0, moisture / 100.0])
 
 def prepare_features_for_inference(
     image_array: np.ndarray,
@@ -187,41 +387,37 @@ def prepare_features_for_inference(
     Prepare all features for model inference
     
     Args:
-        image_array: Preprocessed image array (224, 224, 3)
+        image_array: Resized image array (224, 224, 3) of raw 0-255 pixels;
+            the model normalizes it in-graph
         crop_type: Crop type string
         crop_stage: Crop stage string (optional)
         weather: Dict with 'temp', 'humidity', 'rain' (optional)
         soil: Dict with 'ph', 'moisture' (optional)
     
     Returns:
-        Dictionary with all model inputs
+        Dictionary with all model inputs; the tabular ones may be shared
+        read-only arrays
     """
     # Crop type embedding index
-    crop_type_idx = np.array([[get_crop_type_index(crop_type)]], dtype='int32')
+    crop_type_idx = _CROP_TYPE_ROWS[get_crop_type_index(crop_type)]
     
     # Crop stage one-hot encoding
     if crop_stage:
-        crop_stage_encoded = encode_crop_stage(crop_stage)
+        crop_stage_encoded = _CROP_STAGE_ROWS.get(crop_stage, _UNKNOWN_CROP_STAGE_ROW)
     else:
-        crop_stage_encoded = np.zeros(len(CROP_STAGES))
-    crop_stage_encoded = np.expand_dims(crop_stage_encoded, axis=0)
+        crop_stage_encoded = _NO_CROP_STAGE_ROW
     
     # Weather features (normalized)
     if weather:
-        temp = weather.get('temp', 25.0) / 50.0  # Normalize to 0-1 (assuming max 50°C)
-        humidity = weather.get('humidity', 50.0) / 100.0  # Normalize to 0-1
-        rain = min(weather.get('rain', 0.0) / 200.0, 1.0)  # Normalize to 0-1 (assuming max 200mm)
-        weather_features = np.array([[temp, humidity, rain]], dtype='float32')
+        weather_features = _weather_row(weather.get('temp', 25.0), weather.get('humidity', 50.0), weather.get('rain', 0.0))
     else:
-        weather_features = np.array([[0.5, 0.5, 0.0]], dtype='float32')  # Default values
+        weather_features = _DEFAULT_WEATHER_ROW  # Default values
     
     # Soil features (normalized)
     if soil:
-        ph = (soil.get('ph', 6.5) - 5.0) / 3.0  # Normalize pH (5-8 range) to 0-1
-        moisture = soil.get('moisture', 30.0) / 100.0  # Normalize to 0-1
-        soil_features = np.array([[ph, moisture]], dtype='float32')
+        soil_features = _soil_row(soil.get('ph', 6.5), soil.get('moisture', 30.0))
     else:
-        soil_features = np.array([[0.5, 0.3]], dtype='float32')  # Default values
+        soil_features = _DEFAULT_SOIL_ROW  # Default values
     
     return {
         'image_input': image_array,
@@ -230,4 +426,3 @@ def prepare_features_for_inference(
         'weather_input': weather_features,
         'soil_input': soil_features
     }
-
@@ -5,6 +5,40 @@ NO static templates - all insights derived from model predictions
 import numpy as np
 from model_architecture import CROP_TYPES, CROP_STAGES
 
+HEALTH_STATUSES = ('healthy', 'moderate', 'critical')
+DISEASE_TYPES = (
+    'yellowing', 'browning', 'dark_spots', 'pest_damage',
+    'low_vigor', 'fungal_infection', 'bacterial_spot', 'leaf_curl'
+)
+
+# Description/recommendation templates, formatted with model outputs per request
+DISEASE_META = {
+    disease_type: {
+        'desc_tpl': 'Model detected ' + disease_type.replace('_', ' ') + ' with {conf:.1f}% confidence. This prediction is based on learned patterns from training data.',
+        'recs': ()
+    }
+    for disease_type in DISEASE_TYPES
+}
+
+HEALTHY_DESC_TPL = 'Model assessment for {crop}: Healthy condition predicted ({conf:.1f}% confidence). {crop}-specific analysis indicates good health.'
+HEALTHY_REC_TPL = 'Model assessment for {crop}: Continue current management practices. {crop} shows positive health indicators.'
+CRITICAL_DESC_TPL = 'Model assessment for {crop}: Critical health condition predicted ({prob:.1f}% probability). {crop}-specific analysis indicates severe stress.'
+CRITICAL_REC_TPL = 'Model assessment for {crop}: Immediate intervention required. {crop} shows critical stress response under current conditions.'
+MODERATE_DESC_TPL = 'Model assessment for {crop}: Moderate stress conditions detected ({prob:.1f}% probability). {crop}-specific indicators show stress.'
+MODERATE_REC_TPL = 'Model assessment for {crop}: Monitor closely. {crop} shows moderate stress response that requires attention.'
+
+# Crop-specific recommendations
+STRONG_HEALTHY_REC_TPL = 'Model assessment for {crop}: Strong healthy signal ({prob:.1f}% probability). {crop} appears well-adapted to current conditions.'
+STRESS_REC_TPL = 'Model assessment for {crop}: Moderate stress detected ({prob:.1f}% probability). {crop} may require attention under these conditions.'
+CRITICAL_SIGNAL_REC_TPL = 'Model assessment for {crop}: Critical condition indicated ({prob:.1f}% probability). {crop} shows significant stress response.'
+LOW_TEMP_REC_TPL = 'Model indicates {crop} shows sensitivity to low temperatures ({temp}°C) - prediction confidence: {conf:.1f}%'
+HIGH_TEMP_REC_TPL = 'Model indicates {crop} shows sensitivity to high temperatures ({temp}°C) - prediction confidence: {conf:.1f}%'
+HUMIDITY_REC_TPL = 'Model suggests {crop} may be affected by high humidity ({humidity}%) - current prediction: {status}'
+STAGE_REC_TPL = 'Model assessment for {crop} at {stage} stage: {status} condition predicted ({conf:.1f}% confidence). Crop-specific response detected.'
+SOIL_PH_REC_TPL = 'Model assessment suggests soil pH ({ph:.1f}) may be contributing to stress conditions for {crop}.'
+LOW_MOISTURE_REC_TPL = 'Model indicates low soil moisture ({moisture}%) may be affecting {crop} health.'
+HIGH_MOISTURE_REC_TPL = 'Model suggests high soil moisture ({moisture}%) may be causing stress in {crop}.'
+
 def generate_insights_from_model(
     health_pred: np.ndarray,
     disease_pred: np.ndarray,
@@ -38,56 +72,63 @@ def generate_insights_from_model(
     issues = []
     recommendations = []
     
-    # Get health status from model prediction
-    health_idx = np.argmax(health_pred)
-    health_status = ['healthy', 'moderate', 'critical'][health_idx]
-    confidence = float(health_pred[health_idx] * 100)
+    # Get health status from model prediction; the probabilities are
+    # converted to Python floats once instead of per comparison
+    health_probs = np.asarray(health_pred).tolist()
+    healthy_prob, moderate_prob, critical_prob = health_probs
+    health_idx = int(np.argmax(health_pred))
+    health_status = HEALTH_STATUSES[health_idx]
+    confidence = health_probs[health_idx] * 100
     
     # Model-derived health assessment - CROP-SPECIFIC
     if health_status == 'healthy':
         issues.append({
             'type': 'healthy',
             'severity': 'none',
-            'description': f'Model assessment for {crop_type}: Healthy condition predicted ({confidence:.1f}% confidence). {crop_type}-specific analysis indicates good health.'
+            'description': HEALTHY_DESC_TPL.format(crop=crop_type, conf=confidence)
         })
-        recommendations.append(f'Model assessment for {crop_type}: Continue current management practices. {crop_type} shows positive health indicators.')
+        recommendations.append(HEALTHY_REC_TPL.format(crop=crop_type))
     else:
         # Model indicates health issues - derive from prediction probabilities - CROP-SPECIFIC
-        if health_pred[2] > 0.3:  # Critical probability
+        if critical_prob > 0.3:  # Critical probability
             issues.append({
                 'type': 'critical_condition',
                 'severity': 'high',
-                'description': f'Model assessment for {crop_type}: Critical health condition predicted ({health_pred[2]*100:.1f}% probability). {crop_type}-specific analysis indicates severe stress.'
+                'description': CRITICAL_DESC_TPL.format(crop=crop_type, prob=critical_prob * 100)
             })
-            recommendations.append(f'Model assessment for {crop_type}: Immediate intervention required. {crop_type} shows critical stress response under current conditions.')
+            recommendations.append(CRITICAL_REC_TPL.format(crop=crop_type))
         
-        if health_pred[1] > 0.4:  # Moderate probability
+        if moderate_prob > 0.4:  # Moderate probability
             issues.append({
                 'type': 'moderate_stress',
                 'severity': 'moderate',
-                'description': f'Model assessment for {crop_type}: Moderate stress conditions detected ({health_pred[1]*100:.1f}% probability). {crop_type}-specific indicators show stress.'
+                'description': MODERATE_DESC_TPL.format(crop=crop_type, prob=moderate_prob * 100)
             })
-            recommendations.append(f'Model assessment for {crop_type}: Monitor closely. {crop_type} shows moderate stress response that requires attention.')
+            recommendations.append(MODERATE_REC_TPL.format(crop=crop_type))
     
-    # Disease detection from model outputs
+    # Disease detection from model outputs: one vectorized threshold, then a
+    # loop over the (usually zero to two) detected diseases only
     detected_diseases = []
-    for i, disease_type in enumerate([
-        'yellowing', 'browning', 'dark_spots', 'pest_damage',
-        'low_vigor', 'fungal_infection', 'bacterial_spot', 'leaf_curl'
-    ]):
-        if disease_pred[i] > 0.5:
-            detected_diseases.append({
-                'type': disease_type,
-                'confidence': float(disease_pred[i] * 100),
-                'severity': 'high' if disease_pred[i] > 0.7 else 'moderate'
-            })
-            
-            # Model-derived disease description
-            issues.append({
-                'type': disease_type,
-                'severity': 'high' if disease_pred[i] > 0.7 else 'moderate',
-                'description': f'Model detected {disease_type.replace("_", " ")} with {disease_pred[i]*100:.1f}% confidence. This prediction is based on learned patterns from training data.'
-            })
+    disease_pred = np.asarray(disease_pred)
+    detected = np.flatnonzero(disease_pred > 0.5)
+    for i, prob in zip(detected.tolist(), disease_pred[detected].tolist()):
+        disease_type = DISEASE_TYPES[i]
+        disease_conf = prob * 100
+        severity = 'high' if prob > 0.7 else 'moderate'
+        detected_diseases.append({
+            'type': disease_type,
+            'confidence': disease_conf,
+            'severity': severity
+        })
+
+        # Model-derived disease description
+        meta = DISEASE_META[disease_type]
+        issues.append({
+            'type': disease_type,
+            'severity': severity,
+            'description': meta['desc_tpl'].format(conf=disease_conf)
+        })
+        recommendations.extend(meta['recs'])
     
     # CROP-SPECIFIC INSIGHTS FROM MODEL - MUST SHOW CROP DIFFERENCES
     # Use model's crop-conditioned predictions to generate CROP-SPECIFIC insights
@@ -95,24 +136,13 @@ def generate_insights_from_model(
         # Generate crop-specific insights based on ACTUAL model predictions
         # Different crops MUST produce different insights
         
-        # Get crop-specific health probability pattern
-        healthy_prob = health_pred[0]
-        moderate_prob = health_pred[1]
-        critical_prob = health_pred[2]
-        
         # Crop-specific insight based on prediction pattern
         if healthy_prob > 0.7:
-            recommendations.append(
-                f'Model assessment for {crop_type}: Strong healthy signal ({healthy_prob*100:.1f}% probability). {crop_type} appears well-adapted to current conditions.'
-            )
+            recommendations.append(STRONG_HEALTHY_REC_TPL.format(crop=crop_type, prob=healthy_prob * 100))
         elif moderate_prob > 0.5:
-            recommendations.append(
-                f'Model assessment for {crop_type}: Moderate stress detected ({moderate_prob*100:.1f}% probability). {crop_type} may require attention under these conditions.'
-            )
+            recommendations.append(STRESS_REC_TPL.format(crop=crop_type, prob=moderate_prob * 100))
         elif critical_prob > 0.3:
-            recommendations.append(
-                f'Model assessment for {crop_type}: Critical condition indicated ({critical_prob*100:.1f}% probability). {crop_type} shows significant stress response.'
-            )
+            recommendations.append(CRITICAL_SIGNAL_REC_TPL.format(crop=crop_type, prob=critical_prob * 100))
         
         if weather:
             # Model-derived weather sensitivity - CROP-SPECIFIC
@@ -122,25 +152,17 @@ def generate_insights_from_model(
             # Crop-specific temperature sensitivity based on predictions
             if health_status != 'healthy':
                 if temp < 15:
-                    recommendations.append(
-                        f'Model indicates {crop_type} shows sensitivity to low temperatures ({temp}°C) - prediction confidence: {confidence:.1f}%'
-                    )
+                    recommendations.append(LOW_TEMP_REC_TPL.format(crop=crop_type, temp=temp, conf=confidence))
                 elif temp > 35:
-                    recommendations.append(
-                        f'Model indicates {crop_type} shows sensitivity to high temperatures ({temp}°C) - prediction confidence: {confidence:.1f}%'
-                    )
+                    recommendations.append(HIGH_TEMP_REC_TPL.format(crop=crop_type, temp=temp, conf=confidence))
                 
                 if humidity > 80:
-                    recommendations.append(
-                        f'Model suggests {crop_type} may be affected by high humidity ({humidity}%) - current prediction: {health_status}'
-                    )
+                    recommendations.append(HUMIDITY_REC_TPL.format(crop=crop_type, humidity=humidity, status=health_status))
         
         if crop_stage:
             # Model-derived stage-specific insights - CROP-SPECIFIC
             if health_status != 'healthy':
-                recommendations.append(
-                    f'Model assessment for {crop_type} at {crop_stage} stage: {health_status} condition predicted ({confidence:.1f}% confidence). Crop-specific response detected.'
-                )
+                recommendations.append(STAGE_REC_TPL.format(crop=crop_type, stage=crop_stage, status=health_status, conf=confidence))
     
     # SOIL INSIGHTS FROM MODEL
     if soil and health_status != 'healthy':
@@ -149,24 +171,18 @@ def generate_insights_from_model(
         
         # Model-derived soil sensitivity
         if ph < 6.0 or ph > 7.5:
-            recommendations.append(
-                f'Model assessment suggests soil pH ({ph:.1f}) may be contributing to stress conditions for {crop_type}.'
-            )
+            recommendations.append(SOIL_PH_REC_TPL.format(ph=ph, crop=crop_type))
         
         if moisture < 20:
-            recommendations.append(
-                f'Model indicates low soil moisture ({moisture}%) may be affecting {crop_type} health.'
-            )
+            recommendations.append(LOW_MOISTURE_REC_TPL.format(moisture=moisture, crop=crop_type))
         elif moisture > 60:
-            recommendations.append(
-                f'Model suggests high soil moisture ({moisture}%) may be causing stress in {crop_type}.'
-            )
+            recommendations.append(HIGH_MOISTURE_REC_TPL.format(moisture=moisture, crop=crop_type))
     
     return {
         'healthStatus': health_status,
         'confidence': confidence,
         'issues': issues,
-        'recommendations': list(set(recommendations)),  # Remove duplicates
+        'recommendations': list(dict.fromkeys(recommendations)),  # Remove duplicates, keep order
         'detectedDiseases': detected_diseases,
         'modelDerived': True  # Flag indicating insights come from model
     }
@@ -184,7 +200,7 @@ def extract_crop_sensitivity_from_model(
     # This would require accessing model intermediate layers
     # For now, return placeholder structure
     return {
-        'temperature_sensitivity': None,  # Would come from crop_weather_interaction layer
+        'temperature_sensitivity': None,  # Would come from crop_interaction layer
         'humidity_sensitivity': None,
         'soil_ph_sensitivity': None,
         'moisture_sensitivity': None
@@ -1,5 +1,7 @@
 param(
-  [string]$Port = "5001"
+  [string]$Port = "5001",
+  # Worker processes; each loads its own model and gets CPU count / Workers inference threads
+  [int]$Workers = 1
 )
 
 $scriptDir = Split-Path -Parent $MyInvocation.MyCommand.Path
@@ -18,6 +20,8 @@ if (-Not (Test-Path $modelsDir)) {
 }
 $env:DEEPLEAF_MODELS_DIR = (Resolve-Path $modelsDir).Path
 
-python -m uvicorn fastapi_app:app --host 0.0.0.0 --port $Port
+$env:WEB_CONCURRENCY = $Workers
+
+python -m uvicorn fastapi_app:app --host 0.0.0.0 --port $Port --workers $Workers
 
 
@@ -3,13 +3,14 @@ Training script for crop health classification model
 This script can be used to fine-tune the model with actual image data
 """
 import os
+import json
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
 import logging
+from model_architecture import configure_mixed_precision, unfreeze_top_layers
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,16 +20,28 @@ IMAGE_SIZE = (224, 224)
 BATCH_SIZE = 8
 EPOCHS = 50
 LEARNING_RATE = 0.001
+# MobileNetV2 layers (from the top) trained during fine-tuning
+FINE_TUNE_LAYERS = 30
+# Keras dtype policy, e.g. mixed_bfloat16 on CPUs with AMX / AVX512-BF16;
+# by default mixed_float16 on Tensor Core GPUs, float32 otherwise
+MIXED_PRECISION = os.environ.get('MIXED_PRECISION')
 
 # Data directories
 TRAIN_DIR = 'data/train'
 VALIDATION_DIR = 'data/validation'
 TEST_DIR = 'data/test'
 
+# Decoded, resized uint8 copies of each data directory, rebuilt when its images change
+IMAGE_CACHE_DIR = 'data/cache'
+
 # Output
 MODEL_DIR = 'models'
 MODEL_PATH = os.path.join(MODEL_DIR, 'crop_health_model.h5')
 
+BRIGHTNESS_RANGE = (0.8, 1.2)
+# Same image types as image_dataset_from_directory
+IMAGE_EXTENSIONS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png')
+
 def create_model():
     """Create model with transfer learning"""
     # Load pre-trained MobileNetV2
@@ -42,16 +55,19 @@ def create_model():
     base_model.trainable = False
     
     # Build model
+    # Raw 0-255 pixels, scaled for MobileNetV2 (x / 127.5 - 1) in the graph
     inputs = keras.Input(shape=(*IMAGE_SIZE, 3))
-    x = base_model(inputs, training=False)
+    x = keras.layers.Rescaling(1.0 / 127.5, offset=-1.0, name='normalize')(inputs)
+    x = base_model(x, training=False)
     x = keras.layers.GlobalAveragePooling2D()(x)
     x = keras.layers.Dropout(0.2)(x)
     
     # Health status output (3 classes: healthy, moderate, critical)
-    health_output = keras.layers.Dense(3, activation='softmax', name='health_status')(x)
+    # Outputs stay float32 so softmax/sigmoid and the losses are stable under a mixed precision policy
+    health_output = keras.layers.Dense(3, activation='softmax', name='health_status', dtype='float32')(x)
     
     # Disease detection output (multi-label: 8 disease types)
-    disease_output = keras.layers.Dense(8, activation='sigmoid', name='disease_detection')(x)
+    disease_output = keras.layers.Dense(8, activation='sigmoid', name='disease_detection', dtype='float32')(x)
     
     model = keras.Model(inputs=inputs, outputs=[health_output, disease_output])
     
@@ -69,52 +85,119 @@ def create_model():
     
     return model, base_model
 
-def prepare_data_generators():
-    """Prepare data generators for training"""
-    # Data augmentation for training
-    train_datagen = ImageDataGenerator(
-        rescale=1./255,
-        rotation_range=20,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        horizontal_flip=True,
-        zoom_range=0.2,
-        brightness_range=[0.8, 1.2]
-    )
+def list_images(directory):
+    """Class names (sorted subdirectories) and the sorted (path, class index) pairs below them"""
+    class_names = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    samples = []
+    for index, name in enumerate(class_names):
+        for root, dirs, files in os.walk(os.path.join(directory, name)):
+            dirs.sort()
+            samples.extend((os.path.join(root, f), index) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+    return class_names, samples
+
+def cached_images(directory):
+    """
+    All images of a class-per-subdirectory folder as one (N, H, W, 3) uint8
+    memory-mapped array, plus one-hot labels
+
+    Images are decoded and resized once into IMAGE_CACHE_DIR; later runs map
+    that file instead of decoding every JPEG again each epoch. The cache is
+    rebuilt when images are added, removed or modified.
+    """
+    class_names, samples = list_images(directory)
+    if not samples:
+        raise ValueError(f"No images found in directory {directory}")
+    signature = {
+        'classes': class_names,
+        'files': [os.path.relpath(path, directory) for path, _ in samples],
+        'mtime': max((os.path.getmtime(path) for path, _ in samples), default=0),
+        'image_size': list(IMAGE_SIZE),
+    }
+    name = os.path.basename(os.path.normpath(directory))
+    images_path = os.path.join(IMAGE_CACHE_DIR, f'{name}_images.u8')
+    labels_path = os.path.join(IMAGE_CACHE_DIR, f'{name}_labels.npy')
+    meta_path = os.path.join(IMAGE_CACHE_DIR, f'{name}_meta.json')
+    shape = (len(samples), IMAGE_SIZE[0], IMAGE_SIZE[1], 3)
     
-    # Only rescaling for validation and test
-    val_test_datagen = ImageDataGenerator(rescale=1./255)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            up_to_date = json.load(f) == signature
+    except (OSError, ValueError):
+        up_to_date = False
+    if not up_to_date:
+        logger.info(f"Decoding {len(samples)} images from {directory} into {images_path}...")
+        os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+        images = np.memmap(images_path, dtype=np.uint8, mode='w+', shape=shape)
+        for i, (path, _) in enumerate(samples):
+            # Same decode and bilinear resize as image_dataset_from_directory
+            image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+            image = tf.image.resize(image, IMAGE_SIZE)
+            images[i] = tf.cast(tf.round(tf.clip_by_value(image, 0.0, 255.0)), tf.uint8).numpy()
+        images.flush()
+        del images
+        labels = np.eye(len(class_names), dtype=np.float32)[np.array([index for _, index in samples], dtype=np.intp)]
+        np.save(labels_path, labels)
+        # Written last, so an interrupted build is redone
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(signature, f)
     
-    # Training generator
-    train_generator = train_datagen.flow_from_directory(
-        TRAIN_DIR,
-        target_size=IMAGE_SIZE,
-        batch_size=BATCH_SIZE,
-        class_mode='categorical',
-        subset='training'
+    logger.info(f"Found {len(samples)} files belonging to {len(class_names)} classes.")
+    return np.memmap(images_path, dtype=np.uint8, mode='r', shape=shape), np.load(labels_path)
+
+def build_tfdata(directory, training=True):
+    """
+    tf.data pipeline over a class-per-subdirectory image folder: the images
+    are read from the decoded uint8 cache (cached_images) held in memory,
+    and augmentation runs as TensorFlow ops on tf.data's own threads,
+    overlapped with the training step. Pixels stay in 0-255; the model
+    normalizes them itself
+    """
+    images, labels = cached_images(directory)
+    # One copy in memory; elements are gathered by index so shuffling does
+    # not buffer images
+    images = tf.constant(images)
+    labels = tf.constant(labels)
+    dataset = tf.data.Dataset.range(len(labels))
+    if training:
+        # Full reshuffle every epoch
+        dataset = dataset.shuffle(len(labels), reshuffle_each_iteration=True)
+    # One gather per batch; pixels stay uint8 until the batch is cast
+    dataset = dataset.batch(BATCH_SIZE).map(
+        lambda i: (tf.cast(tf.gather(images, i), tf.float32), tf.gather(labels, i)),
+        num_parallel_calls=tf.data.AUTOTUNE
     )
     
-    # Validation generator
-    validation_generator = val_test_datagen.flow_from_directory(
-        VALIDATION_DIR,
-        target_size=IMAGE_SIZE,
-        batch_size=BATCH_SIZE,
-        class_mode='categorical'
-    )
+    if training:
+        # Same augmentation as the former ImageDataGenerator settings
+        augmentation = keras.Sequential([
+            keras.layers.RandomRotation(20 / 360, fill_mode='nearest'),
+            keras.layers.RandomTranslation(0.2, 0.2, fill_mode='nearest'),
+            keras.layers.RandomZoom(0.2, fill_mode='nearest'),
+            keras.layers.RandomFlip('horizontal'),
+        ])
+        
+        def augment(images, labels):
+            # Whole batches; the layers draw their random transforms per image.
+            # They compute in the global dtype policy (e.g. mixed_bfloat16)
+            images = tf.cast(augmentation(images, training=True), tf.float32)
+            images = images * tf.random.uniform([tf.shape(images)[0], 1, 1, 1], *BRIGHTNESS_RANGE)
+            return tf.clip_by_value(images, 0.0, 255.0), labels
+        
+        dataset = dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE)
     
-    # Test generator
-    test_generator = val_test_datagen.flow_from_directory(
-        TEST_DIR,
-        target_size=IMAGE_SIZE,
-        batch_size=BATCH_SIZE,
-        class_mode='categorical',
-        shuffle=False
-    )
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+def prepare_data_generators():
+    """Prepare tf.data pipelines for training"""
+    train_generator = build_tfdata(TRAIN_DIR, training=True)
+    validation_generator = build_tfdata(VALIDATION_DIR, training=False)
+    test_generator = build_tfdata(TEST_DIR, training=False)
     
     return train_generator, validation_generator, test_generator
 
 def train_model():
     """Train the model"""
+    logger.info(f"Dtype policy: {configure_mixed_precision(MIXED_PRECISION)}")
     logger.info("Creating model...")
     model, base_model = create_model()
     
@@ -171,9 +254,9 @@ def train_model():
         verbose=1
     )
     
-    # Fine-tune: Unfreeze base model and train with lower learning rate
+    # Fine-tune: Unfreeze the top of the base model and train with lower learning rate
     logger.info("Fine-tuning base model...")
-    base_model.trainable = True
+    unfreeze_top_layers(base_model, FINE_TUNE_LAYERS)
     model.compile(
         optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE / 10),
         loss={
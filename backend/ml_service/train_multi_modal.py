@@ -3,23 +3,46 @@ Training script for multi-modal crop health classification model
 Trains model to learn crop-specific behavior from data
 """
 import os
+import json
+import hashlib
 import numpy as np
 import pandas as pd
 import tensorflow as tf
 from tensorflow import keras
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
 import logging
-from model_architecture import create_multi_modal_model, CROP_TYPES, CROP_STAGES, get_crop_type_index, encode_crop_stage
+from model_insights import DISEASE_TYPES
+from model_architecture import create_multi_modal_model, create_head_only_model, configure_mixed_precision, unfreeze_top_layers, quantize_model_int8, write_embedding_table, CROP_TYPES, CROP_STAGES, get_crop_type_index, encode_crop_stage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuration
 IMAGE_SIZE = (224, 224)
-BATCH_SIZE = 8
+# MobileNetV2 kernels are launch-bound at small batches on a GPU
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', '64'))
 EPOCHS = 50
-LEARNING_RATE = 0.001
+# Adam learning rate tuned at batch 8, scaled linearly with the batch size
+LEARNING_RATE = 0.001 * BATCH_SIZE / 8
+# XLA-compile the training steps; by default only on GPU, where it fuses the
+# many small kernels (on CPU the compile time rarely pays off)
+JIT_COMPILE = os.environ.get('JIT_COMPILE', '1' if tf.config.list_physical_devices('GPU') else '0') == '1'
+# MobileNetV2 layers (from the top) trained during fine-tuning
+FINE_TUNE_LAYERS = 30
+# Keras dtype policy, e.g. mixed_bfloat16 on CPUs with AMX / AVX512-BF16;
+# by default mixed_float16 on Tensor Core GPUs, float32 otherwise
+MIXED_PRECISION = os.environ.get('MIXED_PRECISION')
+# MobileNetV2 width multiplier; 0.5 has ~3x fewer MACs than 1.0
+MOBILENET_ALPHA = float(os.environ.get('CROP_MOBILENET_ALPHA', '0.5'))
+# Optional magnitude pruning after training (e.g. PRUNE_SPARSITY=0.5)
+PRUNE_SPARSITY = float(os.environ.get('PRUNE_SPARSITY', '0'))
+PRUNE_EPOCHS = 5
+# Training samples used to calibrate the INT8 TFLite model
+CALIBRATION_SAMPLES = 100
+# While the backbone is frozen, train only the head on MobileNetV2 features
+# computed once (CACHE_BACKBONE_FEATURES=0 runs the backbone every epoch)
+CACHE_BACKBONE_FEATURES = os.environ.get('CACHE_BACKBONE_FEATURES', '1') == '1'
+FEATURE_BATCH_SIZE = 64
 
 # Data directories
 TRAIN_DIR = 'data/train'
@@ -27,17 +50,33 @@ VALIDATION_DIR = 'data/validation'
 TEST_DIR = 'data/test'
 
 # Metadata CSV should contain: image_path, crop_type, crop_stage, temp, humidity, rain, ph, moisture, health_status
+# and optionally a 0/1 column per disease type (DISEASE_TYPES, e.g. yellowing); missing ones count as 0
 METADATA_CSV = 'data/metadata.csv'
 
+# Pooled backbone features and TFRecord shards of each split, rebuilt when its data changes
+FEATURE_CACHE_DIR = 'data/cache'
+TFRECORD_SHARDS = 16
+# Serialized examples; records are also interleaved across shards
+SHUFFLE_BUFFER = 1024
+
 # Output
 MODEL_DIR = 'models'
 MODEL_PATH = os.path.join(MODEL_DIR, 'crop_health_multi_modal.h5')
+PRUNED_MODEL_PATH = os.path.join(MODEL_DIR, 'crop_health_model_pruned.h5')
+# Same naming as app.py's MODEL_VARIANT=int8 conversion of the .h5 they come from; app.py
+# serves the first one only with MODEL_PATH=models/crop_health_multi_modal.h5, the pruned one
+# with its default MODEL_PATH
+INT8_TFLITE_PATH = os.path.splitext(MODEL_PATH)[0] + '_int8.tflite'
+PRUNED_INT8_TFLITE_PATH = os.path.splitext(PRUNED_MODEL_PATH)[0] + '_int8.tflite'
+# Per-row scales of the int8 crop type embedding app.py serves the Keras model with
+EMBEDDING_TABLE_PATH = os.path.splitext(MODEL_PATH)[0] + '_embedding.table'
 
 def load_metadata(csv_path):
     """Load metadata CSV with tabular features"""
     if not os.path.exists(csv_path):
         logger.warning(f"Metadata CSV not found: {csv_path}")
         logger.info("Expected CSV columns: image_path, crop_type, crop_stage, temp, humidity, rain, ph, moisture, health_status")
+        logger.info(f"Optional 0/1 disease label columns: {', '.join(DISEASE_TYPES)}")
         return None
     
     df = pd.read_csv(csv_path)
@@ -48,114 +87,234 @@ def load_metadata(csv_path):
     
     return df
 
-def create_data_generator(df, image_dir, batch_size, shuffle=True):
-    """Create data generator that yields both image and tabular features"""
-    from tensorflow.keras.preprocessing.image import load_img, img_to_array
-    from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-    
-    def generator():
-        indices = np.arange(len(df))
-        if shuffle:
-            np.random.shuffle(indices)
-        
-        while True:
-            for start_idx in range(0, len(df), batch_size):
-                batch_indices = indices[start_idx:start_idx + batch_size]
-                batch_df = df.iloc[batch_indices]
-                
-                # Load images
-                images = []
-                crop_types = []
-                crop_stages = []
-                weather_features = []
-                soil_features = []
-                health_labels = []
-                
-                for _, row in batch_df.iterrows():
-                    # Load and preprocess image
-                    img_path = os.path.join(image_dir, row['image_path'])
-                    if not os.path.exists(img_path):
-                        continue
-                    
-                    img = load_img(img_path, target_size=IMAGE_SIZE)
-                    img_array = img_to_array(img)
-                    img_array = preprocess_input(img_array)
-                    images.append(img_array)
-                    
-                    # Encode crop type
-                    crop_type_idx = get_crop_type_index(row['crop_type'])
-                    crop_types.append([crop_type_idx])
-                    
-                    # Encode crop stage
-                    crop_stage = row.get('crop_stage', '')
-                    crop_stage_encoded = encode_crop_stage(crop_stage)
-                    crop_stages.append(crop_stage_encoded)
-                    
-                    # Weather features (normalized)
-                    temp = row.get('temp', 25.0) / 50.0
-                    humidity = row.get('humidity', 50.0) / 100.0
-                    rain = min(row.get('rain', 0.0) / 200.0, 1.0)
-                    weather_features.append([temp, humidity, rain])
-                    
-                    # Soil features (normalized)
-                    ph = (row.get('ph', 6.5) - 5.0) / 3.0
-                    moisture = row.get('moisture', 30.0) / 100.0
-                    soil_features.append([ph, moisture])
-                    
-                    # Health status (one-hot encode)
-                    health_status = row['health_status']
-                    health_map = {'healthy': [1, 0, 0], 'moderate': [0, 1, 0], 'critical': [0, 0, 1]}
-                    health_labels.append(health_map.get(health_status, [0, 1, 0]))
-                
-                if len(images) == 0:
-                    continue
-                
-                # Convert to numpy arrays
-                images = np.array(images)
-                crop_types = np.array(crop_types, dtype='int32')
-                crop_stages = np.array(crop_stages)
-                weather_features = np.array(weather_features, dtype='float32')
-                soil_features = np.array(soil_features, dtype='float32')
-                health_labels = np.array(health_labels)
-                
-                # Disease labels (placeholder - should be in metadata)
-                disease_labels = np.zeros((len(images), 8), dtype='float32')
-                
-                # Auxiliary target: Crop-conditioned stress score
-                # Higher stress for critical, lower for healthy
-                # This forces model to learn crop-specific stress responses
-                stress_scores = []
-                for health_label in health_labels:
-                    if np.argmax(health_label) == 2:  # Critical
-                        stress_score = 0.8 + np.random.uniform(0, 0.2)  # 0.8-1.0
-                    elif np.argmax(health_label) == 1:  # Moderate
-                        stress_score = 0.4 + np.random.uniform(0, 0.3)  # 0.4-0.7
-                    else:  # Healthy
-                        stress_score = np.random.uniform(0, 0.3)  # 0.0-0.3
-                    stress_scores.append([stress_score])
-                stress_scores = np.array(stress_scores, dtype='float32')
-                
-                yield (
-                    {
-                        'image_input': images,
-                        'crop_type_input': crop_types,
-                        'crop_stage_input': crop_stages,
-                        'weather_input': weather_features,
-                        'soil_input': soil_features
-                    },
-                    {
-                        'health_status': health_labels,
-                        'disease_detection': disease_labels,
-                        'crop_stress_auxiliary': stress_scores  # Auxiliary target
-                    }
-                )
-    
-    return generator
+# Auxiliary crop stress target per health class (healthy, moderate, critical):
+# drawn uniformly from [low, low + width) for every sample and epoch
+STRESS_LOW = np.array([0.0, 0.4, 0.8])
+STRESS_WIDTH = np.array([0.3, 0.3, 0.2])
+HEALTH_INDEX = {'healthy': 0, 'moderate': 1, 'critical': 2}
+
+def build_tfrecords(df, image_dir, shards=TFRECORD_SHARDS):
+    """
+    Sharded TFRecords of a metadata split, one tf.train.Example per image:
+    the resized uint8 pixels, the encoded tabular features, the health
+    class index and the disease labels
+    
+    Images are decoded once, in parallel, into FEATURE_CACHE_DIR; training
+    then reads a few shards sequentially instead of opening and decoding
+    every JPEG each epoch. The shards are reused while the metadata, images
+    and image size are unchanged. Sample i goes to shard i % shards, so
+    interleaving the shards in order yields the metadata order.
+    """
+    paths = df['image_path'].map(lambda path: os.path.join(image_dir, path))
+    exists = paths.map(os.path.exists).to_numpy(dtype=bool)
+    if not exists.all():
+        logger.warning(f"Skipping {(~exists).sum()} images missing from {image_dir}")
+    df = df[exists]
+    paths = paths[exists]
+    if df.empty:
+        raise ValueError(f"No images found for the metadata of {image_dir}")
+    
+    name = os.path.basename(os.path.normpath(image_dir))
+    shard_dir = os.path.join(FEATURE_CACHE_DIR, f'{name}_shards')
+    meta_path = os.path.join(FEATURE_CACHE_DIR, f'{name}_shards_meta.json')
+    shards = min(shards, len(df))
+    shard_paths = [os.path.join(shard_dir, f'{index:03d}-of-{shards:03d}.tfrec') for index in range(shards)]
+    signature = {
+        'metadata': hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest(),
+        'mtime': max(os.path.getmtime(path) for path in paths),
+        'image_size': list(IMAGE_SIZE),
+        'shards': shards,
+        'features': sorted(EXAMPLE_FEATURES),
+    }
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == signature:
+                return shard_paths
+    except (OSError, ValueError):
+        pass
+    
+    logger.info(f"Writing {len(df)} images from {image_dir} to {shards} TFRecord shards...")
+    # Missing columns and blank cells both take the default
+    def column(name, default):
+        return df[name].fillna(default).to_numpy(dtype=np.float64) if name in df else np.full(len(df), default)
+    
+    crop_stages = df['crop_stage'].fillna('') if 'crop_stage' in df else [''] * len(df)
+    crop_types = df['crop_type'].map(get_crop_type_index).to_numpy(dtype=np.int64)
+    crop_stage_features = np.array([encode_crop_stage(stage) for stage in crop_stages], dtype=np.float32).reshape(-1, len(CROP_STAGES))
+    # Weather features (normalized)
+    weather = np.stack([
+        column('temp', 25.0) / 50.0,
+        column('humidity', 50.0) / 100.0,
+        np.minimum(column('rain', 0.0) / 200.0, 1.0),
+    ], axis=1).astype(np.float32)
+    # Soil features (normalized)
+    soil = np.stack([
+        (column('ph', 6.5) - 5.0) / 3.0,
+        column('moisture', 30.0) / 100.0,
+    ], axis=1).astype(np.float32)
+    # Unknown health labels count as moderate
+    health_index = df['health_status'].map(HEALTH_INDEX).fillna(1).to_numpy(dtype=np.int64)
+    disease = np.stack([column(name, 0.0) for name in DISEASE_TYPES], axis=1).astype(np.float32)
+    
+    def decode(path):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        # Nearest resize keeps the original uint8 pixel values
+        return tf.image.resize(image, IMAGE_SIZE, method='nearest')
+    
+    images = tf.data.Dataset.from_tensor_slices(paths.to_numpy(dtype=str)).map(decode, num_parallel_calls=tf.data.AUTOTUNE)
+    os.makedirs(shard_dir, exist_ok=True)
+    writers = [tf.io.TFRecordWriter(path) for path in shard_paths]
+    try:
+        for i, image in enumerate(images.prefetch(tf.data.AUTOTUNE)):
+            example = tf.train.Example(features=tf.train.Features(feature={
+                'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.numpy().tobytes()])),
+                'crop_type': tf.train.Feature(int64_list=tf.train.Int64List(value=[crop_types[i]])),
+                'crop_stage': tf.train.Feature(float_list=tf.train.FloatList(value=crop_stage_features[i])),
+                'weather': tf.train.Feature(float_list=tf.train.FloatList(value=weather[i])),
+                'soil': tf.train.Feature(float_list=tf.train.FloatList(value=soil[i])),
+                'health': tf.train.Feature(int64_list=tf.train.Int64List(value=[health_index[i]])),
+                'disease': tf.train.Feature(float_list=tf.train.FloatList(value=disease[i])),
+            }))
+            writers[i % shards].write(example.SerializeToString())
+    finally:
+        for writer in writers:
+            writer.close()
+    # Written last, so an interrupted build is redone
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(signature, f)
+    return shard_paths
+
+# Fixed-size fields of the build_tfrecords examples
+EXAMPLE_FEATURES = {
+    'image': tf.io.FixedLenFeature([], tf.string),
+    'crop_type': tf.io.FixedLenFeature([1], tf.int64),
+    'crop_stage': tf.io.FixedLenFeature([len(CROP_STAGES)], tf.float32),
+    'weather': tf.io.FixedLenFeature([3], tf.float32),
+    'soil': tf.io.FixedLenFeature([2], tf.float32),
+    'health': tf.io.FixedLenFeature([], tf.int64),
+    'disease': tf.io.FixedLenFeature([len(DISEASE_TYPES)], tf.float32),
+}
+
+def create_dataset(df, image_dir, batch_size, shuffle=True, cache=False):
+    """
+    tf.data pipeline of (inputs, targets) batches read from the split's
+    TFRecord shards (build_tfrecords): shards are read in parallel, and each
+    batch is parsed with one vectorized op, prefetched so loading overlaps
+    with the training step
+    
+    cache=True keeps the serialized records (uint8 pixels, the size of the
+    shards) in memory after the first pass, so later epochs read no files
+    """
+    shard_paths = build_tfrecords(df, image_dir)
+    files = tf.data.Dataset.from_tensor_slices(shard_paths)
+    if shuffle:
+        files = files.shuffle(len(shard_paths), reshuffle_each_iteration=True)
+    # Without shuffling, a round-robin over the shards in order restores the metadata order
+    dataset = files.interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=len(shard_paths),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=not shuffle
+    )
+    if cache:
+        dataset = dataset.cache()
+    if shuffle:
+        dataset = dataset.shuffle(SHUFFLE_BUFFER, reshuffle_each_iteration=True)
+    
+    stress_low = tf.constant(STRESS_LOW, tf.float32)
+    stress_width = tf.constant(STRESS_WIDTH, tf.float32)
+    
+    def parse(records):
+        examples = tf.io.parse_example(records, EXAMPLE_FEATURES)
+        images = tf.reshape(tf.io.decode_raw(examples['image'], tf.uint8), [-1, *IMAGE_SIZE, 3])
+        health = examples['health']
+        inputs = {
+            # Raw 0-255 pixels; the model's 'normalize' layer scales them
+            'image_input': tf.cast(images, tf.float32),
+            'crop_type_input': tf.cast(examples['crop_type'], tf.int32),
+            'crop_stage_input': examples['crop_stage'],
+            'weather_input': examples['weather'],
+            'soil_input': examples['soil'],
+        }
+        # Auxiliary target: Crop-conditioned stress score
+        # Higher stress for critical, lower for healthy
+        # This forces model to learn crop-specific stress responses
+        stress = tf.gather(stress_low, health) + tf.random.uniform(tf.shape(health)) * tf.gather(stress_width, health)
+        targets = {
+            # Health status (one-hot encode)
+            'health_status': tf.one_hot(health, 3),
+            'disease_detection': examples['disease'],
+            'crop_stress_auxiliary': stress[:, tf.newaxis],
+        }
+        return inputs, targets
+    
+    dataset = dataset.batch(batch_size).map(parse, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+def cached_backbone_features(feature_model, df, image_dir):
+    """
+    (inputs, targets) of a metadata split for the head-only model: the
+    pooled backbone features of every image, then the tabular inputs
+    
+    The backbone runs once over the split; its features are written to a
+    memory-mapped .npy in FEATURE_CACHE_DIR and reused while the metadata,
+    images and backbone width are unchanged. The auxiliary stress targets
+    are drawn once and cached with them.
+    """
+    name = os.path.basename(os.path.normpath(image_dir))
+    features_path = os.path.join(FEATURE_CACHE_DIR, f'{name}_features.npy')
+    data_path = os.path.join(FEATURE_CACHE_DIR, f'{name}_head_data.npz')
+    meta_path = os.path.join(FEATURE_CACHE_DIR, f'{name}_features_meta.json')
+    paths = [os.path.join(image_dir, path) for path in df['image_path']]
+    signature = {
+        'metadata': hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest(),
+        'mtime': max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=0),
+        'alpha': MOBILENET_ALPHA,
+        'image_size': list(IMAGE_SIZE),
+    }
+    
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            up_to_date = json.load(f) == signature
+    except (OSError, ValueError):
+        up_to_date = False
+    if not up_to_date:
+        logger.info(f"Extracting backbone features for {len(df)} images from {image_dir}...")
+        os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+        features = np.lib.format.open_memmap(
+            features_path, mode='w+', dtype=np.float32, shape=(len(df), feature_model.output_shape[-1])
+        )
+        columns = {}
+        count = 0
+        for inputs, targets in create_dataset(df, image_dir, FEATURE_BATCH_SIZE, shuffle=False):
+            images = inputs.pop('image_input')
+            features[count:count + len(images)] = feature_model.predict_on_batch(images)
+            count += len(images)
+            for key, values in {**inputs, **targets}.items():
+                columns.setdefault(key, []).append(values.numpy())
+        if not count:
+            raise ValueError(f"No images found for the metadata of {image_dir}")
+        features.flush()
+        del features
+        np.savez(data_path, **{key: np.concatenate(values) for key, values in columns.items()})
+        # Written last, so an interrupted extraction is redone
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(signature, f)
+    
+    data = np.load(data_path)
+    # Rows past the count belong to images missing on disk
+    count = len(data['health_status'])
+    inputs = [np.load(features_path, mmap_mode='r')[:count]] + [
+        data[key] for key in ('crop_type_input', 'crop_stage_input', 'weather_input', 'soil_input')
+    ]
+    targets = {key: data[key] for key in ('health_status', 'disease_detection', 'crop_stress_auxiliary')}
+    return inputs, targets
 
 def train_model():
     """Train the multi-modal model"""
+    logger.info(f"Dtype policy: {configure_mixed_precision(MIXED_PRECISION)}")
     logger.info("Creating multi-modal model...")
-    model, base_model = create_multi_modal_model()
+    model, base_model = create_multi_modal_model(alpha=MOBILENET_ALPHA, learning_rate=LEARNING_RATE, jit_compile=JIT_COMPILE)
     
     # Load metadata
     train_df = load_metadata(os.path.join(TRAIN_DIR, '..', 'train_metadata.csv'))
@@ -165,18 +324,16 @@ def train_model():
         logger.warning("Metadata CSV not found. Model will be created but not trained.")
         logger.info("To train the model, create metadata CSV with columns:")
         logger.info("  image_path, crop_type, crop_stage, temp, humidity, rain, ph, moisture, health_status")
+        logger.info(f"  plus optional 0/1 disease label columns: {', '.join(DISEASE_TYPES)}")
         os.makedirs(MODEL_DIR, exist_ok=True)
         model.save(MODEL_PATH)
         logger.info(f"Untrained model saved to {MODEL_PATH}")
         return
     
-    # Create data generators
-    train_gen = create_data_generator(train_df, TRAIN_DIR, BATCH_SIZE, shuffle=True)
-    val_gen = create_data_generator(val_df, VALIDATION_DIR, BATCH_SIZE, shuffle=False)
-    
-    # Calculate steps per epoch
-    train_steps = len(train_df) // BATCH_SIZE
-    val_steps = len(val_df) // BATCH_SIZE
+    # Create input pipelines
+    train_ds = create_dataset(train_df, TRAIN_DIR, BATCH_SIZE, shuffle=True)
+    # The validation split is the same every epoch
+    val_ds = create_dataset(val_df, VALIDATION_DIR, BATCH_SIZE, shuffle=False, cache=True)
     
     # Create callbacks
     callbacks = [
@@ -220,19 +377,35 @@ def train_model():
     logger.info("Starting training...")
     logger.info(f"Training samples: {len(train_df)}, Validation samples: {len(val_df)}")
     
-    history = model.fit(
-        train_gen,
-        steps_per_epoch=train_steps,
-        epochs=EPOCHS,
-        validation_data=val_gen,
-        validation_steps=val_steps,
-        callbacks=callbacks,
-        verbose=1
-    )
+    if CACHE_BACKBONE_FEATURES:
+        # The frozen backbone sees the same (unaugmented) images every epoch,
+        # so its features are computed once and only the head is trained
+        feature_model, head_model = create_head_only_model(model, LEARNING_RATE, jit_compile=JIT_COMPILE)
+        train_inputs, train_targets = cached_backbone_features(feature_model, train_df, TRAIN_DIR)
+        val_inputs, val_targets = cached_backbone_features(feature_model, val_df, VALIDATION_DIR)
+        history = head_model.fit(
+            train_inputs,
+            train_targets,
+            batch_size=BATCH_SIZE,
+            epochs=EPOCHS,
+            validation_data=(val_inputs, val_targets),
+            callbacks=callbacks[1:],  # ModelCheckpoint would save the head alone
+            verbose=1
+        )
+        # The head layers are shared, so the full model holds the trained head
+        model.save(MODEL_PATH)
+    else:
+        history = model.fit(
+            train_ds,
+            epochs=EPOCHS,
+            validation_data=val_ds,
+            callbacks=callbacks,
+            verbose=1
+        )
     
-    # Fine-tune: Unfreeze base model
+    # Fine-tune: Unfreeze the top of the base model
     logger.info("Fine-tuning base model...")
-    base_model.trainable = True
+    unfreeze_top_layers(base_model, FINE_TUNE_LAYERS)
     model.compile(
         optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE / 10),
         loss={
@@ -242,21 +415,118 @@ def train_model():
         metrics={
             'health_status': 'accuracy',
             'disease_detection': 'binary_accuracy'
-        }
+        },
+        jit_compile=JIT_COMPILE
     )
     
     history_fine = model.fit(
-        train_gen,
-        steps_per_epoch=train_steps,
+        train_ds,
         epochs=EPOCHS // 2,
-        validation_data=val_gen,
-        validation_steps=val_steps,
+        validation_data=val_ds,
         callbacks=callbacks,
         verbose=1
     )
     
     logger.info(f"Training completed. Model saved to {MODEL_PATH}")
     logger.info("Model now learns crop-specific behavior from data!")
+    
+    write_embedding_table(model, EMBEDDING_TABLE_PATH)
+    logger.info(f"Crop type embedding scales written to {EMBEDDING_TABLE_PATH}")
+    export_int8_tflite(model, train_ds)
+    
+    if PRUNE_SPARSITY > 0:
+        prune_model(model, train_ds, val_ds, steps_per_epoch=-(-len(train_df) // BATCH_SIZE))
+
+def export_int8_tflite(model, dataset, tflite_path=INT8_TFLITE_PATH, sparse=False):
+    """Write a full-integer TFLite model to tflite_path, calibrated on real training samples"""
+    
+    def representative_dataset():
+        # Split the training batches into single samples, keeping the
+        # image and tabular inputs of each sample together
+        count = 0
+        for inputs, _ in dataset:
+            inputs = {name: values.numpy() for name, values in inputs.items()}
+            for i in range(len(inputs['image_input'])):
+                yield {name: values[i:i + 1] for name, values in inputs.items()}
+                count += 1
+                if count >= CALIBRATION_SAMPLES:
+                    return
+    
+    logger.info(f"Quantizing to INT8 on {CALIBRATION_SAMPLES} training samples...")
+    try:
+        tflite_model = quantize_model_int8(model, representative_dataset, sparse=sparse)
+    except Exception as e:
+        logger.warning(f"INT8 quantization failed: {e}")
+        return
+    with open(tflite_path, 'wb') as f:
+        f.write(tflite_model)
+    logger.info(f"INT8 TFLite model saved to {tflite_path}")
+
+class MagnitudePruning(keras.callbacks.Callback):
+    """
+    Zero the smallest-magnitude weights of the trainable Dense/Conv2D kernels
+    after every training step, with the sparsity ramping up to
+    `final_sparsity` at `end_step` (cubic schedule)
+    """
+    
+    def __init__(self, layers, final_sparsity, end_step):
+        super().__init__()
+        self.kernels = [layer.kernel for layer in layers]
+        self.final_sparsity = final_sparsity
+        self.end_step = end_step
+        self.step = 0
+    
+    def on_train_batch_end(self, batch, logs=None):
+        self.step += 1
+        progress = min(1.0, self.step / self.end_step)
+        sparsity = self.final_sparsity * (1 - (1 - progress) ** 3)
+        for kernel in self.kernels:
+            weights = np.asarray(kernel.numpy())
+            threshold = np.percentile(np.abs(weights), sparsity * 100)
+            kernel.assign(np.where(np.abs(weights) < threshold, 0, weights).astype(weights.dtype))
+
+def prunable_layers(model):
+    """Trainable Dense/Conv2D layers of the model, including nested models such as the backbone"""
+    found = []
+    for layer in model.layers:
+        if hasattr(layer, 'layers'):
+            found.extend(prunable_layers(layer))
+        elif layer.trainable and isinstance(layer, (keras.layers.Dense, keras.layers.Conv2D)):
+            found.append(layer)
+    return found
+
+def prune_model(model, train_ds, val_ds, steps_per_epoch):
+    """
+    Magnitude-prune the Dense/Conv layers, fine-tune briefly and save the
+    pruned model, plus its sparse INT8 TFLite conversion
+    """
+    # Pruned on a copy, so the trained model is left as saved
+    pruned = keras.models.clone_model(model)
+    pruned.set_weights(model.get_weights())
+    # Sparsity ramps up over the pruning epochs, so the remaining weights can
+    # adapt as the smallest ones are zeroed
+    pruning = MagnitudePruning(
+        prunable_layers(pruned),
+        final_sparsity=PRUNE_SPARSITY,
+        end_step=max(1, PRUNE_EPOCHS * steps_per_epoch - 1)
+    )
+    
+    logger.info(f"Pruning {len(pruning.kernels)} layers to {PRUNE_SPARSITY:.0%} sparsity...")
+    pruned.compile(optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE / 10), loss=model.loss, metrics={
+        'health_status': 'accuracy',
+        'disease_detection': 'binary_accuracy'
+    }, jit_compile=JIT_COMPILE)
+    pruned.fit(
+        train_ds,
+        epochs=PRUNE_EPOCHS,
+        validation_data=val_ds,
+        callbacks=[pruning],
+        verbose=1
+    )
+    
+    pruned.save(PRUNED_MODEL_PATH)
+    logger.info(f"Pruned model saved to {PRUNED_MODEL_PATH}")
+    export_int8_tflite(pruned, train_ds, PRUNED_INT8_TFLITE_PATH, sparse=True)
 
 if __name__ == '__main__':
     # Set random seeds for reproducibility
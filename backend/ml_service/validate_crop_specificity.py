@@ -4,24 +4,29 @@ Tests that model produces different outputs for different crops under same condi
 """
 import numpy as np
 import tensorflow as tf
-from model_architecture import prepare_features_for_inference, CROP_TYPES
-from PIL import Image
+from model_architecture import prepare_features_for_inference, get_crop_type_index, CROP_TYPES
 import os
 
 def create_test_image(size=(224, 224)):
     """Create a dummy test image"""
-    img = Image.new('RGB', size, color=(100, 150, 100))  # Greenish image
-    return np.array(img)
+    return np.full((size[1], size[0], 3), (100, 150, 100), dtype=np.uint8)  # Greenish image
 
-def validate_crop_specificity(model, test_image_path=None):
+def validate_crop_specificity(run_inference, test_image_path=None, raw_pixel_input=False, multi_modal=True):
     """
     Test that model produces different outputs for different crops
     under identical conditions (same weather, soil, stage, image)
     
+    run_inference: forward pass taking a list of batched input arrays (the
+    multi-modal inputs in app.MODEL_INPUT_NAMES order, or only the image) and
+    returning [health_status, ...], e.g. app.run_inference
+    raw_pixel_input: True if the model takes raw 0-255 pixels (in-graph
+    'normalize' layer), as in app.RAW_PIXEL_INPUT
+    multi_modal: False for legacy image-only models
+    
     Returns:
         dict with validation results
     """
-    if model is None:
+    if run_inference is None:
         return {'error': 'Model not loaded'}
     
     # Fixed test conditions
@@ -31,48 +36,45 @@ def validate_crop_specificity(model, test_image_path=None):
     
     # Use test image or create dummy
     if test_image_path and os.path.exists(test_image_path):
-        from tensorflow.keras.preprocessing import image as keras_image
-        from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-        img = Image.open(test_image_path)
-        img = img.resize((224, 224))
-        img_array = keras_image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = preprocess_input(img_array)
+        # Same decode and resize as app.py's TF_DECODE path (libjpeg-turbo for JPEGs)
+        img = tf.io.decode_image(tf.io.read_file(test_image_path), channels=3, expand_animations=False)
+        img_array = tf.image.resize(img, (224, 224), method='bilinear')[tf.newaxis].numpy()
     else:
         # Create dummy image
         dummy_img = create_test_image()
-        img_array = np.expand_dims(dummy_img, axis=0)
-        from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-        img_array = preprocess_input(img_array)
+        img_array = np.expand_dims(dummy_img, axis=0).astype(np.float32)
+    
+    # Models with the in-graph 'normalize' layer take raw 0-255 pixels
+    if not raw_pixel_input:
+        # MobileNetV2 preprocess_input (x / 127.5 - 1), in place
+        img_array *= 1.0 / 127.5
+        img_array -= 1.0
     
     # Test predictions for different crops
     crop_predictions = {}
+    test_crops = CROP_TYPES[:6]  # Test first 6 crops
     
-    for crop_type in CROP_TYPES[:6]:  # Test first 6 crops
+    # All crops in one batch, one forward pass
+    if multi_modal:
+        # Only the crop type differs between the rows; the shared inputs are
+        # encoded once and repeated
         features = prepare_features_for_inference(
             image_array=img_array,
-            crop_type=crop_type,
+            crop_type=test_crops[0],
             crop_stage=test_stage,
             weather=test_weather,
             soil=test_soil
         )
-        
-        # Get model inputs
-        if len(model.inputs) > 1:
-            predictions = model.predict(
-                [
-                    features['image_input'],
-                    features['crop_type_input'],
-                    features['crop_stage_input'],
-                    features['weather_input'],
-                    features['soil_input']
-                ],
-                verbose=0
-            )
-        else:
-            predictions = model.predict(img_array, verbose=0)
-        
-        health_pred = predictions[0][0]
+        inputs = [
+            np.repeat(features[name], len(test_crops), axis=0)
+            for name in ('image_input', 'crop_type_input', 'crop_stage_input', 'weather_input', 'soil_input')
+        ]
+        inputs[1] = np.array([[get_crop_type_index(crop_type)] for crop_type in test_crops], dtype=np.int32)
+    else:
+        inputs = [np.repeat(img_array, len(test_crops), axis=0)]
+    health_preds = np.asarray(run_inference(inputs)[0])
+    
+    for crop_type, health_pred in zip(test_crops, health_preds):
         crop_predictions[crop_type] = {
             'healthy': float(health_pred[0]),
             'moderate': float(health_pred[1]),
@@ -122,11 +124,20 @@ if __name__ == '__main__':
     import sys
     sys.path.append(os.path.dirname(__file__))
     
-    from app import load_model, model
+    import app
     
-    if load_model():
+    if app.load_model():
         print("Running crop-specificity validation...")
-        results = validate_crop_specificity(model)
+        # One batched pass through the backend app loaded and warmed up
+        # (TFLite interpreter, ONNX session, SavedModel or traced Keras function)
+        results = validate_crop_specificity(
+            app.run_inference,
+            raw_pixel_input=app.RAW_PIXEL_INPUT,
+            multi_modal=app.USE_MULTI_MODAL
+        )
+        if 'error' in results:
+            print(f"Validation failed: {results['error']}")
+            sys.exit(1)
         
         print("\n=== Validation Results ===")
         print(f"Crop-specific behavior detected: {results['is_crop_specific']}")
@@ -1,15 +1,44 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 BASE = Path(__file__).resolve().parents[2]
 
-def to_title(x):
-    if pd.isna(x):
-        return x
-    s = str(x).strip().lower()
-    return ' '.join(w.capitalize() for w in s.split())
+# Lowercased column names main() looks up; other columns are not read
+USECOLS = {
+    'state', 'state_name', 'commodity', 'crop', 'product',
+    'modal_price', 'price', 'modal', 'arrivals_in_qtl', 'arrival', 'arrivals', 'arrival_date', 'date', 'week'
+}
+
+def titles(series):
+    # Vectorized string ops on Arrow strings; runs of whitespace collapse to
+    # one space as before, so the same names still group together. Missing
+    # values stay NA
+    return (series.astype('string[pyarrow]')
+                  .str.strip()
+                  .str.replace(r'\s+', ' ', regex=True)
+                  .str.lower()
+                  .str.title())
+
+def finite(series):
+    # JSON-safe values: NaN/inf become None (null)
+    return series.astype(object).where(np.isfinite(series), None)
+
+def read_csv(path):
+    # The pyarrow engine parses in parallel into Arrow-backed columns, but
+    # only takes usecols as a list of names
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c.lower().strip() in USECOLS]
+    return pd.read_csv(path, usecols=usecols, engine='pyarrow', dtype_backend='pyarrow')
 
 def main():
     paths = [
@@ -17,15 +46,19 @@ def main():
         BASE / 'Agri Market Dataset.csv',
         BASE / 'Price_Agriculture_commodities_Week.csv'
     ]
-    frames = []
-    for p in paths:
-        if p.exists():
-            try:
-                df = pd.read_csv(p)
-                df['__source'] = p.name
-                frames.append(df)
-            except Exception as e:
-                print('Failed reading', p, e)
+    def load(p):
+        try:
+            df = read_csv(p)
+            df['__source'] = p.name
+            return df
+        except Exception as e:
+            print('Failed reading', p, e)
+            return None
+
+    # The files are independent and pyarrow releases the GIL while parsing
+    existing = [p for p in paths if p.exists()]
+    with ThreadPoolExecutor(max_workers=max(1, len(existing))) as pool:
+        frames = [df for df in pool.map(load, existing) if df is not None]
     if not frames:
         print('No CSVs found, exiting.')
         return
@@ -34,18 +67,14 @@ def main():
     for df in frames:
         cols = {c.lower().strip(): c for c in df.columns}
         state = cols.get('state') or cols.get('state_name')
-        district = cols.get('district')
         commodity = cols.get('commodity') or cols.get('crop') or cols.get('product')
-        market = cols.get('market') or cols.get('market_name')
         modal = cols.get('modal_price') or cols.get('price') or cols.get('modal')
         arrival = cols.get('arrivals_in_qtl') or cols.get('arrival') or cols.get('arrivals')
         date = cols.get('arrival_date') or cols.get('date') or cols.get('week')
 
         nd = pd.DataFrame()
-        if commodity in df: nd['commodity'] = df[commodity].map(to_title)
-        if market in df: nd['market'] = df[market].map(to_title)
-        if state in df: nd['state'] = df[state].map(to_title)
-        if district in df: nd['district'] = df[district].map(to_title)
+        if commodity in df: nd['commodity'] = titles(df[commodity])
+        if state in df: nd['state'] = titles(df[state])
         if modal in df: nd['modal_price'] = pd.to_numeric(df[modal], errors='coerce')
         if arrival in df: nd['arrival_qtl'] = pd.to_numeric(df[arrival], errors='coerce')
         if date in df: nd['date'] = pd.to_datetime(df[date], errors='coerce', dayfirst=True)
@@ -53,6 +82,11 @@ def main():
 
     combined = pd.concat(norms, ignore_index=True)
     combined = combined.dropna(subset=['commodity'])
+    # Dictionary-encode the group keys: one copy of each name, and groupby
+    # works on integer codes
+    combined['commodity'] = combined['commodity'].astype('category')
+    if 'state' in combined.columns:
+        combined['state'] = combined['state'].astype('category')
     combined['month'] = combined['date'].dt.to_period('M')
 
     # Ensure numeric columns exist to avoid KeyError
@@ -61,33 +95,27 @@ def main():
     if 'modal_price' not in combined.columns:
         combined['modal_price'] = None
 
-    agg = combined.groupby(['commodity','state','month'], dropna=False).agg(
+    agg = combined.groupby(['commodity','state','month'], dropna=False, observed=True).agg(
         avg_modal=('modal_price','mean'),
         total_arrival=('arrival_qtl','sum')
     ).reset_index()
 
-    last3 = (agg.sort_values('month')
-               .groupby(['commodity','state'])
-               .tail(3)
-               .groupby(['commodity','state'])
-               .agg(momentum=('avg_modal', lambda s: (s.iloc[-1]-s.iloc[0])/(abs(s.iloc[0])+1e-6)))
-               .reset_index())
-    agg = agg.merge(last3, on=['commodity','state'], how='left')
-
-    advice = []
-    for (commodity, state), grp in agg.groupby(['commodity','state']):
-        g = grp.sort_values('month').tail(3)
-        if g.empty: continue
-        last_avg = g['avg_modal'].iloc[-1]
-        mom_raw = float(g['momentum'].iloc[0]) if 'momentum' in g and pd.notna(g['momentum'].iloc[0]) else 0.0
-        status = 'bullish' if mom_raw > 0.05 else ('bearish' if mom_raw < -0.05 else 'hold')
-        advice.append({
-            'commodity': commodity,
-            'state': state,
-            'last_avg_price': float(last_avg) if pd.notna(last_avg) else None,
-            'momentum': mom_raw,
-            'status': status
-        })
+    # Momentum over each group's last three months, from the first and last
+    # of those rows (NaN prices included, as positional picks)
+    keys = ['commodity','state']
+    last3 = agg.sort_values('month').groupby(keys).tail(3)
+    first = last3.drop_duplicates(keys, keep='first').set_index(keys)['avg_modal'].astype('float64')
+    # One row per commodity/state, in groupby order: its latest month
+    latest = last3.drop_duplicates(keys, keep='last').set_index(keys).sort_index()
+    last_avg = latest['avg_modal'].astype('float64')
+    momentum = ((last_avg - first) / (first.abs() + 1e-6)).fillna(0.0)
+    status = np.select([momentum > 0.05, momentum < -0.05], ['bullish', 'bearish'], 'hold')
+
+    advice = pd.DataFrame({
+        'last_avg_price': finite(last_avg),
+        'momentum': finite(momentum),
+        'status': status
+    }, index=latest.index).reset_index().to_dict(orient='records')
 
     out_dir = BASE / 'backend' / 'data'
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -96,21 +124,14 @@ def main():
         'advice_rows': len(advice),
         'advice': advice[:1000]
     }
-    # Ensure JSON has no NaN/inf
-    def sanitize(obj):
-        if isinstance(obj, dict):
-            return {k: sanitize(v) for k, v in obj.items()}
-        if isinstance(obj, list):
-            return [sanitize(x) for x in obj]
-        if isinstance(obj, float):
-            if pd.isna(obj) or obj == float('inf') or obj == float('-inf'):
-                return None
-        return obj
-
-    clean = sanitize(insights)
-    with open(out_dir / 'mandi_insights.json', 'w', encoding='utf-8') as f:
-        json.dump(clean, f, ensure_ascii=False)
-    print('Wrote', out_dir / 'mandi_insights.json')
+    out_path = out_dir / 'mandi_insights.json'
+    if ORJSON_AVAILABLE:
+        # UTF-8 bytes in one call, like ensure_ascii=False
+        out_path.write_bytes(orjson.dumps(insights))
+    else:
+        with open(out_path, 'w', encoding='utf-8') as f:
+            json.dump(insights, f, ensure_ascii=False)
+    print('Wrote', out_path)
 
 if __name__ == '__main__':
     main()
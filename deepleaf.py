@@ -4,10 +4,9 @@ import argparse
 import json
 import os
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
 
 import numpy as np
-from PIL import Image
 
 
 try:
@@ -15,27 +14,43 @@ try:
     from tensorflow.keras import layers, models
     from tensorflow.keras.applications import MobileNetV2
     from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-    from tensorflow.keras.preprocessing.image import ImageDataGenerator
     TF_AVAILABLE = True
 except ImportError as e:
     TF_AVAILABLE = False
     print(f"Warning: TensorFlow import failed: {e}")
 
-# Check for scipy (required by ImageDataGenerator)
-try:
-    import scipy
-except ImportError:
-    print("ERROR: scipy is required for ImageDataGenerator but not installed.")
-    print("Please install it: pip install scipy")
-    raise SystemExit(1)
-
 
 DEFAULT_IMG_SIZE = (224, 224)
 SUPPORTED_EXTS = {".jpg", ".jpeg", ".png"}
+VALIDATION_SPLIT = 0.2
+SEED = 42
+BRIGHTNESS_RANGE = (0.8, 1.2)
+# MobileNetV2 kernels are launch-bound at small batches on a GPU
+DEFAULT_BATCH_SIZE = 64
+# Adam learning rate tuned at batch 8, scaled linearly with the batch size
+BASE_LEARNING_RATE = 1e-3
+BASE_BATCH_SIZE = 8
+
+
+def iter_images(root: Path) -> Iterator[str]:
+    """
+    Paths of the supported images below root. Walks with os.scandir, whose
+    entries carry their file type, so no Path objects or extra stat calls
+    are made per file. Symlinked directories are not followed.
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTS:
+                    yield entry.path
 
 
-def list_images(root: Path) -> List[Path]:
-    return [p for p in root.rglob("*") if p.suffix.lower() in SUPPORTED_EXTS]
+def list_images(root: Path) -> List[str]:
+    """Paths of all supported images below root, ready for tf.io.read_file"""
+    return list(iter_images(root))
 
 
 def canonical_class_name(folder_name: str) -> str:
@@ -52,24 +67,58 @@ def canonical_class_name(folder_name: str) -> str:
 
 
 def get_class_mapping(dataset_root: Path) -> Dict[int, str]:
-    """Scan dataset to build class name to index mapping."""
-    class_name_set: Dict[str, int] = {}
-    image_paths = list_images(dataset_root)
-    
-    if not image_paths:
-        raise FileNotFoundError(f"No images found under: {dataset_root}")
+    """
+    Scan dataset to build class name to index mapping.
 
-    for img_path in image_paths:
-        label_folder = img_path.parent.name
-        cls_name = canonical_class_name(label_folder)
+    Classes are the top-level folders, in the same sorted order that training
+    labels them, so only the folder names are listed instead of walking
+    every image.
+    """
+    class_name_set: Dict[str, int] = {}
+    for class_dir in sorted(d for d in dataset_root.iterdir() if d.is_dir()):
+        # Stops at the folder's first image
+        if next(iter_images(class_dir), None) is None:
+            continue
+        cls_name = canonical_class_name(class_dir.name)
         if cls_name not in class_name_set:
             class_name_set[cls_name] = len(class_name_set)
-    
+
+    if not class_name_set:
+        raise FileNotFoundError(f"No images found under: {dataset_root}")
+
     idx_to_name = {idx: name for name, idx in class_name_set.items()}
     return idx_to_name
 
 
-def build_model(num_classes: int, img_size: Tuple[int, int]) -> "tf.keras.Model":
+def configure_mixed_precision(policy: str | None = None) -> str:
+    """
+    Set the Keras dtype policy for models built from here on and return it:
+    `policy` if given, else mixed_float16 on GPUs with Tensor Cores (compute
+    capability 7.0+), else float32. Under mixed_float16, compile() wraps the
+    optimizer in a LossScaleOptimizer by itself.
+    """
+    if policy is None:
+        policy = "float32"
+        gpus = tf.config.list_physical_devices("GPU")
+        if gpus:
+            details = tf.config.experimental.get_device_details(gpus[0])
+            if (details.get("compute_capability") or (0, 0)) >= (7, 0):
+                policy = "mixed_float16"
+    tf.keras.mixed_precision.set_global_policy(policy)
+    return policy
+
+
+def compile_model(model: "tf.keras.Model", batch_size: int) -> None:
+    """Adam at the batch-scaled learning rate; XLA-compiled steps on GPU"""
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=BASE_LEARNING_RATE * batch_size / BASE_BATCH_SIZE),
+        loss=tf.keras.losses.SparseCategoricalCrossentropy(),
+        metrics=["accuracy"],
+        jit_compile=bool(tf.config.list_physical_devices("GPU")),
+    )
+
+
+def build_model(num_classes: int, img_size: Tuple[int, int], batch_size: int = DEFAULT_BATCH_SIZE) -> "tf.keras.Model":
     if not TF_AVAILABLE:
         raise RuntimeError("TensorFlow is required to train the model.")
 
@@ -81,9 +130,10 @@ def build_model(num_classes: int, img_size: Tuple[int, int]) -> "tf.keras.Model"
         inputs = layers.Input(shape=input_shape)
         x = preprocess_input(inputs)
         x = base(x, training=False)
-        x = layers.GlobalAveragePooling2D()(x)
+        x = layers.GlobalAveragePooling2D(name="image_pool")(x)
         x = layers.Dropout(0.2)(x)
-        outputs = layers.Dense(num_classes, activation="softmax")(x)
+        # Softmax and the loss stay float32 under a mixed precision policy
+        outputs = layers.Dense(num_classes, activation="softmax", dtype="float32")(x)
         model = models.Model(inputs, outputs)
     except Exception:
         # Fallback small CNN
@@ -97,88 +147,156 @@ def build_model(num_classes: int, img_size: Tuple[int, int]) -> "tf.keras.Model"
             layers.GlobalAveragePooling2D(),
             layers.Dense(256, activation="relu"),
             layers.Dropout(0.3),
-            layers.Dense(num_classes, activation="softmax"),
+            layers.Dense(num_classes, activation="softmax", dtype="float32"),
         ])
 
-    model.compile(
-        optimizer=tf.keras.optimizers.Adam(learning_rate=1e-3),
-        loss=tf.keras.losses.SparseCategoricalCrossentropy(),
-        metrics=["accuracy"],
-    )
+    compile_model(model, batch_size)
     return model
 
 
+def load_datasets(
+    dataset_root: Path,
+    img_size: Tuple[int, int],
+    batch_size: int,
+    cache: str | None = None,
+    augment: bool = True,
+) -> Tuple["tf.data.Dataset", "tf.data.Dataset", List[str]]:
+    """
+    Training and validation tf.data pipelines over the class-per-folder
+    dataset, plus the folder names in label order. Images are decoded and
+    resized in parallel, augmented on tf.data's threads and prefetched, so
+    loading overlaps with the training step.
+
+    cache: None, "memory", or a file path prefix; the decoded images are then
+    kept (as uint8) after the first epoch instead of being decoded again.
+    augment: False leaves the training images unaugmented.
+    """
+    splits = []
+    for subset in ("training", "validation"):
+        # The seed makes both subsets use the same shuffled file split
+        splits.append(tf.keras.utils.image_dataset_from_directory(
+            str(dataset_root),
+            validation_split=VALIDATION_SPLIT,
+            subset=subset,
+            seed=SEED,
+            image_size=img_size,
+            batch_size=None,
+            label_mode="int",
+        ))
+    train_ds, val_ds = splits
+    class_names = train_ds.class_names
+
+    def to_uint8(image, label):
+        return tf.cast(tf.round(image), tf.uint8), label
+
+    if cache is not None:
+        prefix = "" if cache == "memory" else cache
+        train_ds = train_ds.map(to_uint8, num_parallel_calls=tf.data.AUTOTUNE).cache(prefix and prefix + "_train")
+        val_ds = val_ds.map(to_uint8, num_parallel_calls=tf.data.AUTOTUNE).cache(prefix and prefix + "_val")
+
+    # Same augmentation as the former ImageDataGenerator settings
+    augmentation = tf.keras.Sequential([
+        layers.RandomRotation(20 / 360, fill_mode="nearest"),
+        layers.RandomTranslation(0.2, 0.2, fill_mode="nearest"),
+        layers.RandomZoom(0.2, fill_mode="nearest"),
+        layers.RandomFlip("horizontal"),
+    ])
+
+    # Whole batches are cast and augmented at once; the layers draw their
+    # random transforms per image. Cached images stay uint8 until then
+    def augment_batch(images, labels):
+        images = tf.cast(augmentation(tf.cast(images, tf.float32), training=True), tf.float32)
+        images = images * tf.random.uniform([tf.shape(images)[0], 1, 1, 1], *BRIGHTNESS_RANGE)
+        return tf.clip_by_value(images, 0.0, 255.0), labels
+
+    # The model's preprocess_input takes float pixels in 0-255
+    def to_float(images, labels):
+        return tf.cast(images, tf.float32), labels
+
+    if augment:
+        train_ds = (
+            train_ds.shuffle(1024, seed=SEED, reshuffle_each_iteration=True)
+            .batch(batch_size)
+            .map(augment_batch, num_parallel_calls=tf.data.AUTOTUNE)
+        )
+    else:
+        train_ds = train_ds.batch(batch_size).map(to_float, num_parallel_calls=tf.data.AUTOTUNE)
+    train_ds = train_ds.prefetch(tf.data.AUTOTUNE)
+    val_ds = (
+        val_ds.batch(batch_size)
+        .map(to_float, num_parallel_calls=tf.data.AUTOTUNE)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+    return train_ds, val_ds, class_names
+
+
+def split_at_pool(model: "tf.keras.Model", batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    (feature_model, head_model) sharing the model's layers, split after the
+    pooled MobileNetV2 features; None for the fallback CNN.
+    """
+    try:
+        pool = model.get_layer("image_pool")
+    except ValueError:
+        return None
+    feature_model = models.Model(model.input, pool.output)
+    features = layers.Input(shape=pool.output.shape[1:])
+    x = features
+    for layer in model.layers[model.layers.index(pool) + 1:]:
+        x = layer(x)
+    head_model = models.Model(features, x)
+    compile_model(head_model, batch_size)
+    return feature_model, head_model
+
+
+def extract_features(feature_model: "tf.keras.Model", dataset: "tf.data.Dataset") -> Tuple[np.ndarray, np.ndarray]:
+    """Pooled features and labels of every image in the dataset, one backbone pass"""
+    features, labels = [], []
+    for images, batch_labels in dataset:
+        features.append(feature_model.predict_on_batch(images))
+        labels.append(batch_labels.numpy())
+    return np.concatenate(features), np.concatenate(labels)
+
+
 def train(
     dataset_root: Path,
     out_dir: Path,
     img_size: Tuple[int, int] = DEFAULT_IMG_SIZE,
     epochs: int = 5,
-    batch_size: int = 8,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    cache: str | None = None,
+    cache_features: bool = False,
+    mixed_precision: str | None = None,
 ) -> None:
-    """Train model using memory-efficient generators."""
+    """Train model on tf.data pipelines that stream images from disk."""
     if not TF_AVAILABLE:
         raise RuntimeError("TensorFlow is required to train the model.")
-    
-    # Build model (will update num_classes after generator creates mapping)
-    # Start with a placeholder, will rebuild if needed
-    model = build_model(num_classes=10, img_size=img_size)  # Placeholder
-    
-    # Use ImageDataGenerator for memory-efficient loading
-    # This loads images on-the-fly instead of loading all into memory
-    train_datagen = ImageDataGenerator(
-        rotation_range=20,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        horizontal_flip=True,
-        zoom_range=0.2,
-        brightness_range=[0.8, 1.2],
-        validation_split=0.2  # 20% for validation
-    )
-    
-    val_datagen = ImageDataGenerator(validation_split=0.2)
-    
-    print("Creating data generators (this may take a moment)...")
-    # Note: flow_from_directory expects subdirectories with class names
+
+    print(f"Dtype policy: {configure_mixed_precision(mixed_precision)}")
+    # One class per folder, as image_dataset_from_directory labels them, so
+    # the model (and whether it can be split) is known before the pipelines
+    # are built
+    num_classes = len([d for d in dataset_root.iterdir() if d.is_dir()])
+
+    print(f"Building model for {num_classes} classes...")
+    model = build_model(num_classes=num_classes, img_size=img_size, batch_size=batch_size)
+
+    split = split_at_pool(model, batch_size) if cache_features else None
+    if cache_features and split is None:
+        print("MobileNetV2 unavailable: training on images without cached features")
+
+    print("Creating input pipelines (this may take a moment)...")
+    # Note: image_dataset_from_directory expects subdirectories with class names
     # Our dataset structure matches this (e.g., Dataset/Tomato___Leaf_blight/)
-    train_generator = train_datagen.flow_from_directory(
-        str(dataset_root),
-        target_size=img_size,
-        batch_size=batch_size,
-        class_mode='sparse',  # For integer labels
-        subset='training',
-        shuffle=True,
-        seed=42
-    )
-    
-    val_generator = val_datagen.flow_from_directory(
-        str(dataset_root),
-        target_size=img_size,
-        batch_size=batch_size,
-        class_mode='sparse',
-        subset='validation',
-        shuffle=False,
-        seed=42
-    )
-    
-    # Get class mapping from generator (folder_name -> generator_index)
-    # The generator assigns indices 0, 1, 2, ... to folders alphabetically
-    generator_class_indices = train_generator.class_indices
-    num_classes = len(generator_class_indices)
-    
-    print(f"Found {num_classes} classes in dataset")
-    
-    # Create idx_to_name mapping: generator_index -> canonical_name
+    # Cached features are computed from unaugmented images
+    train_ds, val_ds, class_names = load_datasets(dataset_root, img_size, batch_size, cache, augment=split is None)
+
+    print(f"Found {len(class_names)} classes in dataset")
+
+    # Create idx_to_name mapping: label index (folders in alphabetical order) -> canonical_name
     # We'll use canonical names for consistency
-    idx_to_name = {}
-    for folder_name, gen_idx in sorted(generator_class_indices.items(), key=lambda x: x[1]):
-        canonical = canonical_class_name(folder_name)
-        idx_to_name[gen_idx] = canonical
-    
-    # Rebuild model with correct number of classes
-    print(f"Building model for {num_classes} classes...")
-    model = build_model(num_classes=num_classes, img_size=img_size)
-    
-    print(f"Training with {train_generator.samples} training samples, {val_generator.samples} validation samples")
+    idx_to_name = {idx: canonical_class_name(folder_name) for idx, folder_name in enumerate(class_names)}
+
     print(f"Batch size: {batch_size}, Epochs: {epochs}")
 
     callbacks = [
@@ -196,19 +314,31 @@ def train(
         ),
     ]
 
-    steps_per_epoch = max(1, train_generator.samples // batch_size)
-    validation_steps = max(1, val_generator.samples // batch_size)
-    
     print("\nStarting training...")
-    model.fit(
-        train_generator,
-        steps_per_epoch=steps_per_epoch,
-        validation_data=val_generator,
-        validation_steps=validation_steps,
-        epochs=epochs,
-        callbacks=callbacks,
-        verbose=2,
-    )
+    if split is not None:
+        # The backbone stays frozen, so its pooled features are computed once
+        # and only the classifier head is trained on them
+        feature_model, head_model = split
+        print("Extracting MobileNetV2 features...")
+        train_features, train_labels = extract_features(feature_model, train_ds)
+        val_features, val_labels = extract_features(feature_model, val_ds)
+        head_model.fit(
+            train_features,
+            train_labels,
+            batch_size=batch_size,
+            validation_data=(val_features, val_labels),
+            epochs=epochs,
+            callbacks=callbacks[:1],  # ModelCheckpoint would save the head alone
+            verbose=2,
+        )
+    else:
+        model.fit(
+            train_ds,
+            validation_data=val_ds,
+            epochs=epochs,
+            callbacks=callbacks,
+            verbose=2,
+        )
 
     out_dir.mkdir(parents=True, exist_ok=True)
     model_path = out_dir / "deepleaf_model.h5"
@@ -227,8 +357,16 @@ def main():
     parser.add_argument("--data", type=str, default=str(Path("Dataset")), help="Dataset root folder")
     parser.add_argument("--out", type=str, default=str(Path("backend")/"models"), help="Output models folder")
     parser.add_argument("--epochs", type=int, default=5)
-    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="The learning rate scales linearly with it (1e-3 at batch 8)")
     parser.add_argument("--img-size", nargs=2, type=int, default=list(DEFAULT_IMG_SIZE))
+    parser.add_argument("--cache", type=str, default=None,
+                        help="Keep decoded images after the first epoch: 'memory' or a cache file path prefix")
+    parser.add_argument("--mixed-precision", type=str, default=os.environ.get("MIXED_PRECISION"),
+                        help="Keras dtype policy, e.g. mixed_bfloat16 on CPUs with AMX / AVX512-BF16 "
+                             "(default: mixed_float16 on Tensor Core GPUs, float32 otherwise)")
+    parser.add_argument("--cache-features", action="store_true",
+                        help="Compute the frozen MobileNetV2 features once and train only the head (no augmentation)")
     args = parser.parse_args()
 
     data_root = Path(args.data).expanduser().resolve()
@@ -241,7 +379,8 @@ def main():
     print(f"Dataset: {data_root}")
     print(f"Output:  {out_dir}")
     print(f"Image size: {img_size}")
-    train(data_root, out_dir, img_size=img_size, epochs=args.epochs, batch_size=args.batch_size)
+    train(data_root, out_dir, img_size=img_size, epochs=args.epochs, batch_size=args.batch_size, cache=args.cache,
+          cache_features=args.cache_features, mixed_precision=args.mixed_precision)
 
 
 if __name__ == "__main__":
@@ -36,21 +36,6 @@ if ($LASTEXITCODE -ne 0) {
     Write-Host "TensorFlow is already installed" -ForegroundColor Green
 }
 
-# Check if scipy is installed (required for ImageDataGenerator)
-Write-Host "Checking scipy installation..." -ForegroundColor Yellow
-$scipyCheck = python -c "import scipy; print('OK')" 2>&1
-if ($LASTEXITCODE -ne 0) {
-    Write-Host "Installing scipy (required for image processing)..." -ForegroundColor Yellow
-    python -m pip install scipy --quiet
-    if ($LASTEXITCODE -ne 0) {
-        Write-Host "Failed to install scipy. Please install manually: pip install scipy" -ForegroundColor Red
-        exit 1
-    }
-    Write-Host "scipy installed successfully" -ForegroundColor Green
-} else {
-    Write-Host "scipy is already installed" -ForegroundColor Green
-}
-
 # Create models directory if it doesn't exist
 $modelsDir = "backend\models"
 if (-not (Test-Path $modelsDir)) {